@@ -1,22 +1,44 @@
 # backend/app/api/upload.py
 
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request
 # Sửa lại import JSONResponse
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import shutil
+import json
 import os
 import uuid
 import logging
-import aiofiles
-# Đảm bảo import đúng đường dẫn tới hàm process_video
+import asyncio
+from typing import Optional
+# Đảm bảo import đúng đường dẫn tới scheduler render
 try:
-    from app.services.video_processing import process_video
+    from app.models.file_models import AssetCheckRequest, AssetRenderRequest
+    from app.services import metrics
+    from app.services.asset_store import AssetNotFound, asset_store, is_asset_id
+    from app.services.job_scheduler import render_scheduler
+    from app.services.clip_cache import clip_cache
+    from app.services.media_probe import audio_analysis_cache
+    from app.services.job_store import JOB_STATUSES, RESULTS_MAX_PAGE_SIZE, RESULTS_PAGE_SIZE, job_store
+    from app.services.storage_manager import OUTPUT_DIR, STORAGE_SWEEP_INTERVAL, UPLOAD_DIR, storage_manager
+    from app.services.subtitles import SUBTITLE_MODES
+    from app.services.video_processing import HLS_PLAYLIST_NAME
+    from app.utils.file_helper import save_upload_stream
 except ImportError:
     import sys
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
     if project_root not in sys.path:
         sys.path.append(project_root)
-    from app.services.video_processing import process_video
+    from app.models.file_models import AssetCheckRequest, AssetRenderRequest
+    from app.services import metrics
+    from app.services.asset_store import AssetNotFound, asset_store, is_asset_id
+    from app.services.job_scheduler import render_scheduler
+    from app.services.clip_cache import clip_cache
+    from app.services.media_probe import audio_analysis_cache
+    from app.services.job_store import JOB_STATUSES, RESULTS_MAX_PAGE_SIZE, RESULTS_PAGE_SIZE, job_store
+    from app.services.storage_manager import OUTPUT_DIR, STORAGE_SWEEP_INTERVAL, UPLOAD_DIR, storage_manager
+    from app.services.subtitles import SUBTITLE_MODES
+    from app.services.video_processing import HLS_PLAYLIST_NAME
+    from app.utils.file_helper import save_upload_stream
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,33 +49,81 @@ router = APIRouter(
     tags=["Video Processing"]
 )
 
-# --- Định nghĩa các thư mục một cách rõ ràng hơn ---
-BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-UPLOAD_DIR = os.path.join(BACKEND_ROOT, "temp_uploads")
-OUTPUT_DIR = os.path.join(BACKEND_ROOT, "temp_outputs")
-
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# --- Thư mục upload/output do storage manager quản lý (TTL, quota, dung lượng trống) ---
 logger.info(f"Absolute Upload directory: {os.path.abspath(UPLOAD_DIR)}")
 logger.info(f"Absolute Output directory: {os.path.abspath(OUTPUT_DIR)}")
 
+# Kích thước khối khi ghi upload và số file được ghi đồng thời trong MỘT request (mỗi request có
+# semaphore riêng, nên một client upload nhiều file không chặn client khác).
+# -> bộ đệm ghi của một request ~ UPLOAD_CHUNK_SIZE * UPLOAD_WRITE_CONCURRENCY;
+#    toàn server ~ giá trị đó * số request upload đang chạy đồng thời.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+UPLOAD_WRITE_CONCURRENCY = max(1, int(os.environ.get("UPLOAD_WRITE_CONCURRENCY", 4)))
+
+# Render trước một bản preview độ phân giải thấp (xem /api/preview/{job_id})
+PREVIEW_ENABLED = os.environ.get("PREVIEW_ENABLED", "1") == "1"
+PREVIEW_PREFIX = "preview_"
+
+# Thêm bản HLS (playlist + segment) bên cạnh MP4; client có thể bật cho từng job qua form field `hls`
+HLS_OUTPUT_DEFAULT = os.environ.get("HLS_OUTPUT", "0") == "1"
+HLS_PREFIX = "hls_"
+HLS_MEDIA_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".ts": "video/mp2t"}
+
+
+async def _save_upload(upload: UploadFile, path: str) -> tuple[int, str]:
+    """Stream one upload to disk in chunks, hashing it as it is written."""
+    with metrics.span('upload_write', filename=upload.filename):
+        size, digest = await save_upload_stream(upload, path, UPLOAD_CHUNK_SIZE)
+    metrics.bytes_processed.inc(size, kind='upload')
+    logger.info(f"Saved file: {path} ({size} bytes, sha256={digest[:12]})")
+    return size, digest
+
+
+async def _save_uploads(uploads_to_save: list[tuple[UploadFile, str]]) -> list[tuple[int, str]]:
+    """
+    Ghi các file của một request đồng thời, tối đa UPLOAD_WRITE_CONCURRENCY file cùng lúc.
+    Một file lỗi thì hủy các file còn lại (file ghi dở được save_upload_stream xóa) rồi raise lại lỗi.
+    """
+    write_semaphore = asyncio.Semaphore(UPLOAD_WRITE_CONCURRENCY) # Riêng cho request này
+
+    async def save(upload: UploadFile, path: str) -> tuple[int, str]:
+        async with write_semaphore:
+            return await _save_upload(upload, path)
+
+    tasks = [asyncio.ensure_future(save(upload, path)) for upload, path in uploads_to_save]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 # --- Endpoint để Upload và Xử lý ---
 @router.post("/upload")
 async def upload_and_process_files(
-    background_tasks: BackgroundTasks,
     audio: UploadFile = File(..., description="Audio file (MP3, WAV, etc.)"),
     srt: UploadFile = File(..., description="SRT subtitle file"),
-    videos: list[UploadFile] = File(..., description="List of short video clips")
+    videos: list[UploadFile] = File(..., description="List of short video clips"),
+    subtitle_mode: Optional[str] = Form(None, description="burn | soft | selective (mặc định theo SUBTITLE_MODE)"),
+    hls: Optional[bool] = Form(None, description="Thêm bản HLS để phát trong lúc render (mặc định theo HLS_OUTPUT)")
 ):
     """
-    Uploads audio, SRT, and video files, then processes them
-    in the background to generate a combined video.
+    Uploads audio, SRT, and video files, then queues them on the
+    render scheduler to generate a combined video.
     (Endpoint: /api/upload)
     """
+    if subtitle_mode is not None and subtitle_mode not in SUBTITLE_MODES:
+        raise HTTPException(status_code=400, detail=f"subtitle_mode phải là một trong: {', '.join(SUBTITLE_MODES)}")
+    # Ổ đĩa gần đầy: từ chối trước khi ghi upload
+    if not await asyncio.to_thread(storage_manager.has_free_space):
+        raise _insufficient_space_error()
+
     session_id = str(uuid.uuid4())
     session_upload_dir = os.path.join(UPLOAD_DIR, session_id)
     os.makedirs(session_upload_dir, exist_ok=True)
+    storage_manager.protect(session_upload_dir) # Giữ input cho tới khi job kết thúc
     logger.info(f"Created session upload directory: {session_upload_dir}")
 
     saved_audio_path = ""
@@ -62,27 +132,15 @@ async def upload_and_process_files(
     files_to_cleanup_on_error = [session_upload_dir]
 
     try:
-        # --- Save audio asynchronously ---
+        if not videos:
+            raise HTTPException(status_code=400, detail="Không có file video nào được tải lên.")
+
+        # --- Chuẩn bị đường dẫn cho audio, srt và các video ---
         safe_audio_filename = f"audio_{session_id}_{audio.filename}"
         saved_audio_path = os.path.abspath(os.path.join(session_upload_dir, safe_audio_filename))
-        async with aiofiles.open(saved_audio_path, "wb") as f:
-            content = await audio.read()
-            await f.write(content)
-        logger.info(f"Saved audio file: {saved_audio_path}")
-        files_to_cleanup_on_error.append(saved_audio_path)
-
-        # --- Save srt asynchronously ---
         safe_srt_filename = f"srt_{session_id}_{srt.filename}"
         saved_srt_path = os.path.abspath(os.path.join(session_upload_dir, safe_srt_filename))
-        async with aiofiles.open(saved_srt_path, "wb") as f:
-            content = await srt.read()
-            await f.write(content)
-        logger.info(f"Saved SRT file: {saved_srt_path}")
-        files_to_cleanup_on_error.append(saved_srt_path)
-
-        # --- Save all video files asynchronously ---
-        if not videos:
-            raise HTTPException(status_code=400, detail="Không có file video nào được tải lên.")
+        uploads_to_save = [(audio, saved_audio_path), (srt, saved_srt_path)]
 
         for video in videos:
             if not video.filename:
@@ -90,74 +148,349 @@ async def upload_and_process_files(
                  continue
             safe_video_filename = f"video_{uuid.uuid4()}_{video.filename}"
             video_path = os.path.abspath(os.path.join(session_upload_dir, safe_video_filename))
-            async with aiofiles.open(video_path, "wb") as f:
-                content = await video.read()
-                await f.write(content)
             saved_video_paths.append(video_path)
-            logger.info(f"Saved video file: {video_path}")
-            files_to_cleanup_on_error.append(video_path)
+            uploads_to_save.append((video, video_path))
 
         if not saved_video_paths:
              raise HTTPException(status_code=400, detail="Không thể lưu file video hoặc không có video hợp lệ.")
 
-        # --- Define final output path (absolute path) ---
-        output_filename = f"output_{session_id}.mp4"
-        final_output_path = os.path.abspath(os.path.join(OUTPUT_DIR, output_filename))
-
-        # --- Run processing in background ---
-        logger.info(f"Scheduling background task 'process_video' with correct parameters...")
-        # ... (log các path như trước) ...
-        background_tasks.add_task(
-            process_video,
-            saved_audio_path,
-            saved_video_paths,
-            saved_srt_path,
-            final_output_path
-        )
-
-        # --- Return 202 Accepted response ---
-        # Sử dụng JSONResponse để đặt status code là 202
-        return JSONResponse(
-            status_code=202, # Explicitly set 202 Accepted
-            content={
-                "message": "Yêu cầu xử lý video đã được nhận và đang chạy ngầm.",
-                "detail": "Quá trình có thể mất vài phút. Vui lòng đợi...",
-                "output_filename": output_filename
-            }
-        )
+        # --- Ghi tất cả các phần đồng thời, theo từng khối, tính hash trong lúc ghi ---
+        files_to_cleanup_on_error.extend(path for _, path in uploads_to_save)
+        results = await _save_uploads(uploads_to_save)
+        content_hashes = {path: digest for (_, path), (_, digest) in zip(uploads_to_save, results)}
+        total_bytes = sum(size for size, _ in results)
+        logger.info(f"Saved {len(uploads_to_save)} files ({total_bytes} bytes) for session {session_id}")
+
+        return await _queue_render_job(session_id, saved_audio_path, saved_video_paths, saved_srt_path,
+                                       content_hashes, total_bytes, subtitle_mode, hls)
 
     except Exception as e:
         logger.exception("Error during file saving or task scheduling.")
+        storage_manager.release(session_upload_dir, delete=False)
+        storage_manager.release(os.path.join(OUTPUT_DIR, f"{HLS_PREFIX}{session_id}"), delete=False)
         cleanup_files_sync(files_to_cleanup_on_error)
         raise HTTPException(status_code=500, detail=f"Lỗi máy chủ nội bộ khi chuẩn bị xử lý: {e}")
 
 
+async def _queue_render_job(session_id: str, audio_path: str, video_paths: list[str], srt_path: str,
+                            content_hashes: dict, input_bytes: int, subtitle_mode: Optional[str],
+                            hls: Optional[bool]) -> JSONResponse:
+    """Đưa một job render vào scheduler (dùng chung cho /upload và /jobs) và trả về 202."""
+    # --- Define final output path (absolute path) ---
+    output_filename = f"output_{session_id}.mp4"
+    final_output_path = os.path.abspath(os.path.join(OUTPUT_DIR, output_filename))
+
+    # --- Đưa job vào hàng đợi render (process pool giới hạn) ---
+    logger.info(f"Queueing render job {session_id} on the job scheduler...")
+    render_params = {
+        "audio_path": audio_path,
+        "video_paths": video_paths,
+        "srt_path": srt_path,
+        "output_final_path": final_output_path,
+        "content_hashes": content_hashes,
+    }
+    if subtitle_mode is not None:
+        render_params["subtitle_mode"] = subtitle_mode
+    if PREVIEW_ENABLED:
+        render_params["preview_output_path"] = os.path.abspath(os.path.join(OUTPUT_DIR, f"{PREVIEW_PREFIX}{session_id}.mp4"))
+    if HLS_OUTPUT_DEFAULT if hls is None else hls:
+        hls_output_dir = os.path.abspath(os.path.join(OUTPUT_DIR, f"{HLS_PREFIX}{session_id}"))
+        storage_manager.protect(hls_output_dir) # Playlist đang được ghi trong lúc render
+        render_params["hls_output_dir"] = hls_output_dir
+    job = render_scheduler.submit(session_id, render_params)
+    try:
+        await asyncio.to_thread(job_store.save, job, input_bytes)
+    except Exception as e: # Job đã vào hàng đợi; store sẽ được cập nhật khi job bắt đầu/kết thúc
+        logger.warning(f"Could not record job {session_id} in job store: {e}")
+
+    # --- Return 202 Accepted response ---
+    # Sử dụng JSONResponse để đặt status code là 202
+    return JSONResponse(
+        status_code=202, # Explicitly set 202 Accepted
+        content={
+            "message": "Yêu cầu xử lý video đã được nhận và đang chạy ngầm.",
+            "detail": "Quá trình có thể mất vài phút. Vui lòng đợi...",
+            "output_filename": output_filename,
+            "job_id": session_id,
+            "queue_position": render_scheduler.queue_position(session_id)
+        }
+    )
+
+
+def _insufficient_space_error() -> HTTPException:
+    # Client thử lại sau lần dọn dẹp kế tiếp
+    return HTTPException(
+        status_code=503,
+        detail="Máy chủ tạm thời không đủ dung lượng đĩa, vui lòng thử lại sau.",
+        headers={"Retry-After": str(int(STORAGE_SWEEP_INTERVAL))},
+    )
+
+
+# --- Thư viện asset: kiểm tra hash, upload phần còn thiếu, tạo job từ asset ID ---
+@router.post("/assets/check")
+async def check_assets(request: AssetCheckRequest):
+    """
+    Given the SHA-256 of the files a client is about to send, returns which ones are
+    already stored, so only the missing blobs need to be uploaded.
+    """
+    hashes = [value.lower() for value in request.hashes]
+    invalid = [value for value in hashes if not is_asset_id(value)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Hash SHA-256 không hợp lệ: {', '.join(invalid[:10])}")
+    existing = await asyncio.to_thread(asset_store.existing, hashes)
+    return {
+        "present": [value for value in dict.fromkeys(hashes) if value in existing],
+        "missing": [value for value in dict.fromkeys(hashes) if value not in existing],
+    }
+
+
+@router.post("/assets")
+async def upload_asset(
+    file: UploadFile = File(..., description="Một file media hoặc SRT"),
+    sha256: Optional[str] = Form(None, description="SHA-256 mong đợi; sai lệch thì upload bị từ chối"),
+):
+    """
+    Stores one blob in the content-addressed asset library. Returns 201 with the asset ID
+    (its SHA-256), or 200 if identical content was already stored.
+    """
+    expected = sha256.lower() if sha256 else None
+    if expected is not None and not is_asset_id(expected):
+        raise HTTPException(status_code=400, detail="sha256 không hợp lệ.")
+    if expected is not None:
+        known = await asyncio.to_thread(asset_store.get, expected)
+        if known is not None:
+            return JSONResponse(status_code=200, content={**known, "created": False})
+    if not await asyncio.to_thread(storage_manager.has_free_space):
+        raise _insufficient_space_error()
+
+    incoming_path = asset_store.incoming_path()
+    try:
+        size, digest = await _save_upload(file, incoming_path)
+        if expected is not None and digest != expected:
+            raise HTTPException(status_code=400, detail=f"Nội dung không khớp sha256 (nhận được {digest}).")
+        asset = await asyncio.to_thread(asset_store.add, incoming_path, digest, size, file.filename)
+    except Exception:
+        cleanup_files_sync([incoming_path])
+        raise
+    return JSONResponse(status_code=201 if asset["created"] else 200, content=asset)
+
+
+@router.get("/assets/{asset_id}")
+async def get_asset(asset_id: str):
+    """
+    Returns the metadata and reference count of a stored asset.
+    """
+    asset = await asyncio.to_thread(asset_store.get, asset_id.lower()) if is_asset_id(asset_id.lower()) else None
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy asset.")
+    return asset
+
+
+@router.post("/jobs")
+async def create_job_from_assets(request: AssetRenderRequest):
+    """
+    Queues a render job whose inputs are assets already in the library (no file upload).
+    Returns 409 with the missing asset IDs if any of them is not stored (anymore).
+    """
+    if request.subtitle_mode is not None and request.subtitle_mode not in SUBTITLE_MODES:
+        raise HTTPException(status_code=400, detail=f"subtitle_mode phải là một trong: {', '.join(SUBTITLE_MODES)}")
+    audio_id, srt_id = request.audio.lower(), request.srt.lower()
+    video_ids = [value.lower() for value in request.videos]
+    asset_ids = [audio_id, srt_id, *video_ids]
+    invalid = [value for value in asset_ids if not is_asset_id(value)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Asset ID không hợp lệ: {', '.join(invalid[:10])}")
+
+    session_id = str(uuid.uuid4())
+    try:
+        paths = await asyncio.to_thread(asset_store.acquire, session_id, asset_ids)
+    except AssetNotFound as e:
+        raise HTTPException(status_code=409, detail={"message": "Thiếu asset, hãy upload lại.", "missing": e.missing})
+    try:
+        input_bytes = await asyncio.to_thread(lambda: sum(os.path.getsize(path) for path in paths.values()))
+        return await _queue_render_job(
+            session_id, paths[audio_id], [paths[value] for value in video_ids], paths[srt_id],
+            {path: value for value, path in paths.items()}, input_bytes, request.subtitle_mode, request.hls)
+    except Exception as e:
+        logger.exception("Error while queueing a job from assets.")
+        await asyncio.to_thread(asset_store.release_job, session_id)
+        raise HTTPException(status_code=500, detail=f"Lỗi máy chủ nội bộ khi chuẩn bị xử lý: {e}")
+
+
+# --- Endpoint để xem trạng thái job render ---
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Returns the scheduler status of a render job, including its queue position.
+    """
+    job = render_scheduler.get(job_id)
+    if job is not None:
+        return _job_payload(job)
+    # Job đã bị scheduler xóa khỏi bộ nhớ (hoặc từ lần chạy server trước) -> đọc từ store
+    record = await asyncio.to_thread(job_store.get, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+    return _record_payload(record)
+
+
+def _job_payload(job) -> dict:
+    """Trạng thái job trả cho client (không lộ đường dẫn tuyệt đối trên server)."""
+    payload = {**job.to_dict(), "queue_position": render_scheduler.queue_position(job.job_id)}
+    payload.pop("output_path", None)
+    payload.pop("preview_path", None)
+    payload["preview_url"] = f"/api/preview/{job.job_id}" if job.preview_path else None
+    hls_output_dir = job.params.get("hls_output_dir")
+    # Playlist xuất hiện ngay khi segment đầu tiên được ghi (single-pass) hoặc khi đóng gói xong
+    payload["hls_url"] = (
+        f"/api/hls/{job.job_id}/{HLS_PLAYLIST_NAME}"
+        if hls_output_dir and os.path.isfile(os.path.join(hls_output_dir, HLS_PLAYLIST_NAME)) else None
+    )
+    return payload
+
+
+def _record_payload(record: dict) -> dict:
+    """Một job trong store, định dạng như _job_payload (không có tiến độ chi tiết)."""
+    payload = {key: value for key, value in record.items() if key != "output_deleted"}
+    payload.update({
+        "progress": {},
+        "queue_position": None,
+        "preview_ready": False,
+        "preview_url": None,
+        "hls_url": None,
+        "output_available": record["status"] == "completed" and not record["output_deleted"],
+    })
+    return payload
+
+
+# --- Endpoint tải bản preview ---
+@router.get("/preview/{job_id}")
+async def download_preview(job_id: str):
+    """
+    Returns the low-resolution preview of a job once it is ready,
+    while the full-quality render continues in the background.
+    """
+    job = render_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+    if not job.preview_path or not os.path.isfile(job.preview_path):
+        raise HTTPException(status_code=404, detail="Bản preview chưa sẵn sàng.")
+    return FileResponse(path=job.preview_path, filename=os.path.basename(job.preview_path), media_type='video/mp4')
+
+
+# --- Endpoint phát HLS ---
+@router.get("/hls/{job_id}/{file_name}")
+async def download_hls(job_id: str, file_name: str):
+    """
+    Serves the HLS playlist and segments of a job. The playlist is an EVENT playlist,
+    so players can start while the render is still appending segments.
+    """
+    for part in (job_id, file_name):
+        if ".." in part or "/" in part or "\\" in part:
+            raise HTTPException(status_code=400, detail="Tên file không hợp lệ.")
+    media_type = HLS_MEDIA_TYPES.get(os.path.splitext(file_name)[1])
+    if media_type is None:
+        raise HTTPException(status_code=400, detail="Tên file không hợp lệ.")
+    file_path = os.path.join(OUTPUT_DIR, f"{HLS_PREFIX}{job_id}", file_name)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Không tìm thấy file được yêu cầu.")
+    # Playlist thay đổi trong lúc render; segment thì không bao giờ đổi
+    cache_control = "no-cache" if file_name == HLS_PLAYLIST_NAME else "public, max-age=86400"
+    return FileResponse(path=file_path, media_type=media_type, headers={"Cache-Control": cache_control})
+
+
+# --- Endpoint từ chối preview: hủy render bản chính ---
+@router.post("/preview/{job_id}/reject")
+async def reject_preview(job_id: str):
+    """
+    Rejects the preview of a job: cancels the full-quality render (queued or running)
+    so no more CPU is spent on it, and deletes the preview file.
+    """
+    job = render_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+    if not render_scheduler.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job đã kết thúc ({job.status}), không thể hủy.")
+    if job.preview_path:
+        cleanup_files_sync([job.preview_path])
+    return {"message": "Đã hủy render bản chính.", "job_id": job_id}
+
+
+# --- Endpoint hủy job render ---
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancels a queued or running render job. A running job's ffmpeg process tree is killed;
+    temp files, the preview and HLS output are removed once the worker has stopped.
+    """
+    job = render_scheduler.get(job_id)
+    if job is None:
+        record = await asyncio.to_thread(job_store.get, job_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+        raise HTTPException(status_code=409, detail=f"Job đã kết thúc ({record['status']}), không thể hủy.")
+    if not render_scheduler.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job đã kết thúc ({job.status}), không thể hủy.")
+    return JSONResponse(status_code=202, content={"message": "Đã yêu cầu hủy job.", "job_id": job_id, "status": job.status})
+
+
+# Chu kỳ (giây) kiểm tra tiến độ job khi đẩy qua SSE
+JOB_EVENTS_INTERVAL = float(os.environ.get("JOB_EVENTS_INTERVAL", 0.5))
+
+
+# --- Endpoint đẩy tiến độ job qua Server-Sent Events ---
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    Streams job status and progress (stage, percent, fps, ETA) as Server-Sent Events
+    until the job completes or fails. Replaces polling /api/check.
+    """
+    if render_scheduler.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+
+    async def event_stream():
+        last_payload = None
+        while not await request.is_disconnected():
+            job = render_scheduler.get(job_id)
+            if job is None:
+                break
+            payload = _job_payload(job)
+            if payload != last_payload:
+                last_payload = payload
+                yield f"event: {job.status}\ndata: {json.dumps(payload)}\n\n"
+            if job.finished:
+                break
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- Endpoint để kiểm tra trạng thái file ---
 @router.get("/check/{file_name}")
 async def check_file_status(file_name: str):
     """
     Checks if the generated output file exists and is ready.
+    Reads the job store instead of stat-ing the output directory.
     """
-    logger.info(f"Checking status for filename: {file_name}")
     if ".." in file_name or file_name.startswith(("/", "\\")):
         logger.warning(f"Invalid filename check attempt: {file_name}")
         raise HTTPException(status_code=400, detail="Tên file không hợp lệ.")
 
-    file_path = os.path.abspath(os.path.join(OUTPUT_DIR, file_name))
-    logger.info(f"Checking existence of: {file_path}")
-
-    if os.path.exists(file_path) and os.path.isfile(file_path) and os.path.getsize(file_path) > 0:
-        logger.info(f"File {file_name} exists and is ready.")
-        return {"ready": True, "filename": file_name}
-    else:
-        # Log chi tiết hơn lý do chưa sẵn sàng
-        if not os.path.exists(file_path):
-             logger.info(f"File {file_name} not found yet.")
-        elif not os.path.isfile(file_path):
-             logger.warning(f"Path exists but is not a file: {file_path}")
-        else: # File tồn tại nhưng size = 0
-             logger.warning(f"File {file_name} exists but size is 0. Assuming not ready.")
-        return {"ready": False, "filename": file_name}
+    record = await asyncio.to_thread(job_store.find_output, file_name)
+    if record is None:
+        logger.info(f"File {file_name} not found in job store.")
+        return {"ready": False, "filename": file_name, "status": None}
+    ready = record["status"] == "completed" and not record["output_deleted"]
+    return {
+        "ready": ready,
+        "filename": file_name,
+        "status": record["status"],
+        "size": record["output_bytes"] if ready else None,
+        "error": record["error"],
+    }
 
 
 # --- Endpoint để Download file kết quả ---
@@ -165,6 +498,8 @@ async def check_file_status(file_name: str):
 async def download_file(file_name: str):
     """
     Downloads the generated video file.
+    FileResponse answers Range requests (206 Partial Content), and outputs are written
+    with +faststart, so players can seek and start before the whole file is downloaded.
     """
     # ... (Code download như phiên bản trước, đã có log và kiểm tra) ...
     logger.info(f"Received download request for filename: {file_name}")
@@ -185,19 +520,92 @@ async def download_file(file_name: str):
 
 # --- Endpoint để liệt kê file kết quả ---
 @router.get("/results")
-async def list_results():
+async def list_results(
+    limit: int = Query(RESULTS_PAGE_SIZE, ge=1, le=RESULTS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    status: Optional[str] = Query("completed", description=f"{' | '.join(JOB_STATUSES)} | all"),
+    since: Optional[float] = Query(None, description="Chỉ job nhận sau thời điểm này (unix time)"),
+    until: Optional[float] = Query(None, description="Chỉ job nhận trước thời điểm này (unix time)"),
+    input_hash: Optional[str] = Query(None, description="Chỉ job dùng input có sha256 này"),
+):
     """
-    Lists the files currently available in the output directory.
+    Lists render results from the job store, newest first, with cursor pagination.
+    `results` keeps the plain list of output filenames; `items` carries status, timings and sizes.
     """
-    # ... (Code list_results như phiên bản trước) ...
-    logger.info(f"Listing results from directory: {os.path.abspath(OUTPUT_DIR)}")
+    status_filter = None if status == "all" else status
+    if status_filter is not None and status_filter not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status phải là một trong: {', '.join(JOB_STATUSES)}, all")
     try:
-        files = [f for f in os.listdir(OUTPUT_DIR) if os.path.isfile(os.path.join(OUTPUT_DIR, f))]
-        files.sort(key=lambda f: os.path.getmtime(os.path.join(OUTPUT_DIR, f)), reverse=True)
-        return {"results": files}
-    except Exception as e:
-        logger.error(f"Error listing results directory '{OUTPUT_DIR}': {e}")
-        raise HTTPException(status_code=500, detail="Không thể liệt kê file kết quả.")
+        items, next_cursor = await asyncio.to_thread(
+            job_store.list_jobs, status_filter, since, until, input_hash, False, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "results": [item["output_filename"] for item in items if item["status"] == "completed"],
+        "items": items,
+        "next_cursor": next_cursor,
+    }
+
+
+# --- Endpoint thống kê scheduler ---
+@router.get("/scheduler/stats")
+async def scheduler_stats():
+    """
+    Returns worker count, per-job ffmpeg thread budget, running and queued jobs.
+    """
+    return render_scheduler.stats()
+
+
+# --- Endpoint thống kê dung lượng đĩa ---
+@router.get("/storage/stats")
+async def storage_stats():
+    """
+    Returns free disk space, per-directory usage, quotas/TTLs and the last sweep result.
+    """
+    usage = await asyncio.to_thread(storage_manager.usage)
+    usage["asset_library"] = await asyncio.to_thread(asset_store.usage)
+    return usage
+
+
+def release_job_uploads(job) -> None:
+    """Finish listener của scheduler: xóa thư mục upload của session và bỏ tham chiếu asset khi job kết thúc."""
+    asset_store.release_job(job.job_id)
+    if job.params.get("hls_output_dir"):
+        storage_manager.release(job.params["hls_output_dir"], delete=False) # HLS đã xong -> theo TTL của outputs
+    audio_path = job.params.get("audio_path")
+    if not audio_path:
+        return
+    session_upload_dir = os.path.dirname(os.path.abspath(audio_path))
+    if os.path.dirname(session_upload_dir) == os.path.abspath(UPLOAD_DIR):
+        storage_manager.release(session_upload_dir)
+
+
+def discard_cancelled_outputs(job) -> None:
+    """Finish listener của scheduler: job bị hủy không để lại preview hay HLS dở dang (file tạm do worker tự dọn)."""
+    if job.status != "cancelled":
+        return
+    paths = [job.params.get("preview_output_path"), job.params.get("hls_output_dir")]
+    cleanup_files_sync([path for path in paths if path and os.path.exists(path)])
+
+
+def forget_evicted_output(area: str, path: str) -> None:
+    """Eviction listener của storage manager: output bị xóa không còn được liệt kê trong /results."""
+    if area == "outputs":
+        job_store.mark_output_deleted(path)
+
+
+# --- Endpoint thống kê clip cache và audio analysis cache ---
+def _cache_stats() -> dict:
+    return {**clip_cache.stats(), "audio_analysis": audio_analysis_cache.stats()}
+
+
+@router.get("/cache/stats")
+async def clip_cache_stats():
+    """
+    Returns hit/miss counters and size of the normalized clip cache,
+    with the audio analysis cache under "audio_analysis".
+    """
+    return await asyncio.to_thread(_cache_stats) # Duyệt thư mục cache, không chặn event loop
 
 
 # --- Hàm tiện ích để dọn dẹp file (ĐỒNG BỘ) ---
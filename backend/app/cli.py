@@ -0,0 +1,414 @@
+# backend/app/cli.py
+#
+# Render hàng loạt không qua HTTP: đọc manifest JSON/YAML và chạy process_video cho từng job trong một process pool.
+# Chạy từ thư mục backend:
+#   python -m app.cli batch.yaml --workers 4
+#   python -m app.cli batch.yaml --fresh --stats-json stats.json
+#
+# Manifest (đường dẫn tương đối tính từ thư mục chứa manifest):
+#   output_dir: renders
+#   defaults: {subtitle_mode: burn, single_pass: true, parallel: false, hls: false}
+#   clip_pools:
+#     city: [clips/a.mp4, clips/b.mp4]
+#   jobs:
+#     - id: ep001
+#       audio: audio/ep001.mp3
+#       srt: srt/ep001.srt
+#       clips: city                # tên pool hoặc danh sách đường dẫn
+#       subtitle_mode: soft        # ghi đè defaults
+#
+# Tiến độ được ghi vào checkpoint (JSON Lines, mặc định <manifest>.checkpoint.jsonl) sau mỗi job,
+# nên chạy lại cùng lệnh sau khi crash chỉ render các job chưa xong (hoặc có input đã thay đổi).
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from app.services.clip_cache import clip_cache
+from app.services.job_scheduler import CPU_COUNT, RENDER_FFMPEG_THREADS, RENDER_MAX_WORKERS
+from app.services.media_probe import (
+    PROBE_WORKERS, ProbeCache, ProbeResult, analyze_audio, audio_analysis_cache, probe_cache, probe_many,
+)
+from app.services.subtitles import SUBTITLE_MODES
+
+logger = logging.getLogger(__name__)
+
+# Tùy chọn job được phép trong manifest (defaults hoặc từng job) -> tham số của process_video
+JOB_OPTIONS = ("subtitle_mode", "single_pass", "parallel", "hls")
+HLS_PREFIX = "hls_"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def _configure_logging(level: int) -> None:
+    """
+    Cấu hình log của CLI. force=True vì video_processing gọi logging.basicConfig(INFO) khi được import,
+    nếu không thì mức log của --verbose bị bỏ qua trong tiến trình đã import module đó (worker).
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT, force=True)
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    """Một job trong manifest, đường dẫn đã chuyển thành tuyệt đối."""
+    job_id: str
+    audio_path: str
+    srt_path: str
+    video_paths: Tuple[str, ...]
+    output_path: str
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    def fingerprint(self) -> str:
+        """Định danh job + input (size, mtime): input thay đổi thì checkpoint cũ không còn hiệu lực."""
+        inputs = []
+        for path in (self.audio_path, self.srt_path, *self.video_paths):
+            stat = os.stat(path)
+            inputs.append([path, stat.st_size, stat.st_mtime_ns])
+        payload = json.dumps({'job': asdict(self), 'inputs': inputs}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# --- Manifest ---
+def load_manifest(path: str, output_dir: Optional[str] = None) -> List[BatchJob]:
+    """Đọc manifest JSON/YAML và kiểm tra từng job. Manifest sai -> ValueError."""
+    with open(path, 'r', encoding='utf-8') as manifest_file:
+        if path.lower().endswith('.json'):
+            data = json.load(manifest_file)
+        else:
+            data = yaml.safe_load(manifest_file)
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list) or not data['jobs']:
+        raise ValueError("Manifest must be a mapping with a non-empty 'jobs' list.")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    resolve = lambda value: os.path.abspath(os.path.join(base_dir, str(value)))
+    output_dir = os.path.abspath(output_dir) if output_dir else resolve(data.get('output_dir', 'output'))
+    defaults = _job_options(data.get('defaults') or {}, 'defaults')
+    pools = {name: [resolve(clip) for clip in clips] for name, clips in (data.get('clip_pools') or {}).items()}
+
+    jobs: List[BatchJob] = []
+    seen_ids = set()
+    for index, entry in enumerate(data['jobs']):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Job #{index} must be a mapping.")
+        for key in ('audio', 'srt', 'clips'):
+            if not entry.get(key):
+                raise ValueError(f"Job #{index} is missing '{key}'.")
+        audio_path = resolve(entry['audio'])
+        job_id = str(entry.get('id') or os.path.splitext(os.path.basename(audio_path))[0])
+        if job_id in seen_ids:
+            raise ValueError(f"Duplicate job id '{job_id}' (set 'id' explicitly).")
+        seen_ids.add(job_id)
+
+        clips = entry['clips']
+        if isinstance(clips, str):
+            if clips not in pools:
+                raise ValueError(f"Job '{job_id}' references unknown clip pool '{clips}'.")
+            video_paths = pools[clips]
+        else:
+            video_paths = [resolve(clip) for clip in clips]
+        job = BatchJob(
+            job_id=job_id,
+            audio_path=audio_path,
+            srt_path=resolve(entry['srt']),
+            video_paths=tuple(video_paths),
+            output_path=os.path.join(output_dir, str(entry.get('output') or f"{job_id}.mp4")),
+            options={**defaults, **_job_options(entry, job_id)},
+        )
+        missing = [path for path in (job.audio_path, job.srt_path, *job.video_paths) if not os.path.isfile(path)]
+        if missing:
+            raise ValueError(f"Job '{job_id}' has missing input files: {', '.join(missing)}")
+        jobs.append(job)
+    return jobs
+
+
+def _job_options(entry: dict, where: str) -> Dict[str, Any]:
+    options = {key: entry[key] for key in JOB_OPTIONS if entry.get(key) is not None}
+    subtitle_mode = options.get('subtitle_mode')
+    if subtitle_mode is not None and subtitle_mode not in SUBTITLE_MODES:
+        raise ValueError(f"Unknown subtitle_mode '{subtitle_mode}' in {where}. Expected one of: {', '.join(SUBTITLE_MODES)}")
+    return options
+
+
+# --- Checkpoint ---
+def read_checkpoint(path: str) -> Dict[str, dict]:
+    """job_id -> bản ghi mới nhất. Dòng cuối bị cắt dở (crash lúc đang ghi) được bỏ qua."""
+    records: Dict[str, dict] = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and 'job_id' in record:
+                records[record['job_id']] = record
+    return records
+
+
+def _open_checkpoint(path: str, fresh: bool):
+    torn = False
+    if not fresh and os.path.isfile(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as existing:
+            existing.seek(-1, os.SEEK_END)
+            torn = existing.read(1) != b'\n'
+    checkpoint_file = open(path, 'w' if fresh else 'a', encoding='utf-8')
+    if torn:
+        checkpoint_file.write('\n') # Tách khỏi dòng bị cắt dở của lần chạy trước
+    return checkpoint_file
+
+
+def _append_checkpoint(checkpoint_file, record: dict) -> None:
+    checkpoint_file.write(json.dumps(record) + '\n')
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
+def _is_done(job: BatchJob, record: Optional[dict]) -> bool:
+    return (record is not None and record.get('status') == 'completed'
+            and record.get('fingerprint') == job.fingerprint() and os.path.isfile(job.output_path))
+
+
+# --- Chuẩn bị dùng chung cho cả batch (tiến trình chính) ---
+def _hash_inputs(paths: List[str]) -> Dict[str, str]:
+    """SHA-256 của mọi input khác nhau, mỗi file chỉ đọc một lần cho cả batch."""
+    with ThreadPoolExecutor(max_workers=max(1, min(PROBE_WORKERS, len(paths))), thread_name_prefix="hash") as executor:
+        return dict(zip(paths, executor.map(clip_cache.content_hash, paths)))
+
+
+def _probe_inputs(audio_paths: List[str], video_paths: List[str], content_hashes: Dict[str, str]) -> Dict[str, ProbeResult]:
+    """
+    Probe mọi clip/audio một lần. Kết quả được nạp sẵn vào probe cache của từng worker;
+    phân tích audio được ghi vào cache trên đĩa (dùng chung giữa các tiến trình).
+    """
+    paths = audio_paths + video_paths
+    probes = {path: probe for path, probe in zip(paths, probe_many(paths, content_hashes)) if probe is not None}
+    for path in audio_paths:
+        try:
+            analyze_audio(path, content_hashes.get(path))
+        except ValueError as e:
+            logger.warning(f"Audio analysis failed for {path}: {e}")
+    return probes
+
+
+def _clip_sets(jobs: List[BatchJob]) -> List[Tuple[str, ...]]:
+    return list(dict.fromkeys(job.video_paths for job in jobs))
+
+
+# --- Worker ---
+def _init_batch_worker(ffmpeg_threads: int, probes: Dict[str, ProbeResult], content_hashes: Dict[str, str],
+                       log_level: int = logging.WARNING) -> None:
+    """Chạy một lần trong mỗi tiến trình worker: mức log, ngân sách luồng ffmpeg và probe cache dùng chung."""
+    from app.services import video_processing
+    _configure_logging(log_level) # Sau import: ghi đè basicConfig(INFO) của video_processing
+    video_processing.FFMPEG_THREADS = ffmpeg_threads
+    for path, probe in probes.items():
+        probe_cache.put(ProbeCache.key_for(path, content_hashes.get(path)), probe)
+    clip_cache.remember_hashes(content_hashes)
+
+
+def _warm_clip_set(video_paths: Tuple[str, ...], content_hashes: Dict[str, str]) -> int:
+    """
+    Chuẩn hóa trước các clip lệch chữ ký của một bộ clip vào clip cache, để các job dùng chung bộ clip
+    không cùng lúc encode lại cùng một clip. Trả về số clip đã có bản chuẩn hóa.
+    """
+    from app.services.video_processing import _prepare_copy_concat, _probe_video_files
+    processed_video_paths, _, video_probes = _probe_video_files(list(video_paths), content_hashes)
+    _, normalized_paths = _prepare_copy_concat(processed_video_paths, video_probes)
+    return len(normalized_paths)
+
+
+def _render_batch_job(job: BatchJob, content_hashes: Dict[str, str]) -> dict:
+    """Render một job trong worker; lỗi được trả về trong bản ghi để batch tiếp tục."""
+    from app.services.video_processing import process_video
+
+    options = dict(job.options)
+    hls = options.pop('hls', False)
+    if hls:
+        options['hls_output_dir'] = os.path.join(os.path.dirname(job.output_path), f"{HLS_PREFIX}{job.job_id}")
+    job_hashes = {path: content_hashes[path] for path in (job.audio_path, job.srt_path, *job.video_paths) if path in content_hashes}
+    before = (clip_cache.hits, clip_cache.misses, audio_analysis_cache.hits, audio_analysis_cache.misses)
+    started = time.perf_counter()
+    record = {'job_id': job.job_id, 'output_path': job.output_path}
+    try:
+        os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        process_video(job.audio_path, list(job.video_paths), job.srt_path, job.output_path,
+                      content_hashes=job_hashes, **options)
+        record.update(status='completed', output_bytes=os.path.getsize(job.output_path))
+    except Exception as e:
+        record.update(status='failed', error=str(e))
+    record.update(
+        seconds=time.perf_counter() - started,
+        clip_cache_hits=clip_cache.hits - before[0],
+        clip_cache_misses=clip_cache.misses - before[1],
+        audio_cache_hits=audio_analysis_cache.hits - before[2],
+        audio_cache_misses=audio_analysis_cache.misses - before[3],
+    )
+    return record
+
+
+# --- Batch ---
+def run_batch(jobs: List[BatchJob], checkpoint_path: str, workers: int = RENDER_MAX_WORKERS,
+              ffmpeg_threads: int = RENDER_FFMPEG_THREADS, warm_clips: bool = True, fresh: bool = False,
+              log_level: Optional[int] = None) -> dict:
+    """
+    Render các job chưa hoàn thành trong checkpoint qua một process pool và trả về thống kê throughput.
+    Hash, probe và chuẩn hóa clip được làm một lần cho cả batch thay vì một lần mỗi job.
+    log_level áp dụng cho các worker (mặc định: mức của root logger trong tiến trình gọi).
+    """
+    if log_level is None:
+        log_level = logging.getLogger().getEffectiveLevel()
+    batch_started = time.perf_counter()
+    done = {} if fresh else read_checkpoint(checkpoint_path)
+    pending = [job for job in jobs if not _is_done(job, done.get(job.job_id))]
+    skipped = len(jobs) - len(pending)
+    workers = max(1, min(workers, len(pending) or 1))
+    ffmpeg_threads = ffmpeg_threads if ffmpeg_threads > 0 else max(1, CPU_COUNT // workers)
+    print(f"{len(jobs)} jobs in manifest, {skipped} already completed, {len(pending)} to render "
+          f"({workers} workers x {ffmpeg_threads} ffmpeg threads)")
+
+    stats = {"jobs": len(jobs), "skipped": skipped, "completed": 0, "failed": 0}
+    if not pending:
+        return stats
+
+    # --- 1. Hash + probe mọi input khác nhau một lần ---
+    prepare_started = time.perf_counter()
+    audio_paths = list(dict.fromkeys(job.audio_path for job in pending))
+    video_paths = list(dict.fromkeys(path for job in pending for path in job.video_paths))
+    srt_paths = list(dict.fromkeys(job.srt_path for job in pending))
+    content_hashes = _hash_inputs(audio_paths + video_paths + srt_paths)
+    probes = _probe_inputs(audio_paths, video_paths, content_hashes)
+    clip_sets = _clip_sets(pending)
+    print(f"Prepared {len(content_hashes)} unique inputs ({len(video_paths)} clips in {len(clip_sets)} clip sets) "
+          f"in {time.perf_counter() - prepare_started:.1f}s")
+
+    job_seconds: List[float] = []
+    media_seconds = 0.0
+    output_bytes = 0
+    cache_hits = cache_misses = audio_hits = audio_misses = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_batch_worker,
+                             initargs=(ffmpeg_threads, probes, content_hashes, log_level)) as executor, \
+            _open_checkpoint(checkpoint_path, fresh) as checkpoint_file:
+        try:
+            # --- 2. Chuẩn hóa clip dùng chung trước khi các job chạy song song ---
+            if warm_clips:
+                warm_started = time.perf_counter()
+                warm_futures = [executor.submit(_warm_clip_set, clip_set, content_hashes) for clip_set in clip_sets]
+                normalized = 0
+                for future in as_completed(warm_futures):
+                    try:
+                        normalized += future.result()
+                    except Exception as e:
+                        logger.warning(f"Clip warm-up failed, jobs will normalize on demand: {e}")
+                print(f"Clip cache warmed: {normalized} normalized clips in {time.perf_counter() - warm_started:.1f}s")
+
+            # --- 3. Render ---
+            futures = {executor.submit(_render_batch_job, job, content_hashes): job for job in pending}
+            for finished, future in enumerate(as_completed(futures), start=1):
+                job = futures[future]
+                record = future.result()
+                audio_probe = probes.get(job.audio_path)
+                duration = audio_probe.duration if audio_probe else 0.0
+                record['fingerprint'] = job.fingerprint()
+                record['media_seconds'] = duration
+                record['finished_at'] = time.time()
+                _append_checkpoint(checkpoint_file, record)
+
+                stats[record['status']] += 1
+                cache_hits += record['clip_cache_hits']
+                cache_misses += record['clip_cache_misses']
+                audio_hits += record['audio_cache_hits']
+                audio_misses += record['audio_cache_misses']
+                if record['status'] == 'completed':
+                    job_seconds.append(record['seconds'])
+                    media_seconds += duration
+                    output_bytes += record['output_bytes']
+                    speed = f", {duration / record['seconds']:.1f}x realtime" if record['seconds'] > 0 else ""
+                    print(f"[{finished}/{len(pending)}] {job.job_id} completed in {record['seconds']:.1f}s{speed}")
+                else:
+                    print(f"[{finished}/{len(pending)}] {job.job_id} FAILED after {record['seconds']:.1f}s: {record['error']}")
+        except KeyboardInterrupt:
+            # Job đang chạy sẽ được render lại ở lần chạy sau (chưa có bản ghi completed)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    wall_seconds = time.perf_counter() - batch_started
+    stats.update({
+        "wall_seconds": round(wall_seconds, 3),
+        "media_seconds": round(media_seconds, 3),
+        "realtime_factor": round(media_seconds / wall_seconds, 3) if wall_seconds > 0 else None,
+        "jobs_per_hour": round(stats["completed"] / wall_seconds * 3600, 2) if wall_seconds > 0 else None,
+        "output_bytes": output_bytes,
+        "job_seconds_p50": round(statistics.median(job_seconds), 3) if job_seconds else None,
+        "job_seconds_p95": round(_percentile(job_seconds, 0.95), 3) if job_seconds else None,
+        "clip_cache_hits": cache_hits,
+        "clip_cache_misses": cache_misses,
+        "audio_cache_hits": audio_hits,
+        "audio_cache_misses": audio_misses,
+        "unique_inputs": len(content_hashes),
+        "workers": workers,
+        "ffmpeg_threads": ffmpeg_threads,
+    })
+    return stats
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _print_stats(stats: dict) -> None:
+    print("\n--- Batch summary ---")
+    for key, value in stats.items():
+        print(f"{key:>18}: {value}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render every job of a JSON/YAML manifest without the HTTP API.")
+    parser.add_argument("manifest", help="Đường dẫn manifest (.json, .yaml, .yml)")
+    parser.add_argument("--workers", type=int, default=RENDER_MAX_WORKERS, help="Số job render song song")
+    parser.add_argument("--ffmpeg-threads", type=int, default=RENDER_FFMPEG_THREADS,
+                        help="Số luồng ffmpeg mỗi job (0 = số core / số worker)")
+    parser.add_argument("--output-dir", help="Ghi đè output_dir của manifest")
+    parser.add_argument("--checkpoint", help="File checkpoint (mặc định <manifest>.checkpoint.jsonl)")
+    parser.add_argument("--fresh", action="store_true", help="Bỏ qua checkpoint cũ, render lại tất cả")
+    parser.add_argument("--no-warm", action="store_true", help="Không chuẩn hóa trước các bộ clip dùng chung")
+    parser.add_argument("--stats-json", help="Ghi thống kê throughput ra file JSON")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log INFO của pipeline")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    _configure_logging(log_level)
+    try:
+        jobs = load_manifest(args.manifest, args.output_dir)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        print(f"Invalid manifest: {e}", file=sys.stderr)
+        return 2
+
+    checkpoint_path = args.checkpoint or f"{os.path.splitext(os.path.abspath(args.manifest))[0]}.checkpoint.jsonl"
+    try:
+        stats = run_batch(jobs, checkpoint_path, workers=args.workers, ffmpeg_threads=args.ffmpeg_threads,
+                          warm_clips=not args.no_warm, fresh=args.fresh, log_level=log_level)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Completed jobs are recorded in {checkpoint_path}; rerun to resume.", file=sys.stderr)
+        return 130
+    _print_stats(stats)
+    if args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as stats_file:
+            json.dump(stats, stats_file, indent=2)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
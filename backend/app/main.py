@@ -1,8 +1,75 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.api import upload
+from app.services import metrics
+from app.services.asset_store import asset_store
+from app.services.clip_cache import clip_cache
+from app.services.job_scheduler import render_scheduler
+from app.services.job_store import job_store
+from app.services.media_probe import audio_analysis_cache
+from app.services.storage_manager import STORAGE_SWEEP_INTERVAL, TEMP_DIR, storage_manager
+
+logger = logging.getLogger(__name__)
+
+# Các thư mục làm việc được theo dõi dung lượng trên /metrics
+METRICS_DIRECTORIES = {
+    "uploads": upload.UPLOAD_DIR,
+    "outputs": upload.OUTPUT_DIR,
+    "temp": TEMP_DIR,
+    "clip_cache": clip_cache.cache_dir,
+    "assets": asset_store.root,
+}
+# Bộ đếm hit/miss của các cache (worker render cộng dồn về tiến trình chính khi job kết thúc)
+metrics.cache_lookups.set_function(lambda: {
+    ("clip", "hit"): clip_cache.hits,
+    ("clip", "miss"): clip_cache.misses,
+    ("audio_analysis", "hit"): audio_analysis_cache.hits,
+    ("audio_analysis", "miss"): audio_analysis_cache.misses,
+})
+
+
+async def _storage_sweep_loop() -> None:
+    """Dọn dẹp đĩa định kỳ; sweep duyệt/xóa file nên chạy trong thread, không chặn event loop."""
+    while True:
+        try:
+            await asyncio.to_thread(storage_manager.sweep)
+            await asyncio.to_thread(asset_store.sweep)
+        except Exception:
+            logger.exception("Storage sweep failed")
+        await asyncio.sleep(STORAGE_SWEEP_INTERVAL)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Khởi động process pool render cùng server và dừng nó khi tắt
+    render_scheduler.set_admission_check(storage_manager.has_free_space) # Thiếu đĩa -> job chờ trong hàng đợi
+    render_scheduler.add_finish_listener(upload.release_job_uploads)
+    render_scheduler.add_finish_listener(upload.discard_cancelled_outputs)
+    # Ghi trạng thái job vào store (nguồn dữ liệu của /results và /check)
+    render_scheduler.add_start_listener(job_store.save)
+    render_scheduler.add_finish_listener(job_store.save)
+    storage_manager.add_eviction_listener(upload.forget_evicted_output)
+    storage_manager.set_running_since(render_scheduler.running_since) # Không xóa file tạm/output dở của job đang chạy
+    # Mở các file SQLite lúc khởi động (không phải lúc import) để lỗi đường dẫn/quyền ghi lộ ra ngay
+    await asyncio.to_thread(job_store.open)
+    await asyncio.to_thread(asset_store.open)
+    await asyncio.to_thread(job_store.reconcile, upload.OUTPUT_DIR, (".", upload.PREVIEW_PREFIX))
+    await asyncio.to_thread(asset_store.reconcile)
+    render_scheduler.start()
+    sweep_task = asyncio.create_task(_storage_sweep_loop())
+    yield
+    sweep_task.cancel()
+    render_scheduler.shutdown(wait=False)
+    job_store.close()
+    asset_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS cho phép frontend kết nối
 app.add_middleware(
@@ -14,3 +81,18 @@ app.add_middleware(
 )
 
 app.include_router(upload.router)
+
+
+def _collect_directory_usage() -> str:
+    sizes, counts = metrics.directory_usage(METRICS_DIRECTORIES)
+    metrics.temp_dir_bytes.set_function(lambda: sizes)
+    metrics.temp_dir_files.set_function(lambda: counts)
+    return metrics.registry.render()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Metric định dạng Prometheus (độ trễ từng bước, lỗi, byte đã xử lý, dung lượng thư mục tạm)."""
+    # Duyệt thư mục là I/O chặn -> chạy ngoài event loop
+    body = await asyncio.to_thread(_collect_directory_usage)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
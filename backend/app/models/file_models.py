@@ -0,0 +1,19 @@
+# backend/app/models/file_models.py
+
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class AssetCheckRequest(BaseModel):
+    """Danh sách SHA-256 client định upload; server trả về những asset còn thiếu."""
+    hashes: List[str] = Field(..., description="SHA-256 hex của từng file")
+
+
+class AssetRenderRequest(BaseModel):
+    """Job render tham chiếu asset đã có trong thư viện (ID = SHA-256 nội dung)."""
+    audio: str = Field(..., description="Asset ID của file audio")
+    srt: str = Field(..., description="Asset ID của file phụ đề SRT")
+    videos: List[str] = Field(..., min_length=1, description="Asset ID của các clip video, theo thứ tự")
+    subtitle_mode: Optional[str] = Field(None, description="burn | soft | selective")
+    hls: Optional[bool] = Field(None, description="Thêm bản HLS")
@@ -0,0 +1,289 @@
+# backend/app/services/asset_store.py
+
+import os
+import re
+import uuid
+import sqlite3
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ASSET_DIR = os.environ.get("ASSET_DIR", os.path.join(BACKEND_ROOT, "assets"))
+ASSET_INDEX_PATH = os.environ.get("ASSET_INDEX_PATH", os.path.join(BACKEND_ROOT, "data", "assets.sqlite3"))
+# Asset không còn job nào tham chiếu bị xóa sau số giây này kể từ lần dùng cuối; 0 = giữ mãi
+ASSET_TTL_SECONDS = float(os.environ.get("ASSET_TTL_SECONDS", 7 * 24 * 3600))
+# Dung lượng tối đa của thư viện (byte); vượt quá thì xóa asset không được tham chiếu, dùng lâu nhất trước
+ASSET_QUOTA_BYTES = int(os.environ.get("ASSET_QUOTA_BYTES", 50 * 1024 ** 3))
+
+_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Chỉ giữ phần mở rộng đơn giản (ffmpeg dùng nó để đoán định dạng, ví dụ .srt)
+_EXTENSION_PATTERN = re.compile(r"^\.[0-9A-Za-z]{1,8}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    extension TEXT NOT NULL DEFAULT '',
+    filename TEXT,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    job_uses INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS assets_last_used ON assets (last_used_at);
+CREATE TABLE IF NOT EXISTS asset_refs (
+    job_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES assets (sha256),
+    PRIMARY KEY (job_id, sha256)
+);
+CREATE INDEX IF NOT EXISTS asset_refs_sha256 ON asset_refs (sha256);
+"""
+
+
+def is_asset_id(value: str) -> bool:
+    """ID của asset là SHA-256 hex (chữ thường) của nội dung."""
+    return bool(_SHA256_PATTERN.match(value or ""))
+
+
+class AssetNotFound(LookupError):
+    """Một hoặc nhiều asset được tham chiếu không (còn) tồn tại trong thư viện."""
+
+    def __init__(self, missing: List[str]):
+        super().__init__(f"Missing assets: {', '.join(missing)}")
+        self.missing = missing
+
+
+class AssetStore:
+    """
+    Thư viện media đánh địa chỉ theo nội dung: mỗi nội dung chỉ lưu một lần tại
+    ASSET_DIR/<2 ký tự đầu>/<sha256><ext>, chỉ mục và số tham chiếu nằm trong SQLite.
+    Job giữ tham chiếu (acquire) tới các asset nó dùng cho tới khi kết thúc (release_job);
+    sweep chỉ xóa asset không còn tham chiếu. Các hàm đều đồng bộ (API gọi qua asyncio.to_thread).
+    """
+
+    def __init__(self, root: str = ASSET_DIR, index_path: str = ASSET_INDEX_PATH,
+                 ttl_seconds: float = ASSET_TTL_SECONDS, quota_bytes: int = ASSET_QUOTA_BYTES):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.quota_bytes = quota_bytes
+        self.index_path = index_path
+        self.incoming_dir = os.path.join(root, "incoming")
+        self._lock = threading.Lock()
+        # Thư mục và chỉ mục SQLite được tạo ở lần dùng đầu tiên (hoặc lúc app khởi động), không phải lúc import
+        self._open_lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def open(self) -> sqlite3.Connection:
+        """Tạo thư mục thư viện, mở (một lần) chỉ mục SQLite và tạo schema; gọi lại nhiều lần không sao."""
+        with self._open_lock:
+            if self._connection is None:
+                os.makedirs(self.incoming_dir, exist_ok=True)
+                if self.index_path != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+                conn = sqlite3.connect(self.index_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                with conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.executescript(_SCHEMA)
+                self._connection = conn
+                logger.info(f"Asset store opened at {self.root} (index {self.index_path})")
+            return self._connection
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        return self._connection or self.open()
+
+    def close(self) -> None:
+        with self._lock, self._open_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    # --- Đường dẫn ---
+    def blob_path(self, sha256: str, extension: str = "") -> str:
+        return os.path.join(self.root, sha256[:2], f"{sha256}{extension}")
+
+    def incoming_path(self) -> str:
+        """File tạm cho một upload đang ghi (cùng ổ đĩa với blob nên os.replace là atomic)."""
+        self.open() # Đảm bảo incoming/ đã tồn tại
+        return os.path.join(self.incoming_dir, f".partial_{uuid.uuid4().hex}")
+
+    # --- Ghi ---
+    def add(self, temp_path: str, sha256: str, size: int, filename: Optional[str] = None) -> Dict:
+        """
+        Đưa file đã ghi xong (hash đã kiểm tra) vào thư viện. Nếu nội dung đã có thì bỏ file mới.
+        Trả về metadata của asset kèm created=True/False.
+        """
+        if not is_asset_id(sha256):
+            raise ValueError(f"Invalid asset id: {sha256}")
+        extension = os.path.splitext(filename or "")[1].lower()
+        if not _EXTENSION_PATTERN.match(extension):
+            extension = ""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT * FROM assets WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None and os.path.exists(self.blob_path(sha256, row["extension"])):
+                os.remove(temp_path)
+                self._conn.execute("UPDATE assets SET last_used_at = ? WHERE sha256 = ?", (now, sha256))
+                return {**self._to_dict(row), "created": False}
+            if row is not None:
+                extension = row["extension"] # Blob bị mất trên đĩa: ghi lại cùng tên
+            path = self.blob_path(sha256, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            self._conn.execute(
+                "INSERT INTO assets (sha256, size, extension, filename, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (sha256) DO UPDATE SET size = excluded.size, last_used_at = excluded.last_used_at",
+                (sha256, size, extension, filename, now, now),
+            )
+            row = self._conn.execute("SELECT * FROM assets WHERE sha256 = ?", (sha256,)).fetchone()
+        logger.info(f"Stored asset {sha256[:12]} ({size} bytes) at {path}")
+        return {**self._to_dict(row), "created": True}
+
+    def acquire(self, job_id: str, asset_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Ghi tham chiếu của job tới các asset (asset không bị sweep xóa cho tới release_job).
+        Trả về {sha256: đường dẫn blob}. Thiếu asset nào thì không ghi gì và raise AssetNotFound.
+        Asset đã được job trước dùng là blob client không phải upload lại -> cộng vào asset_deduplicated_bytes.
+        """
+        asset_ids = list(dict.fromkeys(asset_ids))
+        now = time.time()
+        with self._lock, self._conn:
+            rows = {
+                row["sha256"]: row
+                for row in self._conn.execute(
+                    f"SELECT * FROM assets WHERE sha256 IN ({', '.join('?' for _ in asset_ids)})", asset_ids)
+            }
+            paths = {sha256: self.blob_path(sha256, row["extension"]) for sha256, row in rows.items()}
+            missing = [sha256 for sha256 in asset_ids if sha256 not in paths or not os.path.exists(paths[sha256])]
+            if missing:
+                raise AssetNotFound(missing)
+            self._conn.executemany("INSERT OR IGNORE INTO asset_refs (job_id, sha256) VALUES (?, ?)",
+                                   [(job_id, sha256) for sha256 in asset_ids])
+            self._conn.executemany("UPDATE assets SET last_used_at = ?, job_uses = job_uses + 1 WHERE sha256 = ?",
+                                   [(now, sha256) for sha256 in asset_ids])
+        reused_bytes = sum(rows[sha256]["size"] for sha256 in asset_ids if rows[sha256]["job_uses"] > 0)
+        if reused_bytes:
+            metrics.asset_deduplicated_bytes.inc(reused_bytes)
+        return paths
+
+    def release_job(self, job_id: str) -> int:
+        """Bỏ mọi tham chiếu của một job đã kết thúc; trả về số tham chiếu đã bỏ."""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM asset_refs WHERE job_id = ?", (job_id,)).rowcount
+
+    # --- Đọc ---
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        return {
+            "asset_id": row["sha256"],
+            "size": row["size"],
+            "filename": row["filename"],
+            "created_at": row["created_at"],
+            "last_used_at": row["last_used_at"],
+        }
+
+    def get(self, sha256: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM assets WHERE sha256 = ?", (sha256,)).fetchone()
+            refs = self._conn.execute("SELECT COUNT(*) FROM asset_refs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+        if row is None or not os.path.exists(self.blob_path(sha256, row["extension"])):
+            return None
+        return {**self._to_dict(row), "references": refs}
+
+    def existing(self, asset_ids: Iterable[str]) -> Dict[str, int]:
+        """{sha256: size} của các asset đã có trong thư viện (dùng cho bước kiểm tra trước khi upload)."""
+        asset_ids = [sha256 for sha256 in dict.fromkeys(asset_ids) if is_asset_id(sha256)]
+        if not asset_ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT sha256, size, extension FROM assets WHERE sha256 IN ({', '.join('?' for _ in asset_ids)})",
+                asset_ids,
+            ).fetchall()
+        return {row["sha256"]: row["size"] for row in rows if os.path.exists(self.blob_path(row["sha256"], row["extension"]))}
+
+    # --- Dọn dẹp ---
+    def _delete_unreferenced(self, sha256: str, extension: str, reason: str) -> int:
+        """Xóa asset (đang giữ lock) nếu không còn tham chiếu; trả về số byte đã giải phóng."""
+        if self._conn.execute("SELECT 1 FROM asset_refs WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+            return 0
+        path = self.blob_path(sha256, extension)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        except OSError as e:
+            logger.error(f"Error deleting asset {path}: {e}")
+            return 0
+        self._conn.execute("DELETE FROM assets WHERE sha256 = ?", (sha256,))
+        metrics.storage_evicted_bytes.inc(size, area="assets", reason=reason)
+        logger.info(f"Evicted asset {sha256[:12]} ({reason}, {size} bytes)")
+        return size
+
+    def sweep(self) -> dict:
+        """Xóa asset không được tham chiếu: quá ASSET_TTL_SECONDS, rồi lâu nhất trước cho tới khi dưới quota."""
+        report = {"deleted": 0, "freed_bytes": 0}
+        now = time.time()
+        with self._lock, self._conn:
+            if self.ttl_seconds:
+                for row in self._conn.execute(
+                        "SELECT sha256, extension FROM assets WHERE last_used_at < ?", (now - self.ttl_seconds,)).fetchall():
+                    freed = self._delete_unreferenced(row["sha256"], row["extension"], "ttl")
+                    if freed:
+                        report["deleted"] += 1
+                        report["freed_bytes"] += freed
+            if self.quota_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM assets").fetchone()[0]
+                for row in self._conn.execute("SELECT sha256, extension, size FROM assets ORDER BY last_used_at").fetchall():
+                    if total <= self.quota_bytes:
+                        break
+                    freed = self._delete_unreferenced(row["sha256"], row["extension"], "quota")
+                    if freed:
+                        total -= row["size"]
+                        report["deleted"] += 1
+                        report["freed_bytes"] += freed
+        if report["deleted"]:
+            logger.info(f"Asset sweep evicted: {report}")
+        return report
+
+    def reconcile(self) -> dict:
+        """
+        Đồng bộ lúc khởi động: bỏ tham chiếu của job từ lần chạy trước (không job nào sống qua restart),
+        xóa upload dở trong incoming/ và chỉ mục của blob đã mất trên đĩa.
+        """
+        self.open()
+        for name in os.listdir(self.incoming_dir):
+            try:
+                os.remove(os.path.join(self.incoming_dir, name))
+            except OSError:
+                continue
+        with self._lock, self._conn:
+            dropped_refs = self._conn.execute("DELETE FROM asset_refs").rowcount
+            missing = [
+                row["sha256"]
+                for row in self._conn.execute("SELECT sha256, extension FROM assets").fetchall()
+                if not os.path.exists(self.blob_path(row["sha256"], row["extension"]))
+            ]
+            self._conn.executemany("DELETE FROM assets WHERE sha256 = ?", [(sha256,) for sha256 in missing])
+        report = {"dropped_refs": dropped_refs, "missing": len(missing)}
+        logger.info(f"Asset store reconciled: {report}")
+        return report
+
+    def usage(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets").fetchone()
+            referenced = self._conn.execute("SELECT COUNT(DISTINCT sha256) FROM asset_refs").fetchone()[0]
+        return {"assets": count, "bytes": total, "referenced": referenced,
+                "quota_bytes": self.quota_bytes, "ttl_seconds": self.ttl_seconds}
+
+
+# Thư viện asset dùng chung cho API (tiến trình chính); thư mục và chỉ mục chỉ được tạo khi app khởi động/dùng lần đầu
+asset_store = AssetStore()
@@ -0,0 +1,227 @@
+# backend/app/services/clip_cache.py
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+from app.utils.file_helper import compute_file_hash
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CLIP_CACHE_DIR = os.environ.get("CLIP_CACHE_DIR", os.path.join(BACKEND_ROOT, "cache", "clips"))
+CLIP_CACHE_MAX_BYTES = int(os.environ.get("CLIP_CACHE_MAX_BYTES", 10 * 1024 ** 3)) # Mặc định 10 GiB
+# Entry được dùng (get/put) trong khoảng này có thể đang được một job (ở bất kỳ worker nào) đọc -> không evict
+CLIP_CACHE_IN_USE_SECONDS = float(os.environ.get("CLIP_CACHE_IN_USE_SECONDS", 3600))
+
+
+class ClipCache:
+    """
+    Cache trên đĩa cho các clip đã chuẩn hóa, đánh địa chỉ theo nội dung.
+    Khóa = SHA-256(content hash của clip gốc + tham số encode đích).
+    LRU dựa trên mtime: mỗi lần hit sẽ "touch" file; evict xóa file cũ nhất
+    cho đến khi tổng dung lượng <= max_bytes. Ghi file qua os.replace nên
+    nhiều tiến trình có thể dùng chung một thư mục cache.
+    Entry vừa dùng trong in_use_seconds không bị evict: job nhận đường dẫn từ get() rồi mới mở file
+    ở bước concat (có thể ở tiến trình khác), nên mtime gần đây được coi là "đang dùng".
+    """
+
+    def __init__(self, cache_dir: str = CLIP_CACHE_DIR, max_bytes: int = CLIP_CACHE_MAX_BYTES,
+                 in_use_seconds: float = CLIP_CACHE_IN_USE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.in_use_seconds = in_use_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hash_memo: Dict[tuple, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds_saved = 0.0
+
+    # --- Khóa ---
+    def content_hash(self, path: str) -> str:
+        """SHA-256 của file, nhớ theo (path, size, mtime) để không băm lại trong cùng tiến trình."""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hash_memo.get(memo_key)
+        if cached:
+            return cached
+        digest = compute_file_hash(path)
+        with self._lock:
+            self._hash_memo[memo_key] = digest
+        return digest
+
+    def remember_hashes(self, content_hashes: Dict[str, str]) -> None:
+        """Ghi nhớ hash đã tính sẵn (ví dụ lúc upload) để content_hash() không phải đọc lại file."""
+        for path, digest in content_hashes.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            with self._lock:
+                self._hash_memo[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = digest
+
+    @staticmethod
+    def make_key(content_hash: str, params: dict) -> str:
+        payload = json.dumps({'content': content_hash, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    # --- Tra cứu / ghi ---
+    def get(self, key: str) -> Optional[str]:
+        """Trả về đường dẫn clip trong cache (và đánh dấu vừa dùng) hoặc None."""
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path, None)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        saved = 0.0
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                saved = float(json.load(f).get('encode_seconds', 0.0))
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self.hits += 1
+            self.encode_seconds_saved += saved
+        logger.info(f"Clip cache hit: {key} (saved ~{saved:.1f}s encode)")
+        return entry_path
+
+    def put(self, key: str, produced_path: str, encode_seconds: float = 0.0) -> str:
+        """Chuyển file đã encode vào cache (atomic) rồi evict nếu vượt giới hạn."""
+        entry_path = self._entry_path(key)
+        with open(self._meta_path(key), 'w', encoding='utf-8') as f:
+            json.dump({'encode_seconds': encode_seconds, 'created_at': time.time()}, f)
+        os.replace(produced_path, entry_path)
+        logger.info(f"Stored clip in cache: {entry_path} ({encode_seconds:.1f}s encode)")
+        self.evict(protect=(key,)) # Không bao giờ xóa entry vừa ghi, kể cả khi nó lớn hơn max_bytes
+        return entry_path
+
+    def get_or_create(self, source_path: str, params: dict, producer: Callable[[str], None]) -> str:
+        """
+        Trả về clip đã chuẩn hóa từ cache; nếu chưa có thì gọi producer(output_path)
+        để encode rồi lưu vào cache.
+        """
+        key = self.make_key(self.content_hash(source_path), params)
+        cached_path = self.get(key)
+        if cached_path:
+            return cached_path
+
+        # Ghi vào file tạm trong cùng thư mục để os.replace là atomic
+        temp_path = os.path.join(self.cache_dir, f".tmp_{uuid.uuid4()}.mp4")
+        started = time.monotonic()
+        try:
+            producer(temp_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return self.put(key, temp_path, time.monotonic() - started)
+
+    def contains(self, key: str) -> bool:
+        """Đã có entry cho khóa này chưa (không tính vào hits/misses, không đánh dấu vừa dùng)."""
+        return os.path.exists(self._entry_path(key))
+
+    def lookup(self, source_path: str, params: dict) -> Optional[str]:
+        """
+        Chỉ tra cứu (không encode) clip đã chuẩn hóa của source_path. Không tính vào hits/misses:
+        đây là bước thăm dò, thiếu entry thì caller chọn đường khác chứ không encode.
+        Entry tìm thấy được đánh dấu vừa dùng để không bị evict trong khi job đọc nó.
+        """
+        key = self.make_key(self.content_hash(source_path), params)
+        if not self.contains(key):
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path, None)
+        except FileNotFoundError:
+            return None # Vừa bị evict bởi tiến trình khác
+        return entry_path
+
+    def record(self, hits: int, misses: int, encode_seconds_saved: float = 0.0) -> None:
+        """Cộng dồn bộ đếm từ tiến trình khác (worker render) vào cache này."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.encode_seconds_saved += encode_seconds_saved
+
+    # --- Evict / thống kê ---
+    def evict(self, protect: Iterable[str] = ()) -> int:
+        """
+        Xóa các entry ít dùng gần đây nhất cho đến khi tổng dung lượng <= max_bytes.
+        Bỏ qua các khóa trong protect và entry được dùng trong in_use_seconds (cache có thể tạm vượt max_bytes).
+        """
+        protected = set(protect)
+        in_use_after = time.time() - self.in_use_seconds
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.mp4') or name.startswith('.tmp_'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        removed = 0
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            key = name[:-len('.mp4')]
+            if key in protected or mtime >= in_use_after:
+                continue
+            for path in (self._entry_path(key), self._meta_path(key)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Clip cache evicted {removed} entries, size now {total} bytes")
+        if total > self.max_bytes:
+            logger.warning(f"Clip cache over limit ({total} > {self.max_bytes} bytes): remaining entries are in use")
+        return removed
+
+    def stats(self) -> dict:
+        entries = 0
+        size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.mp4') or name.startswith('.tmp_'):
+                continue
+            try:
+                size += os.path.getsize(os.path.join(self.cache_dir, name))
+                entries += 1
+            except OSError:
+                continue
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'encode_seconds_saved': round(self.encode_seconds_saved, 3),
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Cache dùng chung cho pipeline
+clip_cache = ClipCache()
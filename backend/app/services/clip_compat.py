@@ -0,0 +1,75 @@
+# backend/app/services/clip_compat.py
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.services.media_probe import ProbeResult
+
+logger = logging.getLogger(__name__)
+
+# Encoder dùng để chuẩn hóa clip lệch về codec đích (codec_name của ffprobe -> encoder ffmpeg)
+NORMALIZE_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+
+
+@dataclass(frozen=True)
+class ClipSignature:
+    """Các thuộc tính luồng video phải trùng nhau để concat demuxer ghép được với c=copy."""
+    codec_name: str
+    profile: Optional[str]
+    width: int
+    height: int
+    frame_rate: str
+    time_base: str
+    pix_fmt: Optional[str]
+
+
+@dataclass
+class CompatibilityReport:
+    """Kết quả phân tích: chữ ký đích và chỉ số các clip cần chuẩn hóa."""
+    target: ClipSignature
+    signatures: List[ClipSignature]
+    mismatched: List[int] = field(default_factory=list)
+
+    @property
+    def all_compatible(self) -> bool:
+        return not self.mismatched
+
+    @property
+    def target_encoder(self) -> Optional[str]:
+        return NORMALIZE_ENCODERS.get(self.target.codec_name)
+
+
+def clip_signature(probe: ProbeResult) -> ClipSignature:
+    """Tạo chữ ký từ kết quả probe của một clip (luồng video đầu tiên)."""
+    video_info = probe.video_stream
+    if not video_info:
+        raise ValueError("Clip has no video stream.")
+    return ClipSignature(
+        codec_name=video_info.get('codec_name', ''),
+        profile=video_info.get('profile'),
+        width=int(video_info.get('width', 0)),
+        height=int(video_info.get('height', 0)),
+        frame_rate=video_info.get('r_frame_rate', '0/0'),
+        time_base=video_info.get('time_base', '0/0'),
+        pix_fmt=video_info.get('pix_fmt'),
+    )
+
+
+def analyze_compatibility(probes: List[ProbeResult]) -> CompatibilityReport:
+    """
+    So sánh chữ ký các clip. Chữ ký phổ biến nhất được chọn làm đích
+    để số clip phải chuẩn hóa (encode lại) là ít nhất.
+    """
+    if not probes:
+        raise ValueError("No probe data to analyze.")
+    signatures = [clip_signature(probe) for probe in probes]
+    # Counter giữ thứ tự xuất hiện khi bằng số lượng -> ưu tiên clip đầu tiên
+    target = Counter(signatures).most_common(1)[0][0]
+    mismatched = [idx for idx, signature in enumerate(signatures) if signature != target]
+    logger.info(f"Clip compatibility: target={target}, {len(mismatched)}/{len(signatures)} clips need normalization")
+    return CompatibilityReport(target=target, signatures=signatures, mismatched=mismatched)
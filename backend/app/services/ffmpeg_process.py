@@ -0,0 +1,218 @@
+# backend/app/services/ffmpeg_process.py
+
+import os
+import signal
+import logging
+import subprocess
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env, 0 = tắt) ---
+# Timeout của một lệnh ffmpeg = BASE + PER_MEDIA_SECOND * số giây media cần xử lý
+FFMPEG_TIMEOUT_BASE_SECONDS = float(os.environ.get("FFMPEG_TIMEOUT_BASE_SECONDS", 900))
+FFMPEG_TIMEOUT_PER_MEDIA_SECOND = float(os.environ.get("FFMPEG_TIMEOUT_PER_MEDIA_SECOND", 5))
+# Ghi đè timeout (giây) cho từng stage, ví dụ "hls=600,subtitles=3600"
+FFMPEG_STAGE_TIMEOUTS = os.environ.get("FFMPEG_STAGE_TIMEOUTS", "")
+# ffmpeg không ghi dòng progress nào trong khoảng này -> coi như treo
+FFMPEG_STALL_TIMEOUT = float(os.environ.get("FFMPEG_STALL_TIMEOUT", 180))
+# Timeout của một lệnh ffprobe (probe/keyframes); ffprobe chỉ ghi output ở cuối nên không kiểm tra treo
+FFPROBE_TIMEOUT_SECONDS = float(os.environ.get("FFPROBE_TIMEOUT_SECONDS", 120))
+# Chu kỳ watchdog kiểm tra hủy/timeout
+FFMPEG_WATCHDOG_INTERVAL = float(os.environ.get("FFMPEG_WATCHDOG_INTERVAL", 0.5))
+# Giới hạn tài nguyên cho mỗi tiến trình ffmpeg con
+FFMPEG_MAX_MEMORY_MB = int(os.environ.get("FFMPEG_MAX_MEMORY_MB", 0)) # RLIMIT_AS
+FFMPEG_MAX_CPU_SECONDS = int(os.environ.get("FFMPEG_MAX_CPU_SECONDS", 0)) # RLIMIT_CPU
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", 0))
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+KILL_CANCELLED = "cancelled"
+KILL_TIMEOUT = "timeout"
+KILL_STALLED = "stalled"
+
+
+class ProcessTimeout(Exception):
+    """Lệnh ffmpeg vượt timeout của stage hoặc bị treo nên đã bị kill."""
+
+
+class RenderCancelled(Exception):
+    """Job bị hủy (ví dụ preview bị từ chối) trong khi đang render."""
+
+
+# Event hủy của job hiện tại (threading.Event hoặc proxy Manager().Event(); None nếu không hủy được).
+# Nằm ở đây để cả ffmpeg (video_processing) lẫn ffprobe (media_probe) cùng dừng khi job bị hủy.
+cancel_event_var: ContextVar[Optional[object]] = ContextVar("_cancel_event", default=None)
+
+
+def _parse_stage_timeouts(value: str) -> Dict[str, float]:
+    timeouts = {}
+    for item in value.split(','):
+        stage, _, seconds = item.partition('=')
+        if not stage.strip():
+            continue
+        try:
+            timeouts[stage.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid FFMPEG_STAGE_TIMEOUTS entry '{item}'")
+    return timeouts
+
+
+_STAGE_TIMEOUTS = _parse_stage_timeouts(FFMPEG_STAGE_TIMEOUTS)
+
+
+def stage_timeout(stage: str, expected_duration: Optional[float] = None,
+                  base: float = FFMPEG_TIMEOUT_BASE_SECONDS) -> Optional[float]:
+    """Timeout (giây) cho một lệnh ffmpeg/ffprobe của stage; None = không giới hạn."""
+    timeout = _STAGE_TIMEOUTS.get(stage)
+    if timeout is None:
+        timeout = base + FFMPEG_TIMEOUT_PER_MEDIA_SECOND * (expected_duration or 0.0)
+    return timeout if timeout > 0 else None
+
+
+def _resource_limits() -> List[Tuple[int, int]]:
+    if resource is None:
+        return []
+    limits = [(resource.RLIMIT_CORE, 0)] # ffmpeg crash không được đổ core làm đầy đĩa
+    if FFMPEG_MAX_MEMORY_MB > 0:
+        limits.append((resource.RLIMIT_AS, FFMPEG_MAX_MEMORY_MB * 1024 * 1024))
+    if FFMPEG_MAX_CPU_SECONDS > 0:
+        limits.append((resource.RLIMIT_CPU, FFMPEG_MAX_CPU_SECONDS))
+    return limits
+
+
+def _apply_resource_limits(pid: int) -> None:
+    """
+    Đặt rlimit/nice cho tiến trình con ngay sau khi spawn (prlimit), thay vì preexec_fn
+    vốn không an toàn khi nhiều luồng cùng spawn ffmpeg (parallel_render).
+    """
+    if resource is not None and hasattr(resource, 'prlimit'):
+        for limit, value in _resource_limits():
+            try:
+                _, hard = resource.prlimit(pid, limit)
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                resource.prlimit(pid, limit, (value, hard))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not set resource limit {limit} on ffmpeg pid {pid}: {e}")
+    if FFMPEG_NICE and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, FFMPEG_NICE)
+        except OSError as e:
+            logger.warning(f"Could not renice ffmpeg pid {pid}: {e}")
+
+
+class ManagedProcess:
+    """
+    Một lệnh ffmpeg chạy trong session (nhóm tiến trình) riêng, kèm luồng watchdog kill cả nhóm khi
+    job bị hủy, khi vượt timeout của stage hoặc khi không có dòng progress nào trong FFMPEG_STALL_TIMEOUT.
+    Nhờ vậy job bị hủy dừng ngay cả khi ffmpeg đang treo (không còn ghi progress).
+    """
+
+    def __init__(self, args: List[str], stage: str, timeout: Optional[float] = None, cancel_event=None,
+                 stall_timeout: float = FFMPEG_STALL_TIMEOUT):
+        self.args = args
+        self.stage = stage
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.stall_timeout = stall_timeout
+        self.killed_reason: Optional[str] = None
+        self.process: Optional[subprocess.Popen] = None
+        self._last_activity = time.monotonic()
+        self._stderr_chunks: List[bytes] = []
+        self._done = threading.Event()
+
+    def start(self) -> "ManagedProcess":
+        popen_kwargs = {}
+        if os.name == 'posix':
+            popen_kwargs['start_new_session'] = True
+        else:
+            popen_kwargs['creationflags'] = getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)
+        self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+        _apply_resource_limits(self.process.pid)
+        self._started = time.monotonic()
+        self._last_activity = self._started
+        # Đọc stderr ở luồng riêng để pipe không bị đầy khi ffmpeg log nhiều
+        self._stderr_reader = threading.Thread(target=lambda: self._stderr_chunks.append(self.process.stderr.read()), daemon=True)
+        self._stderr_reader.start()
+        self._watchdog = threading.Thread(target=self._watch, name=f"ffmpeg-watchdog-{self.stage}", daemon=True)
+        self._watchdog.start()
+        return self
+
+    def __enter__(self) -> "ManagedProcess":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Lỗi/ngắt (ví dụ KeyboardInterrupt) giữa chừng: không để lại ffmpeg mồ côi trong session riêng
+        self._done.set()
+        if self.process is not None and self.process.poll() is None:
+            self.kill(KILL_CANCELLED)
+            self.process.wait()
+
+    @property
+    def stdout(self):
+        return self.process.stdout
+
+    def touch(self) -> None:
+        """Ghi nhận ffmpeg vẫn đang tiến triển (gọi mỗi dòng progress)."""
+        self._last_activity = time.monotonic()
+
+    def kill(self, reason: str) -> None:
+        """Kill cả nhóm tiến trình (ffmpeg và mọi tiến trình con của nó)."""
+        if self.process is None or self.process.poll() is not None:
+            return
+        if self.killed_reason is None:
+            self.killed_reason = reason
+        try:
+            if os.name == 'posix':
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass # Tiến trình vừa thoát
+        metrics.ffmpeg_killed.inc(stage=self.stage, reason=reason)
+
+    def wait(self) -> Tuple[int, bytes]:
+        """
+        Chờ ffmpeg kết thúc, trả về (returncode, stderr).
+        Raise ProcessTimeout nếu watchdog đã kill vì timeout/treo; việc hủy để caller tự xử lý qua killed_reason.
+        """
+        returncode = self.process.wait()
+        self._stderr_reader.join()
+        self._done.set()
+        stderr = b''.join(self._stderr_chunks)
+        if self.killed_reason == KILL_TIMEOUT:
+            raise ProcessTimeout(f"ffmpeg stage '{self.stage}' exceeded its {self.timeout:.0f}s timeout and was killed.")
+        if self.killed_reason == KILL_STALLED:
+            raise ProcessTimeout(f"ffmpeg stage '{self.stage}' reported no progress for {self.stall_timeout:.0f}s and was killed.")
+        return returncode, stderr
+
+    def _watch(self) -> None:
+        while not self._done.wait(FFMPEG_WATCHDOG_INTERVAL):
+            if self.process.poll() is not None:
+                return
+            now = time.monotonic()
+            try:
+                cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+            except (EOFError, OSError):
+                cancelled = True # Manager của scheduler đã tắt (server dừng) -> job không còn ai chờ
+            if cancelled:
+                logger.info(f"Killing ffmpeg ({self.stage}): job cancelled")
+                self.kill(KILL_CANCELLED)
+            elif self.timeout and now - self._started > self.timeout:
+                logger.error(f"Killing ffmpeg ({self.stage}): exceeded {self.timeout:.0f}s timeout")
+                self.kill(KILL_TIMEOUT)
+            elif self.stall_timeout > 0 and now - self._last_activity > self.stall_timeout:
+                logger.error(f"Killing ffmpeg ({self.stage}): no progress for {self.stall_timeout:.0f}s")
+                self.kill(KILL_STALLED)
+            else:
+                continue
+            return
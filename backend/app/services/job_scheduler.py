@@ -0,0 +1,459 @@
+# backend/app/services/job_scheduler.py
+
+import os
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+CPU_COUNT = os.cpu_count() or 1
+# Mỗi job libx264 tự dùng nhiều luồng nên số job chạy song song nhỏ hơn nhiều so với số core
+RENDER_MAX_WORKERS = int(os.environ.get("RENDER_MAX_WORKERS", max(1, CPU_COUNT // 4)))
+# Ngân sách luồng ffmpeg cho mỗi job để tổng số luồng không vượt quá số core (0 = số core / số worker)
+RENDER_FFMPEG_THREADS = int(os.environ.get("RENDER_FFMPEG_THREADS", 0))
+# Số job đã kết thúc được giữ lại trong bộ nhớ để tra cứu trạng thái
+MAX_FINISHED_JOBS = int(os.environ.get("MAX_FINISHED_JOBS", 1000))
+# Khi admission check từ chối (ví dụ thiếu dung lượng đĩa), dispatcher thử lại sau số giây này
+ADMISSION_RETRY_SECONDS = float(os.environ.get("ADMISSION_RETRY_SECONDS", 5))
+# Job đang chạy khi một worker chết (pool hỏng) được đưa lại hàng đợi tối đa số lần này rồi mới báo lỗi
+RENDER_CRASH_RETRIES = int(os.environ.get("RENDER_CRASH_RETRIES", 1))
+
+# Độ ưu tiên: số nhỏ chạy trước; cùng độ ưu tiên thì FIFO
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+@dataclass
+class RenderJob:
+    """Trạng thái một job render trong scheduler."""
+    job_id: str
+    params: Dict[str, Any]
+    priority: int = PRIORITY_NORMAL
+    status: str = "queued" # queued | running | completed | failed | cancelled
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+    progress: Dict[str, Any] = field(default_factory=dict)
+    preview_path: Optional[str] = None
+    cancel_requested: bool = False
+    crash_retries: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "output_path": self.output_path,
+            "error": self.error,
+            "progress": dict(self.progress),
+            "preview_path": self.preview_path,
+            "preview_ready": self.preview_path is not None,
+        }
+
+
+def _init_worker(ffmpeg_threads: int) -> None:
+    """Chạy một lần trong mỗi tiến trình worker: đặt ngân sách luồng ffmpeg."""
+    from app.services import video_processing
+    video_processing.FFMPEG_THREADS = ffmpeg_threads
+
+
+def _run_render_job(job_id: str, params: Dict[str, Any], events, cancel_event) -> Dict[str, Any]:
+    """
+    Chạy process_video trong tiến trình worker, trả về kết quả và thống kê clip cache/audio cache.
+    Tiến độ, preview và metric được đẩy về tiến trình chính qua hàng đợi `events` (Manager queue)
+    dưới dạng (job_id, loại, dữ liệu); cancel_event (Manager Event) dừng job giữa chừng.
+    """
+    from app.services.clip_cache import clip_cache
+    from app.services.media_probe import audio_analysis_cache
+    from app.services.video_processing import process_video
+
+    before = (clip_cache.hits, clip_cache.misses, clip_cache.encode_seconds_saved)
+    audio_before = (audio_analysis_cache.hits, audio_analysis_cache.misses)
+    previews: List[str] = []
+
+    def on_preview(path: str) -> None:
+        previews.append(path)
+        events.put((job_id, "preview", path))
+
+    # Metric ghi trong worker được cộng vào registry của tiến trình chính (nơi phục vụ /metrics)
+    metrics.registry.set_forwarder(lambda record: events.put((job_id, "metric", record)))
+    try:
+        with metrics.bind(job_id=job_id):
+            output_path = process_video(
+                **params,
+                progress_callback=lambda progress: events.put((job_id, "progress", progress)),
+                preview_callback=on_preview,
+                cancel_event=cancel_event,
+            )
+    finally:
+        metrics.registry.set_forwarder(None)
+    return {
+        "output_path": output_path,
+        # Kết quả của future có thể tới trước event preview trên hàng đợi -> gửi kèm để không bị mất
+        "preview_path": previews[-1] if previews else None,
+        "cache": {
+            "hits": clip_cache.hits - before[0],
+            "misses": clip_cache.misses - before[1],
+            "encode_seconds_saved": clip_cache.encode_seconds_saved - before[2],
+            "audio_hits": audio_analysis_cache.hits - audio_before[0],
+            "audio_misses": audio_analysis_cache.misses - audio_before[1],
+        },
+    }
+
+
+class JobScheduler:
+    """
+    Hàng đợi ưu tiên + process pool giới hạn cho các job render.
+    Một luồng dispatcher lấy job từ hàng đợi khi còn slot trống, nên job
+    đang chờ vẫn còn trong hàng đợi (có thể báo vị trí) thay vì bị dồn vào pool.
+    """
+
+    def __init__(self, max_workers: int = RENDER_MAX_WORKERS, ffmpeg_threads: int = RENDER_FFMPEG_THREADS):
+        self.max_workers = max(1, max_workers)
+        self.ffmpeg_threads = ffmpeg_threads if ffmpeg_threads > 0 else max(1, CPU_COUNT // self.max_workers)
+        self._queue: List[tuple] = [] # heap (priority, seq, job_id)
+        self._seq = itertools.count()
+        self._jobs: Dict[str, RenderJob] = {}
+        self._running = 0
+        self._cond = threading.Condition()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._manager = None
+        self._events = None
+        self._cancel_events: Dict[str, Any] = {} # job_id -> Manager Event của job đang chạy
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = False
+        self._admission_check: Optional[Callable[[], bool]] = None
+        self._start_listeners: List[Callable[[RenderJob], None]] = []
+        self._finish_listeners: List[Callable[[RenderJob], None]] = []
+
+    # --- Vòng đời ---
+    def start(self) -> None:
+        with self._cond:
+            if self._executor is not None:
+                return
+            # 'spawn' tránh fork một tiến trình đang có nhiều luồng (uvicorn, dispatcher)
+            context = multiprocessing.get_context("spawn")
+            self._manager = context.Manager()
+            self._events = self._manager.Queue()
+            self._listener = threading.Thread(target=self._listen_events, args=(self._events,), name="render-progress", daemon=True)
+            self._listener.start()
+            self._executor = self._new_executor()
+            self._stopping = False
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="render-dispatcher", daemon=True)
+            self._dispatcher.start()
+        metrics.scheduler_jobs.set_function(self._job_counts)
+        logger.info(f"Job scheduler started: {self.max_workers} workers, {self.ffmpeg_threads} ffmpeg threads per job")
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.ffmpeg_threads,),
+        )
+
+    def _replace_broken_executor(self, broken: ProcessPoolExecutor) -> Optional[ProcessPoolExecutor]:
+        """
+        Một worker chết (OOM kill, segfault) làm cả ProcessPoolExecutor hỏng vĩnh viễn: tạo pool mới
+        để các job sau vẫn chạy được. Nhiều job cùng thấy pool hỏng -> chỉ job đầu tiên tạo lại.
+        """
+        with self._cond:
+            if self._stopping or self._executor is None:
+                return None
+            if self._executor is broken:
+                logger.error("Render worker pool is broken (a worker died); starting a new pool")
+                self._executor = self._new_executor()
+            executor = self._executor
+        broken.shutdown(wait=False, cancel_futures=True)
+        return executor
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            executor, self._executor = self._executor, None
+            manager, self._manager = self._manager, None
+            events, self._events = self._events, None
+            cancel_events = list(self._cancel_events.values())
+        # ffmpeg chạy trong session riêng nên không nhận tín hiệu dừng của server: báo hủy để watchdog kill
+        for cancel_event in cancel_events:
+            try:
+                cancel_event.set()
+            except (EOFError, OSError):
+                pass
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if events is not None:
+            events.put((None, None, None)) # Báo luồng listener dừng
+        if manager is not None:
+            manager.shutdown()
+        logger.info("Job scheduler stopped.")
+
+    # --- API ---
+    def submit(self, job_id: str, params: Dict[str, Any], priority: int = PRIORITY_NORMAL) -> RenderJob:
+        """Đưa job vào hàng đợi. params là các tham số keyword của process_video."""
+        self.start()
+        job = RenderJob(job_id=job_id, params=params, priority=priority)
+        with self._cond:
+            if job_id in self._jobs:
+                raise ValueError(f"Job {job_id} already exists.")
+            self._jobs[job_id] = job
+            heapq.heappush(self._queue, (priority, next(self._seq), job_id))
+            self._cond.notify_all()
+        logger.info(f"Job {job_id} queued (priority={priority}, position={self.queue_position(job_id)})")
+        return job
+
+    def set_admission_check(self, check: Optional[Callable[[], bool]]) -> None:
+        """Hàm trả về False khi chưa nên bắt đầu job mới (job vẫn nằm trong hàng đợi)."""
+        with self._cond:
+            self._admission_check = check
+            self._cond.notify_all()
+
+    def add_start_listener(self, listener: Callable[[RenderJob], None]) -> None:
+        """Gọi listener(job) khi job rời hàng đợi và bắt đầu chạy, trong luồng dispatcher."""
+        self._start_listeners.append(listener)
+
+    def add_finish_listener(self, listener: Callable[[RenderJob], None]) -> None:
+        """Gọi listener(job) mỗi khi job kết thúc (completed/failed/cancelled), ngoài lock của scheduler."""
+        self._finish_listeners.append(listener)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Hủy một job: job đang chờ bị bỏ khỏi hàng đợi ngay, job đang chạy nhận event hủy
+        (watchdog kill cả nhóm tiến trình ffmpeg trong vòng FFMPEG_WATCHDOG_INTERVAL, kể cả khi ffmpeg đang treo).
+        Trả về False nếu job không tồn tại hoặc đã kết thúc.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_requested = True
+            cancelled_while_queued = job.status == "queued"
+            if cancelled_while_queued:
+                self._queue = [entry for entry in self._queue if entry[2] != job_id]
+                heapq.heapify(self._queue)
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                self._prune_finished()
+                self._cond.notify_all()
+                cancel_event = None
+            else:
+                cancel_event = self._cancel_events.get(job_id)
+        if cancelled_while_queued:
+            metrics.jobs_total.inc(status="cancelled")
+            self._notify_finished(job)
+        if cancel_event is not None:
+            cancel_event.set()
+        logger.info(f"Job {job_id} cancellation requested")
+        return True
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def running_since(self) -> Optional[float]:
+        """Thời điểm bắt đầu của job đang chạy lâu nhất, None nếu không có job nào đang chạy."""
+        with self._cond:
+            started = [job.started_at for job in self._jobs.values() if job.status == "running" and job.started_at]
+        return min(started, default=None)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """Vị trí (bắt đầu từ 1) của job trong hàng đợi, None nếu job không còn chờ."""
+        with self._cond:
+            for position, (_, _, queued_id) in enumerate(sorted(self._queue), start=1):
+                if queued_id == job_id:
+                    return position
+        return None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_workers": self.max_workers,
+                "ffmpeg_threads_per_job": self.ffmpeg_threads,
+                "running": self._running,
+                "queued": len(self._queue),
+                "admitting": self._admitted(),
+            }
+
+    # --- Nội bộ ---
+    def _admitted(self) -> bool:
+        if self._admission_check is None:
+            return True
+        try:
+            return self._admission_check()
+        except Exception as e:
+            logger.warning(f"Admission check failed, admitting job: {e}")
+            return True
+
+    def _notify(self, listeners: List[Callable[[RenderJob], None]], job: RenderJob) -> None:
+        for listener in listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"Job listener failed for job {job.job_id}: {e}")
+
+    def _notify_finished(self, job: RenderJob) -> None:
+        self._notify(self._finish_listeners, job)
+
+    def _job_counts(self) -> Dict[tuple, float]:
+        with self._cond:
+            return {("queued",): len(self._queue), ("running",): self._running}
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if not self._queue or self._running >= self.max_workers:
+                        self._cond.wait()
+                    elif not self._admitted():
+                        # Giữ job trong hàng đợi, kiểm tra lại định kỳ
+                        self._cond.wait(timeout=ADMISSION_RETRY_SECONDS)
+                    else:
+                        break
+                if self._stopping:
+                    return
+                _, _, job_id = heapq.heappop(self._queue)
+                job = self._jobs[job_id]
+                job.status = "running"
+                job.started_at = time.time()
+                self._running += 1
+                executor = self._executor
+                cancel_event = self._manager.Event()
+                self._cancel_events[job_id] = cancel_event
+
+            logger.info(f"Job {job_id} started (waited {job.started_at - job.submitted_at:.1f}s)")
+            metrics.job_queue_wait.observe(job.started_at - job.submitted_at)
+            self._notify(self._start_listeners, job)
+            try:
+                try:
+                    future = executor.submit(_run_render_job, job_id, job.params, self._events, cancel_event)
+                except BrokenProcessPool:
+                    executor = self._replace_broken_executor(executor)
+                    if executor is None:
+                        raise
+                    future = executor.submit(_run_render_job, job_id, job.params, self._events, cancel_event)
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            future.add_done_callback(lambda fut, job=job, executor=executor: self._on_done(job, fut, executor))
+
+    def _listen_events(self, events) -> None:
+        """Nhận tiến độ/preview từ các worker và cập nhật trạng thái job tương ứng."""
+        while True:
+            try:
+                job_id, kind, payload = events.get()
+            except (EOFError, OSError):
+                return # Manager đã tắt
+            if job_id is None:
+                return
+            if kind == "metric":
+                metrics.registry.apply(payload)
+                continue
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if kind == "progress" and not job.finished:
+                    job.progress = payload
+                elif kind == "preview" and job.status != "cancelled":
+                    # Preview xong trước khi job lỗi vẫn hữu ích, kể cả khi event tới sau trạng thái cuối
+                    job.preview_path = payload
+
+    def _on_done(self, job: RenderJob, future: Future, executor: ProcessPoolExecutor) -> None:
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            # Chỉ các job đang chạy trong pool hỏng bị ảnh hưởng; job trong hàng đợi chạy trên pool mới.
+            # Không biết job nào làm worker chết nên mỗi job được chạy lại RENDER_CRASH_RETRIES lần.
+            self._replace_broken_executor(executor)
+            if not self._requeue_after_crash(job):
+                self._finish(job, error=RuntimeError(f"Render worker process died unexpectedly: {e}"))
+            return
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        # Bộ đếm clip cache/audio cache nằm trong tiến trình worker -> cộng dồn về tiến trình chính
+        from app.services.clip_cache import clip_cache
+        from app.services.media_probe import audio_analysis_cache
+        cache = result.get("cache", {})
+        clip_cache.record(cache.get("hits", 0), cache.get("misses", 0), cache.get("encode_seconds_saved", 0.0))
+        audio_analysis_cache.record(cache.get("audio_hits", 0), cache.get("audio_misses", 0))
+        self._finish(job, output_path=result.get("output_path"), preview_path=result.get("preview_path"))
+
+    def _requeue_after_crash(self, job: RenderJob) -> bool:
+        with self._cond:
+            if self._stopping or job.cancel_requested or job.crash_retries >= RENDER_CRASH_RETRIES:
+                return False
+            job.crash_retries += 1
+            job.status = "queued"
+            job.started_at = None
+            job.progress = {}
+            self._cancel_events.pop(job.job_id, None)
+            self._running -= 1
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job.job_id))
+            self._cond.notify_all()
+        logger.warning(f"Job {job.job_id} requeued after its render worker died (retry {job.crash_retries}/{RENDER_CRASH_RETRIES})")
+        return True
+
+    def _finish(self, job: RenderJob, output_path: Optional[str] = None, error: Optional[BaseException] = None,
+                preview_path: Optional[str] = None) -> None:
+        with self._cond:
+            if preview_path:
+                job.preview_path = preview_path # Trước trạng thái cuối: client thấy completed thì cũng thấy preview
+            job.finished_at = time.time()
+            self._cancel_events.pop(job.job_id, None)
+            if error is not None and job.cancel_requested:
+                job.status = "cancelled"
+            elif error is not None:
+                job.status = "failed"
+                job.error = str(error)
+            else:
+                job.status = "completed"
+                job.output_path = output_path
+                job.progress = {**job.progress, "stage": "done", "percent": 100.0, "stage_percent": 100.0, "eta_seconds": 0}
+            self._running -= 1
+            self._prune_finished()
+            self._cond.notify_all()
+        metrics.jobs_total.inc(status=job.status)
+        metrics.job_duration.observe(job.finished_at - job.started_at, status=job.status)
+        self._notify_finished(job)
+        if job.status == "cancelled":
+            logger.info(f"Job {job.job_id} cancelled after {job.finished_at - job.started_at:.1f}s")
+        elif error is not None:
+            logger.error(f"Job {job.job_id} failed: {error}")
+        else:
+            logger.info(f"Job {job.job_id} completed in {job.finished_at - job.started_at:.1f}s: {output_path}")
+
+    def _prune_finished(self) -> None:
+        finished = [job for job in self._jobs.values() if job.finished]
+        if len(finished) <= MAX_FINISHED_JOBS:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - MAX_FINISHED_JOBS]:
+            del self._jobs[job.job_id]
+
+
+# Scheduler dùng chung cho API
+render_scheduler = JobScheduler()
@@ -0,0 +1,280 @@
+# backend/app/services/job_store.py
+
+import os
+import json
+import base64
+import sqlite3
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join(BACKEND_ROOT, "data", "jobs.sqlite3"))
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", 100))
+RESULTS_MAX_PAGE_SIZE = int(os.environ.get("RESULTS_MAX_PAGE_SIZE", 1000))
+
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+# Trạng thái chỉ tiến về phía trước: bản ghi cũ hơn (ví dụ "queued" tới muộn) không ghi đè bản ghi mới hơn
+_STATUS_RANK = {"queued": 0, "running": 1, "completed": 2, "failed": 2, "cancelled": 2}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    output_filename TEXT,
+    output_bytes INTEGER,
+    output_deleted INTEGER NOT NULL DEFAULT 0,
+    input_bytes INTEGER,
+    subtitle_mode TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_submitted ON jobs (status, submitted_at DESC, job_id DESC);
+CREATE INDEX IF NOT EXISTS jobs_submitted ON jobs (submitted_at DESC, job_id DESC);
+CREATE INDEX IF NOT EXISTS jobs_output_filename ON jobs (output_filename);
+CREATE TABLE IF NOT EXISTS job_inputs (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (job_id, sha256)
+);
+CREATE INDEX IF NOT EXISTS job_inputs_sha256 ON job_inputs (sha256);
+"""
+
+_COLUMNS = ("job_id", "status", "priority", "submitted_at", "started_at", "finished_at", "output_filename",
+            "output_bytes", "output_deleted", "input_bytes", "subtitle_mode", "error")
+
+
+def encode_cursor(submitted_at: float, job_id: str) -> str:
+    raw = json.dumps([submitted_at, job_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Cursor là vị trí (submitted_at, job_id) của phần tử cuối trang trước. Sai định dạng -> ValueError."""
+    try:
+        submitted_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(submitted_at), str(job_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class JobStore:
+    """
+    Chỉ mục job/kết quả trong SQLite: trạng thái, thời gian, dung lượng và hash input.
+    Thay cho việc duyệt thư mục output ở mỗi request; các hàm đều đồng bộ
+    nên API gọi qua asyncio.to_thread. Một kết nối dùng chung, bảo vệ bằng lock.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Kết nối được mở ở lần dùng đầu tiên (hoặc lúc app khởi động), không phải lúc import module
+        self._open_lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def open(self) -> sqlite3.Connection:
+        """Mở (một lần) file SQLite tại self.path và tạo schema; gọi lại nhiều lần không sao."""
+        with self._open_lock:
+            if self._connection is None:
+                if self.path != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                with conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute("PRAGMA foreign_keys=ON")
+                    conn.executescript(_SCHEMA)
+                self._connection = conn
+                logger.info(f"Job store opened at {self.path}")
+            return self._connection
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        return self._connection or self.open()
+
+    def close(self) -> None:
+        with self._lock, self._open_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    # --- Ghi ---
+    def save(self, job, input_bytes: Optional[int] = None) -> None:
+        """
+        Ghi (hoặc cập nhật) một RenderJob của scheduler. Gọi khi job được nhận, bắt đầu và kết thúc;
+        thứ tự gọi giữa các luồng không quan trọng vì trạng thái không bao giờ lùi.
+        """
+        params = job.params or {}
+        output_path = job.output_path or params.get("output_final_path")
+        output_bytes = None
+        if job.status == "completed" and job.output_path:
+            try:
+                output_bytes = os.path.getsize(job.output_path)
+            except OSError:
+                pass
+        row = {
+            "job_id": job.job_id,
+            "status": job.status,
+            "priority": job.priority,
+            "submitted_at": job.submitted_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "output_filename": os.path.basename(output_path) if output_path else None,
+            "output_bytes": output_bytes,
+            "output_deleted": 0,
+            "input_bytes": input_bytes,
+            "subtitle_mode": params.get("subtitle_mode"),
+            "error": job.error,
+        }
+        input_hashes = sorted(set((params.get("content_hashes") or {}).values()))
+
+        with self._lock, self._conn:
+            existing = self._conn.execute(
+                "SELECT status, input_bytes FROM jobs WHERE job_id = ?", (job.job_id,)).fetchone()
+            if existing is not None:
+                if _STATUS_RANK.get(existing["status"], 0) > _STATUS_RANK.get(job.status, 0):
+                    # Bản ghi tới muộn: chỉ bổ sung thông tin input còn thiếu
+                    if input_bytes is not None and existing["input_bytes"] is None:
+                        self._conn.execute("UPDATE jobs SET input_bytes = ? WHERE job_id = ?", (input_bytes, job.job_id))
+                    return
+                if row["input_bytes"] is None:
+                    row["input_bytes"] = existing["input_bytes"]
+            placeholders = ", ".join("?" for _ in _COLUMNS)
+            updates = ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (job_id) DO UPDATE SET {updates}",
+                tuple(row[column] for column in _COLUMNS),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO job_inputs (job_id, sha256) VALUES (?, ?)",
+                [(job.job_id, digest) for digest in input_hashes],
+            )
+
+    def mark_output_deleted(self, output_path: str) -> None:
+        """Đánh dấu output đã bị xóa khỏi đĩa (ví dụ do storage manager) để không còn liệt kê."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET output_deleted = 1 WHERE output_filename = ?", (os.path.basename(output_path),))
+
+    def reconcile(self, output_dir: str, ignore_prefixes: Sequence[str] = (".",)) -> dict:
+        """
+        Đồng bộ một lần lúc khởi động (duyệt thư mục output đúng một lần):
+        job còn queued/running từ lần chạy trước bị đánh dấu failed, output có trên đĩa nhưng chưa
+        có trong store được thêm vào, output trong store nhưng đã mất trên đĩa được đánh dấu đã xóa.
+        """
+        on_disk: Dict[str, os.stat_result] = {}
+        try:
+            with os.scandir(output_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.startswith(tuple(ignore_prefixes)):
+                        on_disk[entry.name] = entry.stat()
+        except FileNotFoundError:
+            pass
+
+        now = time.time()
+        with self._lock, self._conn:
+            interrupted = self._conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE status IN ('queued', 'running')",
+                (now, "Server restarted before the job finished."),
+            ).rowcount
+            known = {
+                row["output_filename"]: row["output_deleted"]
+                for row in self._conn.execute("SELECT output_filename, output_deleted FROM jobs WHERE status = 'completed'")
+            }
+            missing = [name for name, deleted in known.items() if name and not deleted and name not in on_disk]
+            self._conn.executemany("UPDATE jobs SET output_deleted = 1 WHERE output_filename = ?", [(name,) for name in missing])
+            imported = 0
+            for name, stat in on_disk.items():
+                if name in known:
+                    continue
+                stem = os.path.splitext(name)[0]
+                job_id = stem[len("output_"):] if stem.startswith("output_") else stem
+                imported += self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, status, submitted_at, finished_at, output_filename, output_bytes) "
+                    "VALUES (?, 'completed', ?, ?, ?, ?)",
+                    (job_id, stat.st_mtime, stat.st_mtime, name, stat.st_size),
+                ).rowcount
+        report = {"interrupted": interrupted, "imported": imported, "missing": len(missing)}
+        logger.info(f"Job store reconciled with {output_dir}: {report}")
+        return report
+
+    # --- Đọc ---
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        item = dict(row)
+        item["output_deleted"] = bool(item["output_deleted"])
+        return item
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def find_output(self, output_filename: str) -> Optional[Dict[str, Any]]:
+        """Job mới nhất ghi ra output_filename."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE output_filename = ? ORDER BY submitted_at DESC LIMIT 1",
+                (output_filename,),
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def input_hashes(self, job_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT sha256 FROM job_inputs WHERE job_id = ? ORDER BY sha256", (job_id,)).fetchall()
+        return [row["sha256"] for row in rows]
+
+    def list_jobs(self, status: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+                  input_hash: Optional[str] = None, include_deleted: bool = False,
+                  limit: int = RESULTS_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Một trang job, mới nhất trước (theo submitted_at, job_id), phân trang theo keyset:
+        truyền next_cursor của trang trước để lấy trang kế tiếp. Trả về (danh sách, next_cursor hoặc None).
+        """
+        if status is not None and status not in JOB_STATUSES:
+            raise ValueError(f"Unknown job status: {status}")
+        limit = max(1, min(limit, RESULTS_MAX_PAGE_SIZE))
+        clauses, args = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        if since is not None:
+            clauses.append("submitted_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("submitted_at < ?")
+            args.append(until)
+        if input_hash:
+            clauses.append("job_id IN (SELECT job_id FROM job_inputs WHERE sha256 = ?)")
+            args.append(input_hash)
+        if not include_deleted:
+            clauses.append("output_deleted = 0")
+        if cursor:
+            cursor_at, cursor_id = decode_cursor(cursor)
+            clauses.append("(submitted_at < ? OR (submitted_at = ? AND job_id < ?))")
+            args.extend((cursor_at, cursor_at, cursor_id))
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT * FROM jobs {where} ORDER BY submitted_at DESC, job_id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, (*args, limit + 1)).fetchall()
+
+        items = [self._to_dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last["submitted_at"], last["job_id"])
+        return items, next_cursor
+
+
+# Store dùng chung cho API và scheduler (tiến trình chính); file SQLite chỉ được mở khi app khởi động/dùng lần đầu
+job_store = JobStore()
@@ -0,0 +1,423 @@
+# backend/app/services/media_probe.py
+
+import os
+import json
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import ffmpeg
+
+from app.services.ffmpeg_process import (
+    FFPROBE_TIMEOUT_SECONDS, KILL_CANCELLED, ManagedProcess, ProcessTimeout, RenderCancelled, cancel_event_var, stage_timeout,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+# ffprobe chủ yếu chờ tiến trình con nên số luồng có thể lớn hơn số core
+PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", min(32, (os.cpu_count() or 1) * 2)))
+PROBE_CACHE_MAX_ENTRIES = int(os.environ.get("PROBE_CACHE_MAX_ENTRIES", 4096))
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Kết quả phân tích audio (theo content hash) được lưu trên đĩa để job lặp lại/thử lại không phải probe lại
+AUDIO_ANALYSIS_CACHE_DIR = os.environ.get("AUDIO_ANALYSIS_CACHE_DIR", os.path.join(BACKEND_ROOT, "cache", "audio"))
+# Số bản ghi tối đa (trong bộ nhớ và trên đĩa); vượt quá thì xóa bản ghi dùng lâu nhất trước. 0 = không giới hạn
+AUDIO_ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("AUDIO_ANALYSIS_CACHE_MAX_ENTRIES", 10000))
+# Tăng khi đổi định dạng AudioInfo để bỏ qua các bản ghi cũ
+AUDIO_ANALYSIS_VERSION = 1
+
+
+def _parse_frame_rate(rate: Optional[str], default: float = 30.0) -> float:
+    """Chuyển r_frame_rate dạng '30000/1001' thành số thực."""
+    try:
+        num, _, den = str(rate).partition('/')
+        value = float(num) / float(den or 1)
+        return value if value > 0 else default
+    except (ValueError, ZeroDivisionError):
+        return default
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """Kết quả ffprobe đã chuẩn hóa kiểu cho một file media."""
+    path: str
+    duration: float
+    size: int
+    format_name: str
+    streams: Tuple[dict, ...] = field(default_factory=tuple)
+
+    @property
+    def video_stream(self) -> Optional[dict]:
+        return next((stream for stream in self.streams if stream.get('codec_type') == 'video'), None)
+
+    @property
+    def audio_stream(self) -> Optional[dict]:
+        return next((stream for stream in self.streams if stream.get('codec_type') == 'audio'), None)
+
+    @property
+    def video_codec(self) -> Optional[str]:
+        return self.video_stream.get('codec_name') if self.video_stream else None
+
+    @property
+    def audio_codec(self) -> Optional[str]:
+        return self.audio_stream.get('codec_name') if self.audio_stream else None
+
+    @property
+    def width(self) -> int:
+        return int(self.video_stream.get('width', 0)) if self.video_stream else 0
+
+    @property
+    def height(self) -> int:
+        return int(self.video_stream.get('height', 0)) if self.video_stream else 0
+
+    @property
+    def frame_rate(self) -> str:
+        """r_frame_rate dạng phân số như ffprobe trả về (ví dụ '30000/1001')."""
+        return self.video_stream.get('r_frame_rate', '0/0') if self.video_stream else '0/0'
+
+    @property
+    def fps(self) -> float:
+        return _parse_frame_rate(self.frame_rate)
+
+    @property
+    def video_duration(self) -> float:
+        """
+        Độ dài luồng video (clip chỉ được ghép phần video); container không ghi duration theo luồng
+        (ví dụ MKV/WebM) thì dùng duration của format, vốn có thể dài hơn do luồng audio.
+        """
+        try:
+            duration = float(self.video_stream.get('duration')) if self.video_stream else 0.0
+        except (TypeError, ValueError):
+            duration = 0.0 # 'N/A' hoặc thiếu
+        return duration if duration > 0 else self.duration
+
+    @classmethod
+    def from_ffprobe(cls, path: str, probe: dict) -> "ProbeResult":
+        if 'format' not in probe or 'duration' not in probe['format']:
+            raise ValueError(f"Could not get duration from probe result for {path}.")
+        return cls(
+            path=path,
+            duration=float(probe['format']['duration']),
+            size=int(probe['format'].get('size', 0) or 0),
+            format_name=probe['format'].get('format_name', ''),
+            streams=tuple(probe.get('streams', [])),
+        )
+
+
+class ProbeCache:
+    """
+    Cache kết quả probe (LRU, an toàn đa luồng).
+    Khóa là (đường dẫn, size, mtime) hoặc content hash nếu đã biết.
+    """
+
+    def __init__(self, max_entries: int = PROBE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, ProbeResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(path: str, content_hash: Optional[str] = None) -> tuple:
+        if content_hash:
+            return ('sha256', content_hash)
+        stat = os.stat(path)
+        return ('stat', path, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, key: tuple) -> Optional[ProbeResult]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: tuple, result: ProbeResult) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Cache dùng chung trong tiến trình cho mọi bước của pipeline
+probe_cache = ProbeCache()
+
+
+def _run_ffprobe(abs_path: str, stage: str, **options) -> dict:
+    """
+    Tương đương ffmpeg.probe nhưng chạy dưới ManagedProcess: có timeout (FFPROBE_TIMEOUT_SECONDS),
+    rlimit và bị kill khi job bị hủy (raise RenderCancelled), để file hỏng không giữ worker mãi.
+    """
+    args = ['ffprobe', '-show_format', '-show_streams', '-of', 'json']
+    for key in sorted(options):
+        args += [f'-{key}', str(options[key])]
+    args.append(abs_path)
+    with ManagedProcess(args, stage, timeout=stage_timeout(stage, base=FFPROBE_TIMEOUT_SECONDS),
+                        cancel_event=cancel_event_var.get(), stall_timeout=0) as process:
+        out = process.stdout.read()
+        returncode, err = process.wait()
+    if process.killed_reason == KILL_CANCELLED:
+        raise RenderCancelled("Render cancelled.")
+    if returncode != 0:
+        raise ffmpeg.Error('ffprobe', out, err)
+    return json.loads(out.decode('utf-8'))
+
+
+def probe_media(path: str, content_hash: Optional[str] = None, cache: Optional[ProbeCache] = None) -> ProbeResult:
+    """
+    Probe một file (đọc từ cache nếu có). Lỗi ffprobe được chuyển thành ValueError.
+    """
+    cache = cache or probe_cache
+    abs_path = os.path.abspath(path)
+    if not os.path.exists(abs_path):
+        raise ValueError(f"Media file does not exist at path: {abs_path}")
+
+    key = cache.key_for(abs_path, content_hash)
+    cached = cache.get(key)
+    if cached is not None:
+        # Cache theo hash có thể trỏ tới bản sao cùng nội dung ở đường dẫn khác
+        return cached if cached.path == abs_path else ProbeResult(abs_path, cached.duration, cached.size, cached.format_name, cached.streams)
+
+    try:
+        probe = _run_ffprobe(abs_path, 'probe')
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg.probe error for file: {abs_path}")
+        logger.error(f"ffprobe stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        raise ValueError(f"Failed to probe {abs_path}") from e
+    except ProcessTimeout as e:
+        raise ValueError(f"Timed out probing {abs_path}: {e}") from e
+
+    result = ProbeResult.from_ffprobe(abs_path, probe)
+    cache.put(key, result)
+    logger.info(f"Probed {abs_path}: duration={result.duration}, video={result.video_codec}, audio={result.audio_codec}")
+    return result
+
+
+def probe_many(paths: List[str], content_hashes: Optional[Dict[str, str]] = None,
+               max_workers: int = PROBE_WORKERS, cache: Optional[ProbeCache] = None) -> List[Optional[ProbeResult]]:
+    """
+    Probe song song nhiều file qua một pool luồng.
+    Trả về danh sách cùng thứ tự với `paths`; phần tử là None nếu file lỗi.
+    """
+    content_hashes = content_hashes or {}
+
+    def _probe_one(path: str) -> Optional[ProbeResult]:
+        try:
+            return probe_media(path, content_hashes.get(path), cache)
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            logger.warning(f"Skipping media file due to probe error: {path} - {e}")
+            return None
+
+    if len(paths) <= 1:
+        return [_probe_one(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(paths))), thread_name_prefix="probe") as executor:
+        # Mỗi luồng cần bản sao context để thấy event hủy của job (ContextVar không tự truyền sang luồng)
+        futures = [executor.submit(contextvars.copy_context().run, _probe_one, path) for path in paths]
+        return [future.result() for future in futures]
+
+
+@dataclass(frozen=True)
+class AudioInfo:
+    """Thông tin luồng audio đầu tiên của một file, đủ để quyết định copy hay encode lại."""
+    duration: float
+    codec: Optional[str]
+    sample_rate: int
+    channels: int
+    bit_rate: Optional[int] = None
+
+    @classmethod
+    def from_probe(cls, probe: ProbeResult) -> "AudioInfo":
+        stream = probe.audio_stream
+        if stream is None:
+            raise ValueError(f"No audio stream found in {probe.path}.")
+        bit_rate = stream.get('bit_rate')
+        return cls(
+            duration=probe.duration,
+            codec=stream.get('codec_name'),
+            sample_rate=int(stream.get('sample_rate', 0) or 0),
+            channels=int(stream.get('channels', 0) or 0),
+            bit_rate=int(bit_rate) if str(bit_rate or '').isdigit() else None,
+        )
+
+
+class AudioAnalysisCache:
+    """
+    Cache AudioInfo theo SHA-256 nội dung: trong bộ nhớ + một file JSON nhỏ mỗi hash trên đĩa
+    (ghi qua os.replace nên nhiều tiến trình worker dùng chung thư mục được).
+    Giới hạn max_entries bản ghi, evict theo LRU (mtime của file JSON được cập nhật mỗi lần hit).
+    """
+
+    def __init__(self, cache_dir: str = AUDIO_ANALYSIS_CACHE_DIR, max_entries: int = AUDIO_ANALYSIS_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries: "OrderedDict[str, AudioInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.json")
+
+    def _remember(self, content_hash: str, info: AudioInfo) -> None:
+        """Ghi vào bộ nhớ (đang giữ lock), bỏ bản ghi dùng lâu nhất nếu vượt max_entries."""
+        self._entries[content_hash] = info
+        self._entries.move_to_end(content_hash)
+        while self.max_entries and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, content_hash: str) -> Optional[AudioInfo]:
+        with self._lock:
+            info = self._entries.get(content_hash)
+        if info is None:
+            try:
+                with open(self._path(content_hash), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                if record.get('version') == AUDIO_ANALYSIS_VERSION:
+                    info = AudioInfo(**record['audio'])
+            except (OSError, ValueError, TypeError, KeyError):
+                info = None
+        if info is not None:
+            try:
+                os.utime(self._path(content_hash), None) # Đánh dấu vừa dùng cho LRU trên đĩa
+            except OSError:
+                pass
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return None
+            self._remember(content_hash, info)
+            self.hits += 1
+        return info
+
+    def contains(self, content_hash: str) -> bool:
+        """Đã có kết quả cho hash này chưa (không tính vào hits/misses, không đọc nội dung)."""
+        with self._lock:
+            if content_hash in self._entries:
+                return True
+        return os.path.exists(self._path(content_hash))
+
+    def put(self, content_hash: str, info: AudioInfo) -> None:
+        with self._lock:
+            self._remember(content_hash, info)
+        temp_path = os.path.join(self.cache_dir, f".partial_{uuid.uuid4().hex}.json")
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': AUDIO_ANALYSIS_VERSION, 'audio': asdict(info)}, f)
+            os.replace(temp_path, self._path(content_hash))
+        except OSError as e:
+            logger.warning(f"Could not persist audio analysis for {content_hash[:12]}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self.evict(protect=(content_hash,))
+
+    def record(self, hits: int, misses: int) -> None:
+        """Cộng dồn bộ đếm từ tiến trình khác (worker render) vào cache này."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    # --- Evict / thống kê ---
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json') or name.startswith('.partial_'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len('.json')]))
+        return entries
+
+    def evict(self, protect: Tuple[str, ...] = ()) -> int:
+        """Xóa các bản ghi trên đĩa dùng lâu nhất cho tới khi còn <= max_entries (bỏ qua hash trong protect)."""
+        if not self.max_entries:
+            return 0
+        entries = self._disk_entries()
+        excess = len(entries) - self.max_entries
+        removed = 0
+        for _, _, content_hash in sorted(entries):
+            if removed >= excess:
+                break
+            if content_hash in protect:
+                continue
+            try:
+                os.remove(self._path(content_hash))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._entries.pop(content_hash, None)
+            removed += 1
+        if removed:
+            logger.info(f"Audio analysis cache evicted {removed} entries")
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._disk_entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_entries': self.max_entries,
+            }
+
+
+# Cache dùng chung trong tiến trình (bản trên đĩa dùng chung giữa các tiến trình)
+audio_analysis_cache = AudioAnalysisCache()
+
+
+def analyze_audio(path: str, content_hash: Optional[str] = None,
+                  cache: Optional[AudioAnalysisCache] = None) -> AudioInfo:
+    """
+    Thời lượng/codec/sample rate của file audio. Có content_hash thì đọc/ghi cache trên đĩa,
+    nên mỗi nội dung chỉ được probe một lần. File không có luồng audio -> ValueError.
+    """
+    cache = cache or audio_analysis_cache
+    if content_hash:
+        cached = cache.get(content_hash)
+        if cached is not None:
+            logger.info(f"Audio analysis cache hit for {path} ({content_hash[:12]})")
+            return cached
+    info = AudioInfo.from_probe(probe_media(path, content_hash))
+    if content_hash:
+        cache.put(content_hash, info)
+    return info
+
+
+def probe_keyframes(path: str) -> List[float]:
+    """
+    Danh sách thời điểm (giây) các keyframe của luồng video đầu tiên, đọc từ cờ packet
+    (không decode frame nên nhanh hơn -show_frames).
+    """
+    abs_path = os.path.abspath(path)
+    try:
+        probe = _run_ffprobe(abs_path, 'keyframes', select_streams='v:0', show_entries='packet=pts_time,flags')
+    except (ffmpeg.Error, ProcessTimeout) as e:
+        logger.error(f"ffprobe keyframe scan failed for {abs_path}")
+        raise ValueError(f"Failed to read keyframes of {abs_path}") from e
+
+    keyframes = []
+    for packet in probe.get('packets', []):
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'):
+            keyframes.append(float(packet['pts_time']))
+    return sorted(keyframes)
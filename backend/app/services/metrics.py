@@ -0,0 +1,294 @@
+# backend/app/services/metrics.py
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bucket mặc định (giây) cho độ trễ các bước render: từ vài chục ms (probe) tới hàng chục phút (encode)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+# Bucket cho hệ số realtime của encode (giây media / giây thực)
+REALTIME_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+# Ngữ cảnh gắn vào log span (ví dụ job_id), đặt bởi worker chạy job
+_span_context: ContextVar[Dict[str, str]] = ContextVar("_span_context", default={})
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{_escape_label_value(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng."""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        self.registry.record(("inc", self.name, labels, amount))
+
+    def _apply(self, labels: Dict[str, str], amount: float) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Histogram với bucket cố định (bucket tích lũy theo định dạng Prometheus)."""
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DURATION_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        self.registry.record(("observe", self.name, labels, value))
+
+    def _apply(self, labels: Dict[str, str], value: float) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(counts):
+                counts[idx] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge đọc giá trị lúc scrape qua một hàm trả về {tuple giá trị label: giá trị}."""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        self._function = function
+
+    def collect(self) -> List[str]:
+        if self._function is None:
+            return []
+        try:
+            values = self._function()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} collection failed: {e}")
+            return []
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, tuple(map(str, key)))} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class MetricsRegistry:
+    """
+    Tập metric của tiến trình, xuất theo định dạng text của Prometheus.
+    Trong tiến trình worker, đặt forwarder để chuyển mọi ghi nhận về tiến trình chính
+    (qua hàng đợi events của scheduler) thay vì ghi vào registry cục bộ.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._forwarder: Optional[Callable[[tuple], None]] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets=buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def set_forwarder(self, forwarder: Optional[Callable[[tuple], None]]) -> None:
+        self._forwarder = forwarder
+
+    def record(self, record: tuple) -> None:
+        """Ghi nhận (loại, tên metric, labels, giá trị) tại chỗ hoặc chuyển đi nếu có forwarder."""
+        if self._forwarder is not None:
+            try:
+                self._forwarder(record)
+            except Exception as e:
+                logger.warning(f"Forwarding metric {record[1]} failed: {e}")
+            return
+        self.apply(record)
+
+    def apply(self, record: tuple) -> None:
+        _, name, labels, value = record
+        metric = self._metrics.get(name)
+        if metric is None or not hasattr(metric, "_apply"):
+            logger.warning(f"Ignoring record for unknown metric: {name}")
+            return
+        metric._apply(labels, value)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# Registry dùng chung của tiến trình
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "render_stage_duration_seconds", "Wall time of each pipeline stage.", ("stage",))
+stage_failures = registry.counter(
+    "render_stage_failures_total", "Pipeline stages that raised an error.", ("stage",))
+encode_realtime_factor = registry.histogram(
+    "render_encode_realtime_factor", "Media seconds processed per wall second for each ffmpeg command.", ("stage",),
+    buckets=REALTIME_BUCKETS)
+bytes_processed = registry.counter(
+    "render_bytes_processed_total", "Bytes of media uploaded, read as render input or written as render output.", ("kind",))
+jobs_total = registry.counter(
+    "render_jobs_total", "Render jobs finished, by final status.", ("status",))
+job_duration = registry.histogram(
+    "render_job_duration_seconds", "Wall time of render jobs from start to finish.", ("status",))
+job_queue_wait = registry.histogram(
+    "render_job_queue_wait_seconds", "Time render jobs spent queued before starting.")
+temp_dir_bytes = registry.gauge(
+    "render_temp_dir_bytes", "Bytes currently stored in working directories.", ("directory",))
+temp_dir_files = registry.gauge(
+    "render_temp_dir_files", "Files currently stored in working directories.", ("directory",))
+scheduler_jobs = registry.gauge(
+    "render_scheduler_jobs", "Render jobs currently queued or running.", ("state",))
+storage_evicted_bytes = registry.counter(
+    "storage_evicted_bytes_total", "Bytes deleted by the storage manager.", ("area", "reason"))
+asset_deduplicated_bytes = registry.counter(
+    "asset_deduplicated_bytes_total", "Bytes clients did not need to upload because the asset was already stored.")
+ffmpeg_killed = registry.counter(
+    "render_ffmpeg_killed_total", "ffmpeg processes killed by the watchdog (cancelled, timeout, stalled).", ("stage", "reason"))
+storage_free_bytes = registry.gauge(
+    "storage_free_bytes", "Free disk space on the working directories' filesystem.")
+cache_lookups = registry.gauge(
+    "render_cache_lookups", "Cache lookups since the server started, by cache and result.", ("cache", "result"))
+
+
+@contextmanager
+def bind(**context: str) -> Iterator[None]:
+    """Gắn thêm trường (ví dụ job_id) vào log span trong phạm vi with."""
+    token = _span_context.set({**_span_context.get(), **context})
+    try:
+        yield
+    finally:
+        _span_context.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[None]:
+    """
+    Đo thời gian một bước: ghi histogram độ trễ, đếm lỗi và log một dòng JSON có cấu trúc.
+    """
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        duration = time.perf_counter() - started
+        stage_duration.observe(duration, stage=stage)
+        if not ok:
+            stage_failures.inc(stage=stage)
+        logger.info(json.dumps({
+            "event": "span",
+            "stage": stage,
+            "duration_seconds": round(duration, 4),
+            "ok": ok,
+            **_span_context.get(),
+            **attributes,
+        }, default=str))
+
+
+def timed(stage: str) -> Callable:
+    """Decorator bọc toàn bộ hàm trong một span."""
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def directory_usage(directories: Dict[str, str]) -> Tuple[Dict[Tuple[str, ...], float], Dict[Tuple[str, ...], float]]:
+    """(bytes, số file) của từng thư mục theo tên, dùng cho gauge temp dir."""
+    sizes, counts = {}, {}
+    for label, directory in directories.items():
+        total, files = 0, 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                    files += 1
+                except OSError:
+                    continue # File vừa bị xóa
+        sizes[(label,)] = total
+        counts[(label,)] = files
+    return sizes, counts
@@ -0,0 +1,243 @@
+# backend/app/services/parallel_render.py
+
+import os
+import shutil
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import ffmpeg
+
+from app.services.media_probe import analyze_audio
+from app.services.subtitles import SubtitleCue, cue_windows, parse_srt
+from app.services.timeline import TimelinePiece, plan_timeline
+from app.services import video_processing
+from app.services.video_processing import (
+    SUBTITLE_STYLE,
+    TEMP_DIR,
+    _audio_output_args,
+    _cancel_event,
+    _container_args,
+    _probe_video_files,
+    _progress_reporter,
+    _render_target_from_probes,
+    _run_ffmpeg,
+    _unlink_quietly,
+    _write_concat_list,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+# Độ dài mục tiêu của mỗi đoạn (giây)
+PARALLEL_SEGMENT_SECONDS = float(os.environ.get("PARALLEL_SEGMENT_SECONDS", 30))
+# Số đoạn encode đồng thời (0 = tự tính theo ngân sách luồng)
+PARALLEL_RENDER_WORKERS = int(os.environ.get("PARALLEL_RENDER_WORKERS", 0))
+# Timescale cố định cho mọi đoạn để concat c=copy giữ đúng timestamp
+SEGMENT_TIMESCALE = 90000
+
+
+@dataclass(frozen=True)
+class RenderSegment:
+    """Một đoạn [start, end) của output được encode độc lập (bắt đầu bằng keyframe)."""
+    index: int
+    start: float
+    end: float
+    pieces: Tuple[TimelinePiece, ...]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def _snap(value: float, fps: float) -> float:
+    """Làm tròn thời điểm cắt về lưới frame để các đoạn nối khít nhau."""
+    return round(round(value * fps) / fps, 6)
+
+
+def plan_segments(timeline: List[TimelinePiece], target_duration: float, cues: List[SubtitleCue],
+                  fps: float, segment_seconds: float = PARALLEL_SEGMENT_SECONDS) -> List[RenderSegment]:
+    """
+    Chia timeline thành các đoạn dài khoảng segment_seconds.
+    Điểm cắt ưu tiên ranh giới clip và tránh nằm giữa một cue phụ đề;
+    nếu không tìm được điểm như vậy trong 2*segment_seconds thì cắt theo lưới thời gian.
+    """
+    windows = cue_windows(cues)
+
+    def inside_cue(t: float) -> bool:
+        return any(start < t < end for start, end in windows)
+
+    step = max(segment_seconds / 4, 1.0 / fps)
+    candidates = {piece.start for piece in timeline}
+    candidates.update(k * step for k in range(1, int(target_duration / step) + 1))
+    candidates = sorted({_snap(t, fps) for t in candidates if 0 < t < target_duration})
+
+    cuts = [0.0]
+    for t in candidates:
+        length = t - cuts[-1]
+        if (length >= segment_seconds and not inside_cue(t)) or length >= 2 * segment_seconds:
+            cuts.append(t)
+    # Không để đoạn cuối quá ngắn
+    if len(cuts) > 1 and target_duration - cuts[-1] < segment_seconds / 4:
+        cuts.pop()
+    cuts.append(target_duration)
+
+    segments = []
+    for index, (start, end) in enumerate(zip(cuts, cuts[1:])):
+        pieces = []
+        for piece in timeline:
+            overlap_start, overlap_end = max(piece.start, start), min(piece.end, end)
+            if overlap_end - overlap_start <= 1e-6:
+                continue
+            pieces.append(TimelinePiece(
+                path=piece.path,
+                inpoint=piece.inpoint + (overlap_start - piece.start),
+                outpoint=piece.inpoint + (overlap_end - piece.start),
+                start=overlap_start,
+                source_duration=piece.source_duration,
+            ))
+        segments.append(RenderSegment(index=index, start=start, end=end, pieces=tuple(pieces)))
+    return segments
+
+
+def _encode_segment(segment: RenderSegment, srt_path: str, width: int, height: int, fps: float,
+                    output_path: str, threads: int, burn_subtitles: bool = True) -> None:
+    """Encode một đoạn (chỉ video) với phụ đề đã dịch thời gian về đúng vị trí trên timeline."""
+    parts = []
+    for piece in segment.pieces:
+        part = (
+            ffmpeg
+            .input(piece.path, ss=piece.inpoint, t=piece.duration)
+            .video
+            .filter('scale', width, height, force_original_aspect_ratio='decrease')
+            .filter('pad', width, height, '(ow-iw)/2', '(oh-ih)/2')
+            .filter('setsar', 1)
+            .filter('fps', fps=fps)
+            .filter('format', 'yuv420p')
+        )
+        parts.append(part)
+    joined = parts[0] if len(parts) == 1 else ffmpeg.concat(*parts, v=1, a=0)
+
+    video = joined
+    if burn_subtitles:
+        subtitle_file = os.path.abspath(srt_path).replace('\\', '/')
+        video = (
+            video
+            # Dời timestamp về vị trí thật trên timeline để filter subtitles chọn đúng cue
+            .setpts(f'PTS-STARTPTS+{segment.start}/TB')
+            .filter('subtitles', subtitle_file, force_style=SUBTITLE_STYLE)
+            .setpts('PTS-STARTPTS')
+        )
+    _run_ffmpeg(
+        video.output(output_path,
+                     t=segment.duration,
+                     vcodec='libx264',
+                     preset='medium',
+                     crf=23,
+                     pix_fmt='yuv420p',
+                     an=None,
+                     threads=threads,
+                     video_track_timescale=SEGMENT_TIMESCALE),
+        stage='segment', expected_duration=segment.duration
+    )
+
+
+class _SegmentCancelEvent:
+    """Event hủy cho các đoạn: set khi job bị hủy hoặc khi một đoạn khác đã lỗi (dừng sớm các ffmpeg còn lại)."""
+
+    def __init__(self, job_event=None):
+        self.job_event = job_event
+        self.failed = threading.Event()
+
+    def is_set(self) -> bool:
+        return self.failed.is_set() or (self.job_event is not None and self.job_event.is_set())
+
+
+def _encode_segment_with_cancel(cancel_event, *args) -> None:
+    """Chạy _encode_segment trong luồng của pool với event hủy của job (ContextVar không tự truyền sang luồng)."""
+    token = _cancel_event.set(cancel_event)
+    try:
+        _encode_segment(*args)
+    finally:
+        _cancel_event.reset(token)
+
+
+def _worker_budget(segment_count: int) -> Tuple[int, int]:
+    """(số đoạn encode đồng thời, số luồng ffmpeg mỗi đoạn) trong ngân sách luồng của job."""
+    total_threads = video_processing.FFMPEG_THREADS or (os.cpu_count() or 1)
+    workers = PARALLEL_RENDER_WORKERS or max(1, total_threads // 2)
+    workers = max(1, min(workers, segment_count))
+    return workers, max(1, total_threads // workers)
+
+
+def render_parallel(audio_path: str, video_paths: List[str], srt_path: str, output_path: str, target_duration: float,
+                    content_hashes: Optional[Dict[str, str]] = None, soft_subtitles: bool = False) -> None:
+    """
+    Render song song: chia timeline (clip + cửa sổ phụ đề) thành các đoạn, encode từng đoạn
+    bằng một tiến trình ffmpeg riêng (luồng Python chỉ giám sát), rồi nối bằng concat c=copy
+    và mux audio (soft_subtitles=True: mux thêm track mov_text thay vì burn).
+    Lỗi ffmpeg được chuyển thành ValueError.
+    """
+    processed_video_paths, video_durations, video_probes = _probe_video_files(video_paths, content_hashes)
+    audio_info = analyze_audio(audio_path, (content_hashes or {}).get(os.path.abspath(audio_path)))
+    width, height, fps = _render_target_from_probes(video_probes)
+    timeline = list(plan_timeline(processed_video_paths, dict(zip(processed_video_paths, video_durations)), target_duration).pieces)
+    segments = plan_segments(timeline, target_duration, parse_srt(srt_path), fps)
+    workers, threads = _worker_budget(len(segments))
+    logger.info(f"Parallel render: {len(segments)} segments, {workers} concurrent encodes x {threads} threads -> '{output_path}'")
+
+    reporter = _progress_reporter.get()
+    cancel_event = _SegmentCancelEvent(_cancel_event.get())
+    work_dir = os.path.join(TEMP_DIR, f"parallel_{uuid.uuid4()}")
+    os.makedirs(work_dir, exist_ok=True)
+    segment_paths = [os.path.join(work_dir, f"segment_{segment.index:05d}.mp4") for segment in segments]
+    list_filename = None
+    try:
+        if reporter:
+            reporter.begin('render')
+        done_seconds = 0.0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as executor:
+            futures = {
+                executor.submit(_encode_segment_with_cancel, cancel_event, segment, srt_path, width, height, fps,
+                                segment_path, threads, not soft_subtitles): segment
+                for segment, segment_path in zip(segments, segment_paths)
+            }
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    done_seconds += futures[future].duration
+                    if reporter:
+                        reporter.emit('render', done_seconds / target_duration)
+            except Exception:
+                cancel_event.failed.set() # Watchdog kill các ffmpeg đang encode đoạn khác
+                for pending in futures:
+                    pending.cancel()
+                raise
+
+        # --- Nối các đoạn bằng stream copy và mux audio ---
+        list_filename = _write_concat_list(segment_paths)
+        video = ffmpeg.input(list_filename, format='concat', safe=0).video
+        streams = [video, ffmpeg.input(audio_path).audio]
+        subtitle_args = {}
+        if soft_subtitles:
+            streams.append(ffmpeg.input(srt_path))
+            subtitle_args['scodec'] = 'mov_text'
+        _run_ffmpeg(
+            ffmpeg.output(*streams, output_path, t=target_duration, vcodec='copy',
+                          **_audio_output_args(audio_info), **subtitle_args, **_container_args()),
+            stage='mux', expected_duration=target_duration
+        )
+        logger.info(f"Parallel render successful: {output_path}")
+
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg parallel render error for {output_path}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        _unlink_quietly(output_path)
+        raise ValueError(f"Failed parallel render: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+    finally:
+        if list_filename:
+            _unlink_quietly(list_filename)
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,279 @@
+# backend/app/services/storage_manager.py
+
+import os
+import time
+import shutil
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Thư mục làm việc ---
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+UPLOAD_DIR = os.path.join(BACKEND_ROOT, "temp_uploads")
+OUTPUT_DIR = os.path.join(BACKEND_ROOT, "temp_outputs")
+TEMP_DIR = os.path.join(BACKEND_ROOT, "temp_files")
+
+# --- Cấu hình (có thể cấu hình qua env) ---
+GIB = 1024 ** 3
+STORAGE_SWEEP_INTERVAL = float(os.environ.get("STORAGE_SWEEP_INTERVAL", 300))
+# Thời gian giữ (giây) tính từ lần sửa cuối; 0 = không giới hạn
+OUTPUT_TTL_SECONDS = float(os.environ.get("OUTPUT_TTL_SECONDS", 24 * 3600))
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_SECONDS", 6 * 3600))
+TEMP_TTL_SECONDS = float(os.environ.get("TEMP_TTL_SECONDS", 6 * 3600))
+# Dung lượng tối đa của từng thư mục (byte); 0 = không giới hạn
+OUTPUT_QUOTA_BYTES = int(os.environ.get("OUTPUT_QUOTA_BYTES", 20 * GIB))
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_BYTES", 10 * GIB))
+TEMP_QUOTA_BYTES = int(os.environ.get("TEMP_QUOTA_BYTES", 0))
+# Dưới ngưỡng dung lượng trống này: từ chối upload mới, giữ job trong hàng đợi và xóa output cũ nhất
+MIN_FREE_BYTES = int(os.environ.get("STORAGE_MIN_FREE_BYTES", 5 * GIB))
+
+
+@dataclass(frozen=True)
+class StorageArea:
+    """Một thư mục được quản lý; mỗi mục con cấp một (file hoặc thư mục session) được xóa như một đơn vị."""
+    name: str
+    path: str
+    ttl_seconds: float
+    quota_bytes: int
+    # Thứ tự bị xóa khi thiếu dung lượng (nhỏ xóa trước); None = không xóa vì thiếu dung lượng
+    pressure_order: Optional[int] = None
+    # Mục trong thư mục là file làm việc của job nhưng không mang tên job (ví dụ TEMP_DIR)
+    scratch: bool = False
+
+
+@dataclass(frozen=True)
+class _Entry:
+    path: str
+    size: int
+    mtime: float
+
+    @property
+    def in_progress(self) -> bool:
+        # Output đang render dở (xem video_processing._partial_output_path) chỉ bị xóa khi quá TTL
+        return os.path.basename(self.path).startswith(".partial_")
+
+
+def _entry_stats(path: str) -> Tuple[int, float]:
+    """(tổng dung lượng, mtime mới nhất) của một file hoặc cả cây thư mục."""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    total, newest = 0, os.stat(path).st_mtime
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue # File vừa bị xóa
+            total += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return total, newest
+
+
+class StorageManager:
+    """
+    Vòng đời dữ liệu trên đĩa của các thư mục upload/output/tạm:
+    xóa theo TTL và quota trong một lần sweep định kỳ, giải phóng input khi job kết thúc,
+    và báo khi dung lượng trống xuống dưới ngưỡng để API/scheduler ngừng nhận việc mới.
+    """
+
+    def __init__(self, areas: List[StorageArea], min_free_bytes: int = MIN_FREE_BYTES):
+        self.areas = {area.name: area for area in areas}
+        self.min_free_bytes = min_free_bytes
+        self._protected: Set[str] = set()
+        self._lock = threading.Lock()
+        self.last_sweep: Optional[dict] = None
+        self._eviction_listeners: List[Callable[[str, str], None]] = []
+        self._running_since: Optional[Callable[[], Optional[float]]] = None
+        for area in areas:
+            os.makedirs(area.path, exist_ok=True)
+
+    # --- Bảo vệ dữ liệu đang dùng ---
+    def protect(self, path: str) -> None:
+        """Đánh dấu một mục đang được job dùng (không bị sweep xóa)."""
+        with self._lock:
+            self._protected.add(os.path.abspath(path))
+
+    def release(self, path: str, delete: bool = True) -> None:
+        """Bỏ bảo vệ và (mặc định) xóa ngay mục đó, ví dụ thư mục upload khi job đã kết thúc."""
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            self._protected.discard(abs_path)
+        if delete:
+            freed = self._delete(abs_path)
+            if freed is not None:
+                logger.info(f"Released {abs_path} ({freed} bytes)")
+
+    def _is_protected(self, path: str) -> bool:
+        with self._lock:
+            return path in self._protected
+
+    def add_eviction_listener(self, listener: Callable[[str, str], None]) -> None:
+        """Gọi listener(tên thư mục, đường dẫn) sau mỗi mục bị sweep xóa."""
+        self._eviction_listeners.append(listener)
+
+    def set_running_since(self, source: Optional[Callable[[], Optional[float]]]) -> None:
+        """
+        Hàm trả về thời điểm bắt đầu của job đang chạy lâu nhất (None = không có job nào chạy).
+        File tạm và output dở không mang tên job, nên mọi mục được ghi sau thời điểm đó
+        có thể thuộc một job đang chạy và không bị sweep xóa.
+        """
+        self._running_since = source
+
+    def _active_since(self) -> Optional[float]:
+        if self._running_since is None:
+            return None
+        try:
+            return self._running_since()
+        except Exception as e:
+            logger.warning(f"Could not read running jobs, sweeping without them: {e}")
+            return None
+
+    @staticmethod
+    def _in_use(area: StorageArea, entry: _Entry, active_since: Optional[float]) -> bool:
+        return (active_since is not None and entry.mtime >= active_since
+                and (area.scratch or entry.in_progress))
+
+    # --- Dung lượng trống ---
+    def free_bytes(self) -> int:
+        # Các thư mục thường cùng một ổ đĩa; lấy giá trị nhỏ nhất nếu khác ổ
+        return min(shutil.disk_usage(area.path).free for area in self.areas.values())
+
+    def has_free_space(self, required_bytes: int = 0) -> bool:
+        """True nếu sau khi ghi thêm required_bytes vẫn còn ít nhất min_free_bytes trống."""
+        try:
+            return self.free_bytes() - required_bytes >= self.min_free_bytes
+        except OSError as e:
+            logger.warning(f"Could not read free disk space: {e}")
+            return True
+
+    # --- Sweep ---
+    def _entries(self, area: StorageArea) -> List[_Entry]:
+        entries = []
+        try:
+            names = os.listdir(area.path)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            path = os.path.join(area.path, name)
+            try:
+                size, mtime = _entry_stats(path)
+            except OSError:
+                continue
+            entries.append(_Entry(path=path, size=size, mtime=mtime))
+        return entries
+
+    def _delete(self, path: str) -> Optional[int]:
+        """Xóa một mục, trả về số byte đã giải phóng (None nếu không xóa được)."""
+        try:
+            size, _ = _entry_stats(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return size
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Error deleting {path}: {e}")
+            return None
+
+    def _evict(self, area: StorageArea, entry: _Entry, reason: str, report: dict) -> int:
+        freed = self._delete(entry.path)
+        if freed is None:
+            return 0
+        logger.info(f"Evicted {entry.path} from {area.name} ({reason}, {freed} bytes, idle {time.time() - entry.mtime:.0f}s)")
+        metrics.storage_evicted_bytes.inc(freed, area=area.name, reason=reason)
+        area_report = report.setdefault(area.name, {"deleted": 0, "freed_bytes": 0})
+        area_report["deleted"] += 1
+        area_report["freed_bytes"] += freed
+        for listener in self._eviction_listeners:
+            try:
+                listener(area.name, entry.path)
+            except Exception as e:
+                logger.warning(f"Eviction listener failed for {entry.path}: {e}")
+        return freed
+
+    def sweep(self) -> dict:
+        """
+        Một lần dọn dẹp (chạy đồng bộ, nên gọi qua asyncio.to_thread):
+        1. xóa mục quá TTL, 2. xóa mục cũ nhất cho tới khi thư mục dưới quota,
+        3. nếu dung lượng trống vẫn dưới ngưỡng, xóa mục cũ nhất theo pressure_order.
+        Mục đang được bảo vệ và file có thể thuộc job đang chạy (xem set_running_since) không bao giờ bị xóa.
+        """
+        now = time.time()
+        active_since = self._active_since()
+        report: dict = {}
+        remaining: Dict[str, List[_Entry]] = {}
+        for area in self.areas.values():
+            kept = []
+            total = 0 # Mục được bảo vệ vẫn tính vào quota dù không thể xóa
+            for entry in sorted(self._entries(area), key=lambda entry: entry.mtime):
+                if self._is_protected(entry.path) or self._in_use(area, entry, active_since):
+                    total += entry.size
+                elif area.ttl_seconds and now - entry.mtime > area.ttl_seconds:
+                    self._evict(area, entry, "ttl", report)
+                else:
+                    kept.append(entry)
+                    total += entry.size
+
+            kept = [entry for entry in kept if not entry.in_progress]
+            while area.quota_bytes and total > area.quota_bytes and kept:
+                entry = kept.pop(0)
+                total -= entry.size
+                self._evict(area, entry, "quota", report)
+            remaining[area.name] = kept
+
+        if not self.has_free_space():
+            candidates = sorted(
+                ((area.pressure_order, entry.mtime, area, entry)
+                 for area in self.areas.values() if area.pressure_order is not None
+                 for entry in remaining[area.name]),
+                key=lambda item: item[:2],
+            )
+            for _, _, area, entry in candidates:
+                if self.has_free_space():
+                    break
+                self._evict(area, entry, "disk_pressure", report)
+
+        self.last_sweep = {"finished_at": time.time(), "evicted": report}
+        if report:
+            logger.info(f"Storage sweep evicted: {report}")
+        return report
+
+    def usage(self) -> dict:
+        areas = {}
+        for area in self.areas.values():
+            entries = self._entries(area)
+            areas[area.name] = {
+                "path": area.path,
+                "entries": len(entries),
+                "bytes": sum(entry.size for entry in entries),
+                "quota_bytes": area.quota_bytes,
+                "ttl_seconds": area.ttl_seconds,
+            }
+        with self._lock:
+            protected = len(self._protected)
+        return {
+            "free_bytes": self.free_bytes(),
+            "min_free_bytes": self.min_free_bytes,
+            "accepting_jobs": self.has_free_space(),
+            "protected_entries": protected,
+            "areas": areas,
+            "last_sweep": self.last_sweep,
+        }
+
+
+# Storage manager dùng chung cho API và scheduler.
+# Thư mục tạm không có quota mặc định: file tạm của job đang chạy chỉ được bảo vệ theo thời điểm ghi.
+storage_manager = StorageManager([
+    StorageArea("outputs", OUTPUT_DIR, OUTPUT_TTL_SECONDS, OUTPUT_QUOTA_BYTES, pressure_order=1),
+    StorageArea("uploads", UPLOAD_DIR, UPLOAD_TTL_SECONDS, UPLOAD_QUOTA_BYTES),
+    StorageArea("temp", TEMP_DIR, TEMP_TTL_SECONDS, TEMP_QUOTA_BYTES, scratch=True),
+])
+metrics.storage_free_bytes.set_function(lambda: {(): storage_manager.free_bytes()})
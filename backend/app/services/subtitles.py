@@ -0,0 +1,79 @@
+# backend/app/services/subtitles.py
+
+import re
+import logging
+from dataclasses import dataclass
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cách đưa phụ đề vào video output:
+#   burn      - vẽ phụ đề lên hình (encode lại toàn bộ)
+#   soft      - mux SRT thành track mov_text, video/audio stream copy
+#   selective - burn nhưng chỉ encode lại các khoảng có cue, phần còn lại stream copy
+SUBTITLE_MODES = ('burn', 'soft', 'selective')
+
+# Dòng thời gian SRT: 00:00:01,000 --> 00:00:02,500 (chấp nhận cả '.' thay cho ',')
+_TIMING_RE = re.compile(
+    r"(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})"
+)
+
+
+@dataclass(frozen=True)
+class SubtitleCue:
+    """Một cue phụ đề, thời gian tính bằng giây."""
+    index: int
+    start: float
+    end: float
+    text: str
+
+
+def _to_seconds(hours: str, minutes: str, seconds: str, millis: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, '0')) / 1000
+
+
+def parse_srt(path: str) -> List[SubtitleCue]:
+    """Đọc file SRT thành danh sách cue đã sắp xếp theo thời gian bắt đầu. Bỏ qua block lỗi."""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        content = f.read()
+
+    cues = []
+    for block in re.split(r"\r?\n\s*\r?\n", content.strip()):
+        lines = [line for line in block.splitlines() if line.strip()]
+        timing_idx = next((idx for idx, line in enumerate(lines) if _TIMING_RE.search(line)), None)
+        if timing_idx is None:
+            continue
+        match = _TIMING_RE.search(lines[timing_idx])
+        start = _to_seconds(*match.groups()[:4])
+        end = _to_seconds(*match.groups()[4:])
+        if end <= start:
+            logger.warning(f"Skipping SRT cue with non-positive duration in {path}: {lines[timing_idx]}")
+            continue
+        cues.append(SubtitleCue(index=len(cues) + 1, start=start, end=end, text="\n".join(lines[timing_idx + 1:])))
+    cues.sort(key=lambda cue: cue.start)
+    return cues
+
+
+def format_srt_timestamp(seconds: float) -> str:
+    millis = int(round(max(seconds, 0.0) * 1000))
+    hours, millis = divmod(millis, 3600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def write_srt(cues: List[SubtitleCue], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for number, cue in enumerate(cues, start=1):
+            f.write(f"{number}\n{format_srt_timestamp(cue.start)} --> {format_srt_timestamp(cue.end)}\n{cue.text}\n\n")
+
+
+def cue_windows(cues: List[SubtitleCue], merge_gap: float = 0.0) -> List[Tuple[float, float]]:
+    """Gộp các cue chồng lấn (hoặc cách nhau <= merge_gap giây) thành các khoảng thời gian có phụ đề."""
+    windows: List[Tuple[float, float]] = []
+    for cue in sorted(cues, key=lambda cue: cue.start):
+        if windows and cue.start <= windows[-1][1] + merge_gap:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], cue.end))
+        else:
+            windows.append((cue.start, cue.end))
+    return windows
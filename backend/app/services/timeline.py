@@ -0,0 +1,132 @@
+# backend/app/services/timeline.py
+
+import bisect
+import logging
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sai số (giây) khi so sánh thời điểm cắt với đầu/cuối clip
+_EPSILON = 1e-3
+
+
+@dataclass(frozen=True)
+class TimelinePiece:
+    """Một đoạn clip trên timeline output: lấy [inpoint, outpoint) của path, bắt đầu tại `start`."""
+    path: str
+    inpoint: float
+    outpoint: float
+    start: float
+    source_duration: float = 0.0 # Độ dài clip gốc (0 = không rõ, coi như dùng hết clip)
+
+    @property
+    def duration(self) -> float:
+        return self.outpoint - self.inpoint
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+    @property
+    def trims_start(self) -> bool:
+        return self.inpoint > _EPSILON
+
+    @property
+    def trims_end(self) -> bool:
+        return self.source_duration > 0 and self.outpoint < self.source_duration - _EPSILON
+
+    def input_args(self) -> dict:
+        """Tham số input ffmpeg (-ss/-t) để chỉ đọc phần clip thực sự nằm trên timeline."""
+        args = {}
+        if self.trims_start:
+            args['ss'] = self.inpoint
+        if self.trims_start or self.trims_end:
+            args['t'] = self.duration
+        return args
+
+
+@dataclass(frozen=True)
+class Timeline:
+    """
+    Kế hoạch ghép clip dùng chung cho mọi chế độ render: clip lặp theo thứ tự,
+    clip cuối bị cắt bằng outpoint để không encode frame nào sẽ bị bỏ đi.
+    """
+    pieces: Tuple[TimelinePiece, ...]
+    target_duration: float
+
+    @property
+    def duration(self) -> float:
+        return self.pieces[-1].end if self.pieces else 0.0
+
+    @property
+    def overshoot(self) -> float:
+        """Phần dư sau target_duration (chỉ khác 0 khi outpoint được nới tới keyframe)."""
+        return max(self.duration - self.target_duration, 0.0)
+
+    def with_paths(self, path_map: Dict[str, str]) -> "Timeline":
+        """Thay đường dẫn (ví dụ clip gốc -> bản chuẩn hóa trong clip cache), giữ nguyên điểm cắt."""
+        if not path_map:
+            return self
+        return Timeline(
+            pieces=tuple(replace(piece, path=path_map.get(piece.path, piece.path)) for piece in self.pieces),
+            target_duration=self.target_duration,
+        )
+
+    def concat_lines(self) -> List[str]:
+        """Các dòng cho concat demuxer, kèm inpoint/outpoint khi chỉ lấy một phần clip."""
+        lines = []
+        for piece in self.pieces:
+            # Đảm bảo dùng dấu / cho ffmpeg ngay cả trên Windows
+            safe_path = piece.path.replace('\\', '/')
+            lines.append(f"file '{safe_path}'")
+            if piece.trims_start:
+                lines.append(f"inpoint {piece.inpoint:.6f}")
+            if piece.trims_end:
+                lines.append(f"outpoint {piece.outpoint:.6f}")
+        return lines
+
+
+def plan_timeline(paths: List[str], durations: Dict[str, float], target_duration: float,
+                  keyframes: Optional[Callable[[str], List[float]]] = None) -> Timeline:
+    """
+    Lặp các clip theo thứ tự cho tới khi phủ đúng target_duration; clip cuối có outpoint chính xác.
+    keyframes(path) (tùy chọn, dùng khi ghép bằng stream copy): nới outpoint của clip cuối tới keyframe
+    kế tiếp để điểm cắt sạch; phần dư tối đa một GOP và được cắt bởi -t ở bước mux.
+    """
+    loop_duration = sum(durations[path] for path in paths)
+    if loop_duration <= 0:
+        raise ValueError("Total duration of valid videos is zero or negative.")
+
+    pieces: List[TimelinePiece] = []
+    position = 0.0
+    while position < target_duration - _EPSILON:
+        for path in paths:
+            if position >= target_duration - _EPSILON:
+                break
+            source_duration = durations[path]
+            outpoint = min(source_duration, target_duration - position)
+            if keyframes and outpoint < source_duration - _EPSILON:
+                outpoint = _snap_to_next_keyframe(path, outpoint, source_duration, keyframes)
+            pieces.append(TimelinePiece(path=path, inpoint=0.0, outpoint=outpoint, start=position,
+                                        source_duration=source_duration))
+            position += outpoint
+
+    timeline = Timeline(pieces=tuple(pieces), target_duration=target_duration)
+    skipped = pieces[-1].source_duration - pieces[-1].outpoint if pieces else 0.0
+    logger.info(f"Timeline: {len(pieces)} pieces, {timeline.duration:.3f}s for target {target_duration:.3f}s "
+                f"(overshoot {timeline.overshoot:.3f}s, {skipped:.3f}s of the last clip skipped)")
+    return timeline
+
+
+def _snap_to_next_keyframe(path: str, outpoint: float, source_duration: float,
+                           keyframes: Callable[[str], List[float]]) -> float:
+    try:
+        points = keyframes(path)
+    except ValueError as e:
+        logger.warning(f"Keyframe lookup failed for {path}, using the exact outpoint: {e}")
+        return outpoint
+    idx = bisect.bisect_left(points, outpoint - _EPSILON)
+    if idx < len(points) and points[idx] < source_duration - _EPSILON:
+        return points[idx]
+    return source_duration # Không còn keyframe phía sau -> lấy hết clip
@@ -5,21 +5,265 @@ import os
 import math
 import tempfile
 import uuid # Thêm uuid
+import bisect
+import shutil
 import logging # Thêm logging
-from typing import List
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services import metrics
+from app.services.clip_cache import clip_cache
+from app.services.clip_compat import ClipSignature, analyze_compatibility, clip_signature
+from app.services.ffmpeg_process import ManagedProcess, ProcessTimeout, RenderCancelled, cancel_event_var, stage_timeout
+from app.services.media_probe import (
+    AudioInfo, ProbeResult, analyze_audio, audio_analysis_cache, probe_keyframes, probe_many, probe_media,
+)
+from app.services.subtitles import SUBTITLE_MODES, cue_windows, parse_srt
+from app.services.storage_manager import TEMP_DIR
+from app.services.timeline import Timeline, plan_timeline
 
 # --- Cấu hình Logging ---
 # Đảm bảo logging được cấu hình ở mức INFO để thấy các log chi tiết
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- Thư mục tạm (có thể cấu hình qua env) ---
-# Xác định thư mục gốc của backend để tạo thư mục tạm bên trong đó
-BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-TEMP_DIR = os.path.join(BACKEND_ROOT, "temp_files")
+# --- Thư mục tạm (định nghĩa cùng các thư mục làm việc khác trong storage_manager) ---
 os.makedirs(TEMP_DIR, exist_ok=True)
 logger.info(f"Temporary files directory: {TEMP_DIR}")
 
+# --- Chế độ pipeline: render một lượt (single-pass) hoặc nhiều bước (multi-step) ---
+# Single-pass gộp concat -> cắt theo audio -> phụ đề vào một filter graph và chỉ encode một lần.
+SINGLE_PASS_DEFAULT = os.environ.get("VIDEO_PIPELINE_MODE", "single_pass").lower() != "multi_step"
+
+# Render song song theo đoạn (xem parallel_render.py); tắt mặc định
+PARALLEL_RENDER_DEFAULT = os.environ.get("PARALLEL_RENDER", "0") == "1"
+
+# Khi audio cần từ số vòng clip này trở lên, chỉ encode một vòng rồi lặp lại bằng stream copy
+LOOP_REUSE_MIN_LOOPS = int(os.environ.get("LOOP_REUSE_MIN_LOOPS", 2))
+
+# Khi ghép bằng stream copy, nới outpoint của clip cuối tới keyframe kế tiếp (điểm cắt sạch, dư tối đa một GOP)
+TIMELINE_KEYFRAME_SNAP = os.environ.get("TIMELINE_KEYFRAME_SNAP", "1") == "1"
+
+# Số luồng encoder cho mỗi lệnh ffmpeg (0 = để ffmpeg tự chọn).
+# Scheduler đặt lại giá trị này trong từng tiến trình worker để tránh tranh chấp CPU.
+FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", 0))
+
+# Chế độ phụ đề mặc định (burn | soft | selective, xem subtitles.SUBTITLE_MODES).
+# selective chỉ khác burn ở pipeline nhiều bước; single-pass/song song vốn đã encode một lần.
+SUBTITLE_MODE_DEFAULT = os.environ.get("SUBTITLE_MODE", "burn").lower()
+# Các cue cách nhau không quá số giây này được gộp thành một khoảng encode lại
+SELECTIVE_MERGE_GAP = float(os.environ.get("SELECTIVE_MERGE_GAP", 2.0))
+# Khoảng cách keyframe ép buộc khi chuẩn bị video cho selective, để khoảng encode lại không bị nới quá xa
+SELECTIVE_KEYFRAME_INTERVAL = float(os.environ.get("SELECTIVE_KEYFRAME_INTERVAL", 2.0))
+# Phần phải encode lại chiếm từ tỉ lệ này trở lên thì burn toàn bộ luôn
+SELECTIVE_MAX_BURN_RATIO = float(os.environ.get("SELECTIVE_MAX_BURN_RATIO", 0.8))
+
+# Bản preview độ phân giải thấp render trước bản chính (chỉ để kiểm tra timing/vị trí phụ đề)
+PREVIEW_HEIGHT = int(os.environ.get("PREVIEW_HEIGHT", 360))
+PREVIEW_FPS = float(os.environ.get("PREVIEW_FPS", 15))
+PREVIEW_CRF = int(os.environ.get("PREVIEW_CRF", 30))
+
+# Codec audio được stream copy vào output (MP4 và segment MPEG-TS của HLS đều chứa được); codec khác encode AAC
+AUDIO_COPY_CODECS = tuple(codec.strip() for codec in os.environ.get("AUDIO_COPY_CODECS", "aac,mp3,ac3,eac3").split(',') if codec.strip())
+
+# Ghi moov atom ở đầu file MP4 (+faststart) để player phát được ngay khi mới tải phần đầu
+FASTSTART_ENABLED = os.environ.get("FASTSTART", "1") == "1"
+# Đóng gói HLS (playlist + segment .ts): độ dài segment mục tiêu (giây) và tên playlist
+HLS_SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", 4))
+HLS_PLAYLIST_NAME = "index.m3u8"
+
+SUBTITLE_STYLE = "FontName=Arial,FontSize=24,PrimaryColour=&H00FFFFFF,OutlineColour=&HFF000000,BorderStyle=1,Outline=1,Shadow=1,Alignment=2,MarginV=15"
+
+def _thread_args() -> dict:
+    """Tham số -threads cho output ffmpeg theo ngân sách luồng của tiến trình."""
+    return {'threads': FFMPEG_THREADS} if FFMPEG_THREADS > 0 else {}
+
+
+def _audio_output_args(audio: AudioInfo) -> dict:
+    """Stream copy audio nếu codec chứa được trong output, ngược lại encode AAC."""
+    if audio.codec in AUDIO_COPY_CODECS:
+        return {'acodec': 'copy'}
+    return {'acodec': 'aac'}
+
+
+def _container_args() -> dict:
+    """Tham số muxer cho file MP4 cuối cùng (faststart)."""
+    return {'movflags': '+faststart'} if FASTSTART_ENABLED else {}
+
+
+def _hls_muxer_options(hls_dir: str) -> Dict[str, str]:
+    """
+    Tùy chọn muxer hls: playlist dạng event (player đọc được trong lúc đang render,
+    có #EXT-X-ENDLIST khi xong) và segment ghi qua file tạm nên không bao giờ phục vụ segment dở.
+    """
+    return {
+        'hls_time': f"{HLS_SEGMENT_SECONDS:g}",
+        'hls_playlist_type': 'event',
+        'hls_flags': 'temp_file+independent_segments',
+        'hls_segment_filename': os.path.join(hls_dir, 'segment_%05d.ts'),
+    }
+
+
+def _hls_keyframe_args() -> dict:
+    """Ép keyframe tại mỗi ranh giới segment HLS (segment chỉ cắt được ở keyframe)."""
+    return {'force_key_frames': f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS:g})"}
+
+
+def _escape_tee(value: str) -> str:
+    """Chuẩn hóa đường dẫn cho cú pháp tee muxer: dùng '/' và escape ':', '|', '[', ']'."""
+    value = value.replace('\\', '/')
+    for char in ':|[]':
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def _reset_dir(path: str) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+# Các bước có tiến độ riêng; bước không cần thiết (ví dụ không có clip lệch để chuẩn hóa) bị bỏ qua
+SINGLE_PASS_STAGES = ['normalize', 'loop_cycle', 'render']
+MULTI_STEP_STAGES = ['normalize', 'loop_cycle', 'concat', 'audio', 'subtitles']
+PARALLEL_STAGES = ['render', 'mux']
+
+
+class _ProgressReporter:
+    """
+    Gom tiến độ từng lệnh ffmpeg thành tiến độ tổng của job.
+    Mỗi bước (stage) có trọng số bằng nhau; callback nhận dict có thể pickle
+    (stage, percent, stage_percent, fps, speed, eta_seconds).
+    percent không bao giờ giảm: bước con ngoài danh sách (segment, hls), bước chạy lại
+    hay chuyển sang pipeline dự phòng chỉ giữ nguyên tiến độ tổng.
+    """
+
+    def __init__(self, callback: Callable[[dict], None], stages: List[str], media_duration: float):
+        self.callback = callback
+        self.media_duration = media_duration
+        self._lock = threading.Lock() # parallel_render báo tiến độ từ nhiều luồng
+        self._percent = 0.0
+        self.set_stages(stages)
+
+    def set_stages(self, stages: List[str], completed: int = 0) -> None:
+        self.stages = list(stages)
+        self.completed = completed
+
+    def begin(self, stage: str, stage_fraction: float = 0.0) -> None:
+        if stage in self.stages:
+            self.completed = self.stages.index(stage)
+        self.emit(stage, stage_fraction)
+
+    def emit(self, stage: str, stage_fraction: float, fps: Optional[float] = None, speed: Optional[float] = None) -> None:
+        stage_fraction = min(max(stage_fraction, 0.0), 1.0)
+        total = max(len(self.stages), 1)
+        # Bước con không nằm trong danh sách không được cộng phần trăm của chính nó vào tiến độ tổng
+        overall_fraction = stage_fraction if stage in self.stages else 0.0
+        with self._lock:
+            self._percent = max(self._percent, min((self.completed + overall_fraction) / total, 1.0) * 100)
+            percent = self._percent
+        eta = None
+        if speed and speed > 0 and self.media_duration > 0:
+            # Ước lượng: phần còn lại của bước hiện tại + các bước sau, mỗi bước xử lý toàn bộ thời lượng
+            remaining_stages = max(total - self.completed - 1, 0)
+            eta = ((1 - stage_fraction) + remaining_stages) * self.media_duration / speed
+        try:
+            self.callback({
+                "stage": stage,
+                "percent": round(percent, 2),
+                "stage_percent": round(stage_fraction * 100, 2),
+                "fps": fps,
+                "speed": speed,
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            })
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {e}")
+
+
+# Reporter của job đang chạy trong luồng/tiến trình hiện tại (None nếu không theo dõi tiến độ)
+_progress_reporter: ContextVar[Optional[_ProgressReporter]] = ContextVar("_progress_reporter", default=None)
+
+
+class RenderTimeout(Exception):
+    """Một lệnh ffmpeg vượt timeout của stage hoặc bị treo; job thất bại thay vì giữ core vô thời hạn."""
+
+
+# Event hủy của job hiện tại (xem ffmpeg_process.cancel_event_var, dùng chung với ffprobe)
+_cancel_event = cancel_event_var
+
+
+def _check_cancelled() -> None:
+    cancel_event = _cancel_event.get()
+    if cancel_event is not None and cancel_event.is_set():
+        raise RenderCancelled("Render cancelled.")
+
+
+def _parse_progress_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(str(value).rstrip('x'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _run_ffmpeg(stream_spec, stage: str, expected_duration: Optional[float] = None,
+                progress_offset: float = 0.0, progress_total: Optional[float] = None) -> None:
+    """
+    Chạy một lệnh ffmpeg-python với '-progress pipe:1' và chuyển out_time thành
+    tiến độ so với expected_duration. Lỗi được raise dưới dạng ffmpeg.Error (có stderr)
+    để các khối except hiện có vẫn hoạt động.
+    Khi một stage gồm nhiều lệnh nối tiếp (từng đoạn), progress_offset/progress_total (giây) cho biết
+    lệnh này bắt đầu ở đâu trong tổng thời lượng của stage để tiến độ được cộng dồn.
+    ffmpeg chạy dưới ManagedProcess: bị kill (cả nhóm tiến trình) khi job bị hủy -> RenderCancelled,
+    khi vượt timeout của stage hoặc treo -> RenderTimeout.
+    """
+    _check_cancelled()
+    args = ffmpeg.compile(stream_spec, overwrite_output=True)
+    args[1:1] = ['-progress', 'pipe:1', '-nostats']
+    reporter = _progress_reporter.get()
+    progress_total = progress_total or expected_duration
+    if reporter:
+        reporter.begin(stage, progress_offset / progress_total if progress_total else 0.0)
+
+    started = time.perf_counter()
+    with ManagedProcess(args, stage, timeout=stage_timeout(stage, expected_duration), cancel_event=_cancel_event.get()) as process:
+        block: Dict[str, str] = {}
+        for raw_line in process.stdout:
+            process.touch()
+            key, _, value = raw_line.decode('utf-8', errors='ignore').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            if reporter:
+                out_time_us = _parse_progress_float(block.get('out_time_us'))
+                done = progress_offset
+                if out_time_us is not None and expected_duration:
+                    done += min(out_time_us / 1_000_000, expected_duration)
+                if value == 'end':
+                    done = progress_offset + (expected_duration or progress_total or 0.0)
+                fraction = done / progress_total if progress_total else float(value == 'end')
+                reporter.emit(stage, fraction, _parse_progress_float(block.get('fps')), _parse_progress_float(block.get('speed')))
+            block = {}
+
+        try:
+            returncode, stderr = process.wait()
+        except ProcessTimeout as e:
+            raise RenderTimeout(str(e)) from e
+    _check_cancelled()
+    if returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', stderr)
+    elapsed = time.perf_counter() - started
+    if expected_duration and elapsed > 0:
+        metrics.encode_realtime_factor.observe(expected_duration / elapsed, stage=stage)
+
+
+def _partial_output_path(output_path: str) -> str:
+    """Tên tạm (cùng thư mục, giữ phần mở rộng) để ghi output trước khi rename atomic."""
+    directory, filename = os.path.split(os.path.abspath(output_path))
+    return os.path.join(directory, f".partial_{uuid.uuid4().hex}_{filename}")
+
+
 def _escape_path_for_ffmpeg_filter(path: str) -> str:
     """Chuẩn hóa và escape đường dẫn cho filter ffmpeg (ví dụ: subtitles)."""
     path = os.path.abspath(path).replace('\\', '/')
@@ -43,143 +287,364 @@ def _escape_path_for_ffmpeg_filter(path: str) -> str:
     return path
 
 
-def concatenate_videos(video_paths: List[str], target_duration: float) -> str:
+@metrics.timed('probe')
+def _probe_video_files(video_paths: List[str], content_hashes: Optional[Dict[str, str]] = None) -> Tuple[List[str], List[float], List[ProbeResult]]:
     """
-    Ghép nối các video, bỏ qua file lỗi khi probe.
-    Trả về đường dẫn file tạm đã ghép.
+    Probe song song các file video (qua cache), bỏ qua file lỗi.
+    Trả về (đường dẫn hợp lệ, duration tương ứng, kết quả probe tương ứng).
     """
-    input_videos_for_concat = []
     video_durations = []
     processed_video_paths = [] # Lưu các đường dẫn file hợp lệ đã probe
+    video_probes = []
+
+    # --- Probe các file video song song và tính tổng duration ---
+    abs_paths = [os.path.abspath(path) for path in video_paths] # Lấy đường dẫn tuyệt đối
+    abs_hashes = {os.path.abspath(path): value for path, value in (content_hashes or {}).items()}
+    logger.info(f"Probing {len(abs_paths)} video files")
+    for abs_path, probe in zip(abs_paths, probe_many(abs_paths, abs_hashes)):
+        if probe is None:
+            continue # Bỏ qua file lỗi hoặc không tồn tại (đã log trong probe_many)
+        # Timeline chỉ dùng luồng video nên lấy độ dài của luồng video, không phải của container
+        if probe.video_duration <= 0:
+            logger.warning(f"Video {abs_path} has zero or negative duration ({probe.video_duration}). Skipping.")
+            continue
+
+        video_durations.append(probe.video_duration)
+        processed_video_paths.append(abs_path) # Lưu đường dẫn tuyệt đối
+        video_probes.append(probe)
+
+    if not processed_video_paths:
+        raise ValueError("No valid video files could be processed after probing.")
+
+    return processed_video_paths, video_durations, video_probes
+
+
+def _plan_clip_timeline(processed_video_paths: List[str], video_durations: List[float], target_duration: float,
+                        snap_paths: Optional[Dict[str, str]] = None) -> Timeline:
+    """
+    Timeline chính xác cho các clip hợp lệ (xem timeline.plan_timeline).
+    snap_paths (clip gốc -> file thực sự được ghép): bật nới outpoint tới keyframe của file đó khi ghép bằng copy.
+    """
+    logger.info(f"Target duration: {target_duration}, Single loop duration: {sum(video_durations)}")
+    keyframes = None
+    if snap_paths is not None and TIMELINE_KEYFRAME_SNAP:
+        keyframes = lambda path: probe_keyframes(snap_paths.get(path, path))
+    return plan_timeline(processed_video_paths, dict(zip(processed_video_paths, video_durations)), target_duration, keyframes)
+
+
+def _write_timeline_list(timeline: Timeline) -> str:
+    """Ghi timeline thành list của concat demuxer (có inpoint/outpoint) vào TEMP_DIR."""
+    list_filename = os.path.join(TEMP_DIR, f"concat_list_{uuid.uuid4()}.txt")
+    logger.info(f"Creating timeline concat list file: {list_filename} ({len(timeline.pieces)} pieces)")
+    with open(list_filename, 'w', encoding='utf-8') as list_file:
+        list_file.write('\n'.join(timeline.concat_lines()) + '\n')
+    return list_filename
+
+
+def _write_concat_list(video_paths: List[str]) -> str:
+    """Ghi danh sách file cho concat demuxer vào TEMP_DIR, trả về đường dẫn list."""
+    list_filename = os.path.join(TEMP_DIR, f"concat_list_{uuid.uuid4()}.txt")
+    logger.info(f"Creating concat list file: {list_filename}")
+    with open(list_filename, 'w', encoding='utf-8') as list_file:
+        for video_path in video_paths:
+            # Đảm bảo dùng dấu / cho ffmpeg ngay cả trên Windows
+            safe_video_path = video_path.replace('\\', '/')
+            list_file.write(f"file '{safe_video_path}'\n")
+    logger.info(f"Concat list file content written.")
+    return list_filename
 
-    # --- Probe từng file video và tính tổng duration ---
-    for path in video_paths:
-        abs_path = os.path.abspath(path) # Lấy đường dẫn tuyệt đối
-        logger.info(f"Probing video file: {abs_path}")
-        if not os.path.exists(abs_path):
-             logger.error(f"Video file does not exist at path: {abs_path}. Skipping.")
-             continue # Bỏ qua nếu file không tồn tại
 
+def _unlink_quietly(path: str) -> None:
+    """Xóa file tạm nếu tồn tại, chỉ log lỗi."""
+    if os.path.exists(path):
         try:
-            probe = ffmpeg.probe(abs_path)
-            # Kiểm tra xem có 'format' và 'duration' không
-            if 'format' not in probe or 'duration' not in probe['format']:
-                 logger.warning(f"Could not get duration from probe result for {abs_path}. Skipping. Probe data: {probe}")
-                 continue
-            duration = float(probe['format']['duration'])
-            if duration <= 0:
-                logger.warning(f"Video {abs_path} has zero or negative duration ({duration}). Skipping.")
+            os.unlink(path)
+            logger.info(f"Deleted temp file: {path}")
+        except OSError as unlink_error:
+             logger.error(f"Error deleting temp file {path}: {unlink_error}")
+
+
+# Ánh xạ profile của ffprobe sang tên profile của libx264
+_X264_PROFILES = {'Baseline': 'baseline', 'Constrained Baseline': 'baseline', 'Main': 'main', 'High': 'high'}
+
+# Tham số encode khi chuẩn hóa clip (cũng là một phần khóa của clip cache)
+NORMALIZE_PRESET = 'fast'
+NORMALIZE_CRF = 23
+
+
+def _normalize_params(target: ClipSignature, encoder: str) -> dict:
+    """Tham số encode đích dùng làm khóa cache cho clip đã chuẩn hóa."""
+    return {**asdict(target), 'encoder': encoder, 'preset': NORMALIZE_PRESET, 'crf': NORMALIZE_CRF}
+
+
+def _signature_output_args(target: ClipSignature, encoder: str = 'libx264') -> dict:
+    """Tham số output để luồng encode lại khớp pix_fmt/timescale/profile của chữ ký đích (ghép c=copy được)."""
+    output_kwargs = {}
+    if target.pix_fmt:
+        output_kwargs['pix_fmt'] = target.pix_fmt
+    # Timebase của luồng MP4 là 1/timescale -> giữ cùng timescale với các clip còn lại
+    _, _, timescale = target.time_base.partition('/')
+    if timescale.isdigit():
+        output_kwargs['video_track_timescale'] = int(timescale)
+    if encoder == 'libx264' and target.profile in _X264_PROFILES:
+        output_kwargs['profile:v'] = _X264_PROFILES[target.profile]
+    return output_kwargs
+
+
+@metrics.timed('normalize')
+def normalize_clip(video_path: str, target: ClipSignature, encoder: str, output_path: str,
+                   expected_duration: Optional[float] = None) -> None:
+    """
+    Encode lại một clip về đúng chữ ký đích (codec, kích thước, fps, timebase, pix_fmt)
+    để có thể ghép với các clip khác bằng concat c=copy.
+    """
+    logger.info(f"Normalizing clip '{video_path}' -> '{output_path}' ({target.width}x{target.height}, {target.frame_rate}, {encoder})")
+    output_kwargs = {
+        'vcodec': encoder,
+        'preset': NORMALIZE_PRESET,
+        'crf': NORMALIZE_CRF,
+        'an': None, # Luồng audio của clip không được dùng ở các bước sau
+        **_signature_output_args(target, encoder),
+        **_thread_args(),
+    }
+
+    try:
+        _run_ffmpeg(
+            ffmpeg
+            .input(video_path)
+            .video
+            .filter('scale', target.width, target.height, force_original_aspect_ratio='decrease')
+            .filter('pad', target.width, target.height, '(ow-iw)/2', '(oh-ih)/2')
+            .filter('setsar', 1)
+            .filter('fps', fps=target.frame_rate)
+            .output(output_path, **output_kwargs),
+            stage='normalize', expected_duration=expected_duration
+        )
+        logger.info(f"Normalized clip written: {output_path}")
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg error normalizing clip {video_path}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        _unlink_quietly(output_path)
+        raise ValueError(f"Failed to normalize clip: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+
+
+def _prepare_copy_concat(processed_video_paths: List[str], video_probes: List[ProbeResult]) -> Tuple[bool, Dict[str, str]]:
+    """
+    Phân tích độ tương thích của các clip và chuẩn hóa những clip bị lệch
+    (lấy từ clip cache nếu đã có, ngược lại encode rồi lưu vào cache).
+    Trả về (có thể ghép bằng c=copy hay không, map đường dẫn gốc -> clip đã chuẩn hóa trong cache).
+    """
+    normalized_paths: Dict[str, str] = {}
+    try:
+        report = analyze_compatibility(video_probes)
+    except ValueError as e:
+        logger.warning(f"Clip compatibility analysis failed, re-encoding concat: {e}")
+        return False, normalized_paths
+
+    if report.all_compatible:
+        logger.info("All clips share codec/resolution/fps/timebase/pix_fmt. Using stream copy concat.")
+        return True, normalized_paths
+    if not report.target_encoder:
+        logger.info(f"No normalize encoder for target codec '{report.target.codec_name}'. Re-encoding concat.")
+        return False, normalized_paths
+
+    params = _normalize_params(report.target, report.target_encoder)
+    try:
+        for idx in report.mismatched:
+            source_path = processed_video_paths[idx]
+            if source_path in normalized_paths:
                 continue
+            normalized_paths[source_path] = clip_cache.get_or_create(
+                source_path, params,
+                lambda output_path, source_path=source_path, duration=video_probes[idx].video_duration:
+                    normalize_clip(source_path, report.target, report.target_encoder, output_path, duration)
+            )
+    except (ValueError, OSError, RenderTimeout) as e:
+        # Chuẩn hóa chỉ là đường tắt cho concat c=copy: quá hạn thì encode lại concat (hủy job vẫn được raise)
+        logger.warning(f"Clip normalization failed, re-encoding concat: {e}")
+        return False, {}
 
-            video_durations.append(duration)
-            processed_video_paths.append(abs_path) # Lưu đường dẫn tuyệt đối
-            logger.info(f"Successfully probed {abs_path}, duration: {duration}")
+    logger.info(f"Normalized {len(normalized_paths)} mismatched clips. Using stream copy concat.")
+    return True, normalized_paths
 
-        except ffmpeg.Error as e:
-            logger.error(f"ffmpeg.probe error for file: {abs_path}")
-            logger.error(f"ffprobe stdout: {e.stdout.decode('utf-8', errors='ignore') if e.stdout else 'N/A'}")
-            logger.error(f"ffprobe stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
-            logger.warning(f"Skipping video file due to probe error: {abs_path}")
-            continue # Bỏ qua file lỗi
-        except Exception as e:
-            # Log lỗi cụ thể hơn
-            logger.exception(f"Unexpected error probing video file: {abs_path} - Error: {e}")
-            logger.warning(f"Skipping video file due to unexpected error: {abs_path}")
+
+def _lookup_cached_normalized(processed_video_paths: List[str], video_probes: List[ProbeResult]) -> Optional[Dict[str, str]]:
+    """
+    Chỉ tra clip cache (không encode): trả về map clip lệch -> bản chuẩn hóa
+    nếu mọi clip lệch đều đã có trong cache, ngược lại None.
+    """
+    try:
+        report = analyze_compatibility(video_probes)
+    except ValueError:
+        return None
+    if report.all_compatible:
+        return {}
+    if not report.target_encoder:
+        return None
+
+    params = _normalize_params(report.target, report.target_encoder)
+    normalized_paths: Dict[str, str] = {}
+    for idx in report.mismatched:
+        source_path = processed_video_paths[idx]
+        if source_path in normalized_paths:
             continue
+        cached_path = clip_cache.lookup(source_path, params)
+        if not cached_path:
+            return None
+        normalized_paths[source_path] = cached_path
+    return normalized_paths
 
-    if not processed_video_paths:
-        raise ValueError("No valid video files could be processed after probing.")
 
+def _run_concat(list_filename: str, output_path: str, copy_mode: bool, expected_duration: float,
+                stage: str = 'concat') -> None:
+    """
+    Ghép các file trong list bằng concat demuxer: c=copy nếu copy_mode,
+    nếu copy thất bại (hoặc không tương thích) thì encode lại.
+    """
+    logger.info(f"Running ffmpeg concat operation (copy={copy_mode}). Output: {output_path}")
+    # --- Ghép file bằng concat demuxer ---
+    # Xóa bỏ ignore_chapters=1 vì gây lỗi
+    if copy_mode:
+        try:
+            _run_ffmpeg(
+                ffmpeg
+                .input(list_filename, format='concat', safe=0)
+                # Chỉ lấy luồng video: audio của clip bị thay bằng audio chính ở bước sau
+                .output(output_path, vcodec='copy', an=None),
+                stage=stage, expected_duration=expected_duration
+            )
+            logger.info(f"Stream copy concatenation successful for: {output_path}")
+            return
+        except ffmpeg.Error as e:
+            logger.warning(f"Stream copy concat failed, retrying with re-encode: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}")
+            _unlink_quietly(output_path)
+
+    _run_ffmpeg(
+        ffmpeg
+        .input(list_filename, format='concat', safe=0) # Đã xóa ignore_chapters
+        # Clip không tương thích (codec, res, fps, timebase) -> encode lại (an toàn hơn, chậm hơn):
+        .output(output_path, vcodec='libx264', acodec='aac', preset='fast', **_thread_args()), # Dùng preset 'fast' để nhanh hơn
+        stage=stage, expected_duration=expected_duration
+    )
+    logger.info(f"Concatenation successful for: {output_path}")
+
+
+def _build_loop_cycle(cycle_paths: List[str], copy_mode: bool, cycle_duration: float) -> Tuple[str, float]:
+    """
+    Ghép một vòng clip (mỗi clip một lần) thành một file trong TEMP_DIR.
+    Vòng này chỉ encode (hoặc copy) một lần rồi được lặp lại bằng concat demuxer (stream copy).
+    Trả về (đường dẫn, độ dài luồng video của vòng đã ghép) để outpoint của vòng cuối khớp file thật;
+    probe lỗi thì dùng cycle_duration (tổng độ dài luồng video của các clip).
+    """
+    cycle_output = os.path.join(TEMP_DIR, f"loop_cycle_{uuid.uuid4()}.mp4")
+    list_filename = _write_concat_list(cycle_paths)
+    try:
+        _run_concat(list_filename, cycle_output, copy_mode, cycle_duration, stage='loop_cycle')
+    except Exception:
+        _unlink_quietly(cycle_output)
+        raise
+    finally:
+        _unlink_quietly(list_filename)
+    try:
+        cycle_duration = probe_media(cycle_output).video_duration
+    except ValueError as e:
+        logger.warning(f"Could not probe loop cycle {cycle_output}, using the summed clip duration: {e}")
+    logger.info(f"Loop cycle built once ({cycle_duration:.2f}s): {cycle_output}")
+    return cycle_output, cycle_duration
+
+
+def _loops_needed(video_durations: List[float], target_duration: float) -> int:
+    """Số vòng clip cần để phủ target_duration."""
     single_loop_duration = sum(video_durations)
     if single_loop_duration <= 0:
          raise ValueError("Total duration of valid videos is zero or negative.")
+    return max(1, math.ceil(target_duration / single_loop_duration))
+
+
+@metrics.timed('concat')
+def concatenate_videos(video_paths: List[str], target_duration: float, content_hashes: Optional[Dict[str, str]] = None) -> str:
+    """
+    Ghép nối các video, bỏ qua file lỗi khi probe.
+    Nếu các clip tương thích (hoặc đã chuẩn hóa được) thì ghép bằng c=copy, ngược lại encode lại.
+    Khi audio dài hơn nhiều vòng clip, chỉ ghép/encode một vòng rồi lặp lại vòng đó bằng c=copy.
+    Clip cuối được cắt bằng outpoint của concat demuxer nên không encode phần vượt quá target_duration.
+    Trả về đường dẫn file tạm đã ghép.
+    """
+    processed_video_paths, video_durations, video_probes = _probe_video_files(video_paths, content_hashes)
+    copy_mode, normalized_paths = _prepare_copy_concat(processed_video_paths, video_probes)
+    loops = _loops_needed(video_durations, target_duration)
 
-    # --- Lặp các video hợp lệ cho đến khi đủ thời lượng ---
-    current_total_duration = 0.0
-    logger.info(f"Target duration: {target_duration}, Single loop duration: {single_loop_duration}")
-    while current_total_duration < target_duration:
-        for idx, path in enumerate(processed_video_paths):
-            input_videos_for_concat.append(path)
-            current_total_duration += video_durations[idx]
-            # logger.debug(f"Added video {idx+1}, current total duration: {current_total_duration}") # Debug log
-            if current_total_duration >= target_duration:
-                break
-    logger.info(f"Total videos in concat list: {len(input_videos_for_concat)}")
-
-    # --- Ghi vào file list.txt ---
-    list_filename = os.path.join(TEMP_DIR, f"concat_list_{uuid.uuid4()}.txt")
     temp_concat_output = os.path.join(TEMP_DIR, f"concat_output_{uuid.uuid4()}.mp4")
+    list_filename = None
+    cycle_path = None
 
     try:
-        logger.info(f"Creating concat list file: {list_filename}")
-        with open(list_filename, 'w', encoding='utf-8') as list_file:
-            for video_path in input_videos_for_concat:
-                # Đảm bảo dùng dấu / cho ffmpeg ngay cả trên Windows
-                safe_video_path = video_path.replace('\\', '/')
-                list_file.write(f"file '{safe_video_path}'\n")
-        logger.info(f"Concat list file content written.")
-
-        logger.info(f"Running ffmpeg concat operation. Output: {temp_concat_output}")
-        # --- Ghép file bằng concat demuxer ---
-        # Xóa bỏ ignore_chapters=1 vì gây lỗi
-        (
-            ffmpeg
-            .input(list_filename, format='concat', safe=0) # Đã xóa ignore_chapters
-            # Quan trọng: Bỏ c='copy' nếu video không tương thích hoàn toàn (codec, res, fps, timebase)
-            # Nếu giữ c='copy' mà video không tương thích -> lỗi hoặc video hỏng
-            # .output(temp_concat_output, c='copy')
-            # Thay bằng encode lại (an toàn hơn, chậm hơn):
-            .output(temp_concat_output, vcodec='libx264', acodec='aac', preset='fast') # Dùng preset 'fast' để nhanh hơn
-            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-        )
-        logger.info(f"Concatenation successful for: {temp_concat_output}")
+        if loops >= LOOP_REUSE_MIN_LOOPS:
+            # --- Encode một vòng, các vòng sau chỉ copy ---
+            logger.info(f"Target needs {loops} loops of clips. Building one loop cycle and repeating it with stream copy.")
+            cycle_path, cycle_duration = _build_loop_cycle(
+                [normalized_paths.get(path, path) for path in processed_video_paths], copy_mode, sum(video_durations))
+            timeline = _plan_clip_timeline([cycle_path], [cycle_duration], target_duration, snap_paths={})
+            list_filename = _write_timeline_list(timeline)
+            _run_concat(list_filename, temp_concat_output, True, timeline.duration)
+        else:
+            # --- Ghi timeline (clip cuối có outpoint) vào file list.txt ---
+            timeline = _plan_clip_timeline(processed_video_paths, video_durations, target_duration,
+                                           snap_paths=normalized_paths if copy_mode else None)
+            list_filename = _write_timeline_list(timeline.with_paths(normalized_paths))
+            _run_concat(list_filename, temp_concat_output, copy_mode, timeline.duration)
         return temp_concat_output
 
     except ffmpeg.Error as e:
         logger.error(f"ffmpeg concat error using list {list_filename}")
         logger.error(f"ffmpeg stdout: {e.stdout.decode('utf-8', errors='ignore') if e.stdout else 'N/A'}")
         logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
-        if os.path.exists(temp_concat_output):
-            os.unlink(temp_concat_output)
+        _unlink_quietly(temp_concat_output)
         raise ValueError(f"Failed to concatenate videos: {e.stderr.decode('utf-8', errors='ignore')}") from e
     except Exception as e:
         logger.exception(f"Unexpected error during concatenation using list {list_filename}")
-        if os.path.exists(temp_concat_output):
-            os.unlink(temp_concat_output)
+        _unlink_quietly(temp_concat_output)
         raise
     finally:
-        if os.path.exists(list_filename):
-            try:
-                os.unlink(list_filename)
-                logger.info(f"Deleted temp concat list: {list_filename}")
-            except OSError as unlink_error:
-                 logger.error(f"Error deleting temp file {list_filename}: {unlink_error}")
+        if list_filename:
+            _unlink_quietly(list_filename)
+        if cycle_path:
+            _unlink_quietly(cycle_path)
 
 
-def add_audio_to_video(video_path: str, audio_path: str, output_path: str, target_duration: float) -> None:
+@metrics.timed('audio_mux')
+def add_audio_to_video(video_path: str, audio_path: str, output_path: str, target_duration: float,
+                       keyframe_interval: Optional[float] = None, audio_info: Optional[AudioInfo] = None) -> None:
     """
     Gán audio vào video, cắt đúng bằng target_duration.
+    Audio được stream copy khi codec tương thích (xem AUDIO_COPY_CODECS), chỉ encode AAC khi cần.
+    keyframe_interval: ép keyframe mỗi N giây (dùng cho burn phụ đề selective ở bước sau).
     """
+    audio_info = audio_info or analyze_audio(audio_path)
+    keyframe_args = {}
+    if keyframe_interval:
+        keyframe_args['force_key_frames'] = f"expr:gte(t,n_forced*{keyframe_interval})"
     logger.info(f"Adding audio '{audio_path}' to video '{video_path}' -> '{output_path}' (duration: {target_duration}s)")
     try:
         video_stream = ffmpeg.input(video_path)
         audio_stream = ffmpeg.input(audio_path)
 
-        (
+        _run_ffmpeg(
             ffmpeg
             .output(video_stream['v'], audio_stream['a'], output_path,
                     t=target_duration,      # Trim/Extend to target duration
                     vcodec='libx264',
-                    acodec='aac',
-                    strict='experimental',  # Often needed for aac
                     preset='medium',        # Balance speed/quality
                     crf=23,                 # Video quality (lower is better)
-                    shortest=None           # Do not use shortest with -t
+                    shortest=None,          # Do not use shortest with -t
+                    **_audio_output_args(audio_info),
+                    **keyframe_args,
+                    **_thread_args()
                    )
              # Bắt buộc phải dùng .global_args('-map', '0:v:0', '-map', '1:a:0') nếu input có nhiều luồng
              # Tuy nhiên, nếu input chỉ có 1 video/1 audio thì ffmpeg-python tự xử lý
-            .global_args('-map', '0:v:0', '-map', '1:a:0') # Explicitly map streams
-            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            .global_args('-map', '0:v:0', '-map', '1:a:0'), # Explicitly map streams
+            stage='audio', expected_duration=target_duration
         )
         logger.info(f"Successfully added audio and trimmed video: {output_path}")
 
@@ -193,7 +658,8 @@ def add_audio_to_video(video_path: str, audio_path: str, output_path: str, targe
         raise
 
 
-def add_subtitles(video_path: str, srt_path: str, output_path: str) -> None:
+@metrics.timed('subtitles')
+def add_subtitles(video_path: str, srt_path: str, output_path: str, expected_duration: Optional[float] = None) -> None:
     """
     Thêm phụ đề SRT vào video.
     """
@@ -201,32 +667,24 @@ def add_subtitles(video_path: str, srt_path: str, output_path: str) -> None:
     safe_srt_path = _escape_path_for_ffmpeg_filter(srt_path)
     logger.info(f"Using escaped subtitle path in filter: {safe_srt_path}")
 
-    subtitle_style = "FontName=Arial,FontSize=24,PrimaryColour=&H00FFFFFF,OutlineColour=&HFF000000,BorderStyle=1,Outline=1,Shadow=1,Alignment=2,MarginV=15"
-
     try:
-        # Lấy thông tin luồng audio từ video_path để giữ nguyên codec
-        probe = ffmpeg.probe(video_path)
-        # Tìm luồng audio đầu tiên
-        audio_stream_info = next((stream for stream in probe['streams'] if stream['codec_type'] == 'audio'), None)
-        # Xác định audio codec, mặc định là aac nếu không tìm thấy
-        original_acodec = audio_stream_info['codec_name'] if audio_stream_info else 'aac'
-        logger.info(f"Detected original audio codec: {original_acodec}")
-
-        (
+        _run_ffmpeg(
             ffmpeg
             .input(video_path)
             .output(
                 output_path,
-                vf=f"subtitles='{safe_srt_path}':force_style='{subtitle_style}'",
+                vf=f"subtitles='{safe_srt_path}':force_style='{SUBTITLE_STYLE}'",
                 # --- Mã hóa lại video, giữ nguyên audio nếu có thể ---
                 vcodec='libx264',
-                acodec=original_acodec, # Cố gắng giữ nguyên audio codec
+                acodec='copy', # Audio đã đúng codec/độ dài từ bước trước, không encode lại
                 preset='medium',
-                crf=23
+                crf=23,
+                **_container_args(),
+                **_thread_args()
                 # Thêm các tùy chọn khác nếu cần, ví dụ: -map để đảm bảo giữ các luồng
             )
-            .global_args('-map', '0') # Map tất cả các luồng từ input 0
-            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            .global_args('-map', '0'), # Map tất cả các luồng từ input 0
+            stage='subtitles', expected_duration=expected_duration
         )
         logger.info(f"Successfully added subtitles: {output_path}")
 
@@ -240,35 +698,479 @@ def add_subtitles(video_path: str, srt_path: str, output_path: str) -> None:
         raise
 
 
-def process_video(audio_path: str, video_paths: List[str], srt_path: str, output_final_path: str) -> str:
+@metrics.timed('subtitles_soft')
+def add_soft_subtitles(video_path: str, srt_path: str, output_path: str, expected_duration: Optional[float] = None) -> None:
+    """
+    Mux SRT thành track phụ đề mov_text (bật/tắt được trong player).
+    Video và audio được stream copy nên chỉ mất vài giây.
+    """
+    logger.info(f"Muxing soft subtitles '{srt_path}' into video '{video_path}' -> '{output_path}'")
+    try:
+        _run_ffmpeg(
+            ffmpeg
+            .output(ffmpeg.input(video_path), ffmpeg.input(srt_path), output_path,
+                    vcodec='copy',
+                    acodec='copy',
+                    scodec='mov_text', # MP4 chỉ hỗ trợ phụ đề dạng mov_text
+                    **_container_args()),
+            stage='subtitles', expected_duration=expected_duration
+        )
+        logger.info(f"Successfully muxed soft subtitles: {output_path}")
+
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg error muxing soft subtitles from {srt_path}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        _unlink_quietly(output_path)
+        raise ValueError(f"Failed to mux soft subtitles: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+
+
+def _plan_selective_ranges(windows: List[Tuple[float, float]], keyframes: List[float],
+                           duration: float) -> List[Tuple[float, float, bool]]:
+    """
+    Chia [0, duration) thành các khoảng (start, end, cần encode lại hay không).
+    Mỗi cửa sổ phụ đề được nới ra tới keyframe gần nhất ở hai phía, nên mọi khoảng
+    stream copy đều bắt đầu bằng keyframe.
+    """
+    burn_ranges: List[Tuple[float, float]] = []
+    for start, end in windows:
+        if start >= duration:
+            break
+        idx = bisect.bisect_right(keyframes, start) - 1
+        start = keyframes[idx] if idx >= 0 else 0.0
+        idx = bisect.bisect_left(keyframes, end)
+        end = min(keyframes[idx] if idx < len(keyframes) else duration, duration)
+        if burn_ranges and start <= burn_ranges[-1][1]:
+            burn_ranges[-1] = (burn_ranges[-1][0], max(burn_ranges[-1][1], end))
+        else:
+            burn_ranges.append((start, end))
+
+    ranges = []
+    position = 0.0
+    for start, end in burn_ranges:
+        if start > position:
+            ranges.append((position, start, False))
+        ranges.append((start, end, True))
+        position = end
+    if position < duration:
+        ranges.append((position, duration, False))
+    return ranges
+
+
+def add_subtitles_selective(video_path: str, srt_path: str, output_path: str, expected_duration: Optional[float] = None) -> None:
+    """
+    Burn phụ đề nhưng chỉ encode lại các khoảng có cue (nới tới keyframe); phần còn lại
+    stream copy, sau đó nối bằng concat demuxer và copy audio gốc.
+    Với video không phải H.264 hoặc phụ đề phủ gần hết video thì burn toàn bộ bằng add_subtitles.
+    """
+    probe = probe_media(video_path)
+    if probe.video_codec != 'h264':
+        logger.info(f"Selective subtitles need H.264 input (got {probe.video_codec}). Burning the whole video.")
+        add_subtitles(video_path, srt_path, output_path, expected_duration)
+        return
+
+    windows = cue_windows(parse_srt(srt_path), merge_gap=SELECTIVE_MERGE_GAP)
+    ranges = _plan_selective_ranges(windows, probe_keyframes(video_path), probe.duration)
+    burn_seconds = sum(end - start for start, end, burn in ranges if burn)
+    if burn_seconds >= SELECTIVE_MAX_BURN_RATIO * probe.duration:
+        logger.info(f"Subtitles cover {burn_seconds:.1f}s of {probe.duration:.1f}s. Burning the whole video.")
+        add_subtitles(video_path, srt_path, output_path, expected_duration)
+        return
+    logger.info(f"Selective subtitles: re-encoding {burn_seconds:.1f}s of {probe.duration:.1f}s in "
+                f"{sum(1 for *_, burn in ranges if burn)} ranges -> '{output_path}'")
+    _burn_subtitle_ranges(video_path, srt_path, output_path, probe, ranges, expected_duration)
+
+
+@metrics.timed('subtitles_selective')
+def _burn_subtitle_ranges(video_path: str, srt_path: str, output_path: str, probe: ProbeResult,
+                          ranges: List[Tuple[float, float, bool]], expected_duration: Optional[float] = None) -> None:
+    """
+    Encode từng khoảng của add_subtitles_selective (burn hoặc copy) rồi nối lại.
+    Tách riêng để span 'subtitles_selective' không lồng span 'subtitles' của nhánh burn toàn bộ.
+    """
+    encode_args = {
+        'vcodec': 'libx264',
+        'preset': 'medium',
+        'crf': 23,
+        'an': None,
+        **_signature_output_args(clip_signature(probe)),
+        **_thread_args(),
+    }
+    subtitle_file = os.path.abspath(srt_path).replace('\\', '/')
+    work_dir = os.path.join(TEMP_DIR, f"selective_{uuid.uuid4()}")
+    os.makedirs(work_dir, exist_ok=True)
+    list_filename = None
+    try:
+        piece_paths = []
+        for idx, (start, end, burn) in enumerate(ranges):
+            piece_path = os.path.join(work_dir, f"piece_{idx:05d}.mp4")
+            video = ffmpeg.input(video_path, ss=start, t=end - start).video
+            if burn:
+                # Dời timestamp về vị trí thật để filter subtitles chọn đúng cue
+                video = (
+                    video
+                    .setpts(f'PTS-STARTPTS+{start}/TB')
+                    .filter('subtitles', subtitle_file, force_style=SUBTITLE_STYLE)
+                    .setpts('PTS-STARTPTS')
+                )
+                stream_spec = video.output(piece_path, **encode_args)
+            else:
+                stream_spec = video.output(piece_path, vcodec='copy', an=None, avoid_negative_ts='make_zero')
+            # Mọi đoạn cùng báo stage 'subtitles' với tiến độ cộng dồn trên toàn video
+            _run_ffmpeg(stream_spec, stage='subtitles', expected_duration=end - start,
+                        progress_offset=start, progress_total=probe.duration)
+            piece_paths.append(piece_path)
+
+        list_filename = _write_concat_list(piece_paths)
+        streams = [ffmpeg.input(list_filename, format='concat', safe=0).video]
+        if probe.audio_stream:
+            streams.append(ffmpeg.input(video_path).audio)
+        _run_ffmpeg(
+            ffmpeg.output(*streams, output_path, c='copy', **_container_args()),
+            stage='subtitles_concat', expected_duration=expected_duration
+        )
+        logger.info(f"Successfully added subtitles (selective): {output_path}")
+
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg error adding selective subtitles from {srt_path}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        _unlink_quietly(output_path)
+        raise ValueError(f"Failed to add selective subtitles: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+    finally:
+        if list_filename:
+            _unlink_quietly(list_filename)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _render_target_from_probes(probes: List[ProbeResult]) -> Tuple[int, int, float]:
+    """
+    Lấy (width, height, fps) của chữ ký đích (chữ ký phổ biến nhất, xem analyze_compatibility) làm
+    thông số cho filter graph, để khung hình output khớp với các clip ghép bằng concat demuxer
+    (clip gốc hoặc bản chuẩn hóa trong cache) dù clip đầu tiên bị lệch. libx264 với yuv420p yêu cầu kích thước chẵn.
+    Clip không có luồng video -> ValueError.
+    """
+    report = analyze_compatibility(probes)
+    probe = probes[report.signatures.index(report.target)]
+    return report.target.width // 2 * 2, report.target.height // 2 * 2, probe.fps
+
+
+def _preview_target(width: int, height: int, fps: float) -> Tuple[int, int, float]:
+    """Thu nhỏ thông số đích về PREVIEW_HEIGHT/PREVIEW_FPS (giữ tỉ lệ khung hình, kích thước chẵn)."""
+    if height <= PREVIEW_HEIGHT:
+        return width, height, min(fps, PREVIEW_FPS)
+    preview_width = max(2, int(round(width * PREVIEW_HEIGHT / height / 2)) * 2)
+    return preview_width, PREVIEW_HEIGHT // 2 * 2, min(fps, PREVIEW_FPS)
+
+
+def _fit_frame(stream, width: int, height: int, fps: float):
+    """Scale + pad về đúng width x height, SAR 1, fps và yuv420p (điều kiện của concat filter)."""
+    return (
+        stream
+        .filter('scale', width, height, force_original_aspect_ratio='decrease')
+        .filter('pad', width, height, '(ow-iw)/2', '(oh-ih)/2')
+        .filter('setsar', 1)
+        .filter('fps', fps=fps)
+        .filter('format', 'yuv420p')
+    )
+
+
+def render_single_pass(audio_path: str, video_paths: List[str], srt_path: str, output_path: str, target_duration: float,
+                       content_hashes: Optional[Dict[str, str]] = None, soft_subtitles: bool = False,
+                       preview: bool = False, hls_dir: Optional[str] = None) -> None:
+    """
+    Render một lượt: concat -> cắt theo target_duration -> phụ đề trong cùng một filter graph.
+    Chỉ encode libx264 một lần và không ghi file trung gian vào TEMP_DIR.
+    soft_subtitles=True: không burn, mux SRT thành track mov_text trong cùng lệnh.
+    preview=True: bản xem trước PREVIEW_HEIGHT/PREVIEW_FPS với preset ultrafast, không chuẩn hóa clip.
+    hls_dir: đồng thời ghi playlist + segment HLS vào thư mục này (tee muxer, vẫn chỉ encode một lần),
+    nên client phát được các segment đầu trong khi phần sau còn đang render.
+    """
+    processed_video_paths, video_durations, video_probes = _probe_video_files(video_paths, content_hashes)
+    timeline = _plan_clip_timeline(processed_video_paths, video_durations, target_duration)
+    width, height, fps = _render_target_from_probes(video_probes)
+    if preview:
+        width, height, fps = _preview_target(width, height, fps)
+    logger.info(f"Single-pass {'preview ' if preview else ''}render target: {width}x{height} @ {fps:.3f}fps, "
+                f"{len(timeline.pieces)} segments -> '{output_path}'")
+
+    list_filename = None
+    cycle_path = None
+    loop_copy_mode, loop_normalized_paths = False, {}
+    # Preview không đáng để chuẩn hóa clip (encode thêm) nên chỉ dùng bản chuẩn hóa đã có trong cache
+    if not preview and _loops_needed(video_durations, target_duration) >= LOOP_REUSE_MIN_LOOPS:
+        # Audio dài hơn nhiều vòng clip: chuẩn hóa/ghép một vòng duy nhất rồi lặp lại qua concat list
+        loop_copy_mode, loop_normalized_paths = _prepare_copy_concat(processed_video_paths, video_probes)
+    normalized_paths = None if loop_copy_mode else _lookup_cached_normalized(processed_video_paths, video_probes)
+
+    try:
+        if loop_copy_mode:
+            cycle_path, cycle_duration = _build_loop_cycle(
+                [loop_normalized_paths.get(path, path) for path in processed_video_paths], True, sum(video_durations))
+            # Vòng clip lặp lại qua concat demuxer, vòng cuối dừng ở outpoint
+            list_filename = _write_timeline_list(plan_timeline([cycle_path], {cycle_path: cycle_duration}, target_duration))
+            joined = ffmpeg.input(list_filename, format='concat', safe=0).video
+        elif normalized_paths is not None:
+            # Các clip cùng chữ ký (hoặc bản chuẩn hóa đã có trong clip cache)
+            # -> đọc qua concat demuxer như một input duy nhất, không cần chuẩn hóa
+            list_filename = _write_timeline_list(timeline.with_paths(normalized_paths))
+            joined = ffmpeg.input(list_filename, format='concat', safe=0).video
+            if preview:
+                joined = _fit_frame(joined, width, height, fps)
+        else:
+            # Concat filter yêu cầu mọi đoạn cùng kích thước/SAR/fps nên chuẩn hóa từng đoạn trước khi nối
+            segments = [_fit_frame(ffmpeg.input(piece.path, **piece.input_args()).video, width, height, fps)
+                        for piece in timeline.pieces]
+            joined = ffmpeg.concat(*segments, v=1, a=0)
+    except ffmpeg.Error as e:
+        if cycle_path:
+            _unlink_quietly(cycle_path)
+        raise ValueError(f"Failed to build loop cycle: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+
+    # ffmpeg-python tự escape tham số filter nên truyền đường dẫn tuyệt đối (dùng '/') trực tiếp
+    subtitle_file = os.path.abspath(srt_path).replace('\\', '/')
+    video = (
+        joined
+        .trim(duration=target_duration)
+        .setpts('PTS-STARTPTS')
+    )
+    if not soft_subtitles:
+        video = video.filter('subtitles', subtitle_file, force_style=SUBTITLE_STYLE)
+    streams = [video, ffmpeg.input(audio_path).audio]
+    subtitle_args = {}
+    if soft_subtitles:
+        streams.append(ffmpeg.input(srt_path))
+        subtitle_args['scodec'] = 'mov_text'
+    if preview:
+        quality_args = {'preset': 'ultrafast', 'crf': PREVIEW_CRF, 'acodec': 'aac', 'audio_bitrate': '64k'}
+    else:
+        audio_info = analyze_audio(audio_path, (content_hashes or {}).get(os.path.abspath(audio_path)))
+        quality_args = {'preset': 'medium', 'crf': 23, **_audio_output_args(audio_info)}
+
+    output_target, muxer_args = output_path, _container_args()
+    if hls_dir:
+        _reset_dir(hls_dir)
+        # tee: một lần encode, hai muxer. global_header cho MP4, h264_mp4toannexb cho segment .ts
+        hls_options = {'f': 'hls', **_hls_muxer_options(hls_dir), 'bsfs/v': 'h264_mp4toannexb'}
+        if soft_subtitles:
+            hls_options['select'] = 'v,a' # mov_text không đóng gói được vào MPEG-TS
+        mp4_options = 'f=mp4' + (':movflags=+faststart' if FASTSTART_ENABLED else '')
+        output_target = '|'.join([
+            f"[{mp4_options}]{_escape_tee(output_path)}",
+            f"[{':'.join(f'{key}={_escape_tee(value)}' for key, value in hls_options.items())}]"
+            f"{_escape_tee(os.path.join(hls_dir, HLS_PLAYLIST_NAME))}",
+        ])
+        muxer_args = {'format': 'tee', 'flags': '+global_header', **_hls_keyframe_args()}
+
+    try:
+        _run_ffmpeg(
+            ffmpeg
+            .output(*streams, output_target,
+                    t=target_duration,
+                    vcodec='libx264',
+                    **quality_args,
+                    **subtitle_args,
+                    **muxer_args,
+                    **_thread_args()),
+            stage='preview' if preview else 'render', expected_duration=target_duration
+        )
+        logger.info(f"Single-pass render successful: {output_path}")
+
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg single-pass render error for {output_path}")
+        logger.error(f"ffmpeg stdout: {e.stdout.decode('utf-8', errors='ignore') if e.stdout else 'N/A'}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        _unlink_quietly(output_path)
+        raise ValueError(f"Failed single-pass render: {e.stderr.decode('utf-8', errors='ignore')}") from e
+    finally:
+        if list_filename:
+            _unlink_quietly(list_filename)
+        if cycle_path:
+            _unlink_quietly(cycle_path)
+
+
+@metrics.timed('hls_package')
+def package_hls(video_path: str, hls_dir: str, expected_duration: Optional[float] = None) -> None:
+    """
+    Đóng gói một MP4 đã render thành HLS bằng stream copy (dùng khi output không đi qua
+    render_single_pass, ví dụ render song song hoặc pipeline nhiều bước). Segment cắt tại keyframe sẵn có.
+    """
+    logger.info(f"Packaging HLS from '{video_path}' -> '{hls_dir}'")
+    _reset_dir(hls_dir)
+    source = ffmpeg.input(video_path)
+    streams = [source.video]
+    if probe_media(video_path).audio_stream:
+        streams.append(source.audio)
+    try:
+        _run_ffmpeg(
+            ffmpeg.output(*streams, os.path.join(hls_dir, HLS_PLAYLIST_NAME), c='copy', format='hls',
+                          **_hls_muxer_options(hls_dir)),
+            stage='hls', expected_duration=expected_duration
+        )
+        logger.info(f"HLS playlist available at: {os.path.join(hls_dir, HLS_PLAYLIST_NAME)}")
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg error packaging HLS for {video_path}")
+        logger.error(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else 'N/A'}")
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        raise ValueError(f"Failed to package HLS: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else e}") from e
+
+
+def _package_hls_quietly(video_path: str, hls_dir: Optional[str], expected_duration: float) -> None:
+    """HLS là định dạng bổ sung: lỗi đóng gói chỉ được log, MP4 vẫn là kết quả của job."""
+    if not hls_dir:
+        return
+    try:
+        package_hls(video_path, hls_dir, expected_duration)
+    except ValueError as hls_error:
+        logger.warning(f"HLS packaging failed, only the MP4 output is available: {hls_error}")
+
+
+def _record_bytes_processed(audio_path: str, video_paths: List[str], srt_path: str, output_path: str) -> None:
+    """Cộng dồn số byte input đã đọc và output đã ghi của một job thành công."""
+    input_bytes = 0
+    for path in [audio_path, srt_path, *video_paths]:
+        try:
+            input_bytes += os.path.getsize(path)
+        except OSError:
+            continue
+    metrics.bytes_processed.inc(input_bytes, kind='input')
+    metrics.bytes_processed.inc(os.path.getsize(output_path), kind='output')
+
+
+def process_video(audio_path: str, video_paths: List[str], srt_path: str, output_final_path: str,
+                  single_pass: bool = SINGLE_PASS_DEFAULT, content_hashes: Optional[Dict[str, str]] = None,
+                  progress_callback: Optional[Callable[[dict], None]] = None,
+                  parallel: bool = PARALLEL_RENDER_DEFAULT, subtitle_mode: str = SUBTITLE_MODE_DEFAULT,
+                  preview_output_path: Optional[str] = None, preview_callback: Optional[Callable[[str], None]] = None,
+                  cancel_event=None, hls_output_dir: Optional[str] = None) -> str:
     """
     Hàm chính: Ghép video, thêm audio, phụ đề và xử lý file tạm.
+    Mặc định render một lượt; nếu thất bại sẽ quay về pipeline nhiều bước.
+    parallel=True: chia timeline thành nhiều đoạn encode song song (parallel_render.py), lỗi thì quay về các chế độ trên.
+    content_hashes (đường dẫn -> sha256, tính lúc upload) giúp probe cache và clip cache không phải băm lại file.
+    progress_callback nhận tiến độ (stage, percent, fps, eta) đọc từ '-progress' của ffmpeg.
+    Output được ghi vào file tạm rồi rename atomic, nên output_final_path chỉ xuất hiện khi đã hoàn chỉnh.
+    subtitle_mode: burn (mặc định), soft (track mov_text, không encode lại) hoặc selective
+    (pipeline nhiều bước chỉ encode lại các khoảng có cue).
+    preview_output_path: render trước một bản preview nhỏ (PREVIEW_HEIGHT, ultrafast) rồi gọi preview_callback(path);
+    lỗi preview chỉ được log, không làm hỏng job.
+    cancel_event (Event, có thể là proxy của Manager): khi được set, lệnh ffmpeg đang chạy bị kill và raise RenderCancelled.
+    hls_output_dir: thêm bản HLS (playlist HLS_PLAYLIST_NAME + segment). Single-pass ghi HLS ngay trong lượt encode
+    để client phát được khi job còn chạy; các chế độ khác đóng gói từ MP4 cuối bằng stream copy.
     """
+    if subtitle_mode not in SUBTITLE_MODES:
+        raise ValueError(f"Unknown subtitle mode '{subtitle_mode}'. Expected one of: {', '.join(SUBTITLE_MODES)}")
+    soft_subtitles = subtitle_mode == 'soft'
     temp_files_to_delete = []
+    content_hashes = {os.path.abspath(path): value for path, value in (content_hashes or {}).items()}
+    clip_cache.remember_hashes(content_hashes)
+    working_output_path = _partial_output_path(output_final_path)
+    temp_files_to_delete.append(working_output_path)
+    reporter_token = None
+    cancel_token = _cancel_event.set(cancel_event)
+    preview_stages = ['preview'] if preview_output_path else []
+    serial_stages = preview_stages + (SINGLE_PASS_STAGES if single_pass else MULTI_STEP_STAGES)
     logger.info("--- Starting Video Processing Pipeline ---")
     try:
-        # --- 1. Lấy duration file audio ---
-        logger.info(f"Step 1: Probing audio file: {audio_path}")
-        probe_audio = ffmpeg.probe(audio_path)
-        audio_duration = float(probe_audio['format']['duration'])
-        logger.info(f"Audio duration: {audio_duration} seconds")
+        # --- 1. Phân tích audio (cache theo content hash trên đĩa) ---
+        logger.info(f"Step 1: Analyzing audio file: {audio_path}")
+        with metrics.span('probe', kind='audio'):
+            audio_hash = content_hashes.get(os.path.abspath(audio_path))
+            if not audio_hash or not audio_analysis_cache.contains(audio_hash):
+                # Probe audio cùng lượt với các clip (song song); các bước sau đọc từ probe cache
+                all_paths = [os.path.abspath(path) for path in [audio_path, *video_paths]]
+                probe_many(all_paths, content_hashes)
+            audio_info = analyze_audio(audio_path, audio_hash)
+        audio_duration = audio_info.duration
+        logger.info(f"Audio: {audio_duration} seconds, codec={audio_info.codec}, "
+                    f"{'stream copy' if _audio_output_args(audio_info)['acodec'] == 'copy' else 'encode AAC'}")
+
+        reporter = None
+        if progress_callback:
+            reporter = _ProgressReporter(progress_callback, serial_stages, audio_duration)
+            reporter_token = _progress_reporter.set(reporter)
+
+        if preview_output_path:
+            # Bản xem trước để kiểm tra timing/phụ đề trong khi bản chính tiếp tục render
+            logger.info(f"Step 1b: Rendering preview: {preview_output_path}")
+            working_preview_path = _partial_output_path(preview_output_path)
+            temp_files_to_delete.append(working_preview_path)
+            try:
+                with metrics.span('preview'):
+                    render_single_pass(audio_path, video_paths, srt_path, working_preview_path, audio_duration, content_hashes,
+                                       soft_subtitles=soft_subtitles, preview=True)
+                os.replace(working_preview_path, preview_output_path)
+                logger.info(f"Preview available at: {preview_output_path}")
+                if preview_callback:
+                    preview_callback(preview_output_path)
+            except (ValueError, RenderTimeout) as preview_error:
+                logger.warning(f"Preview render failed, continuing with the full render: {preview_error}")
+
+        if parallel:
+            # Import tại chỗ vì parallel_render dùng lại các hàm của module này
+            from app.services.parallel_render import render_parallel
+            logger.info("Step 2: Parallel segmented render...")
+            if reporter:
+                reporter.set_stages(preview_stages + PARALLEL_STAGES, completed=len(preview_stages))
+            try:
+                with metrics.span('parallel_render'):
+                    render_parallel(audio_path, video_paths, srt_path, working_output_path, audio_duration, content_hashes,
+                                    soft_subtitles=soft_subtitles)
+                os.replace(working_output_path, output_final_path)
+                _package_hls_quietly(output_final_path, hls_output_dir, audio_duration)
+                _record_bytes_processed(audio_path, video_paths, srt_path, output_final_path)
+                logger.info(f"--- Video Processing Pipeline Completed Successfully (parallel) ---")
+                logger.info(f"Final video available at: {output_final_path}")
+                return output_final_path
+            except ValueError as parallel_error:
+                logger.warning(f"Parallel render failed, falling back to serial pipeline: {parallel_error}")
+                if reporter:
+                    reporter.set_stages(serial_stages, completed=len(preview_stages))
+
+        if single_pass:
+            logger.info("Step 2: Single-pass render (concat + audio + subtitles)...")
+            try:
+                with metrics.span('single_pass_render'):
+                    render_single_pass(audio_path, video_paths, srt_path, working_output_path, audio_duration, content_hashes,
+                                       soft_subtitles=soft_subtitles, hls_dir=hls_output_dir)
+                os.replace(working_output_path, output_final_path)
+                _record_bytes_processed(audio_path, video_paths, srt_path, output_final_path)
+                logger.info(f"--- Video Processing Pipeline Completed Successfully (single-pass) ---")
+                logger.info(f"Final video available at: {output_final_path}")
+                return output_final_path
+            except ValueError as single_pass_error:
+                logger.warning(f"Single-pass render failed, falling back to multi-step pipeline: {single_pass_error}")
+                if reporter:
+                    reporter.set_stages(preview_stages + MULTI_STEP_STAGES, completed=len(preview_stages))
 
         # --- 2. Ghép video đủ dài ---
         logger.info("Step 2: Starting video concatenation...")
-        concatenated_video_temp = concatenate_videos(video_paths, target_duration=audio_duration)
+        concatenated_video_temp = concatenate_videos(video_paths, target_duration=audio_duration, content_hashes=content_hashes)
         temp_files_to_delete.append(concatenated_video_temp)
         logger.info(f"Temporary concatenated video created: {concatenated_video_temp}")
 
         # --- 3. Gán audio và cắt video theo duration audio ---
         logger.info("Step 3: Adding audio and trimming video...")
         temp_with_audio = os.path.join(TEMP_DIR, f"audio_added_{uuid.uuid4()}.mp4")
-        add_audio_to_video(concatenated_video_temp, audio_path, temp_with_audio, audio_duration)
+        add_audio_to_video(concatenated_video_temp, audio_path, temp_with_audio, audio_duration,
+                           keyframe_interval=SELECTIVE_KEYFRAME_INTERVAL if subtitle_mode == 'selective' else None,
+                           audio_info=audio_info)
         temp_files_to_delete.append(temp_with_audio)
         logger.info(f"Temporary video with audio created: {temp_with_audio}")
 
         # --- 4. Thêm phụ đề vào video đã có audio và đúng độ dài ---
-        logger.info("Step 4: Adding subtitles...")
-        add_subtitles(temp_with_audio, srt_path, output_final_path)
+        logger.info(f"Step 4: Adding subtitles ({subtitle_mode})...")
+        if soft_subtitles:
+            add_soft_subtitles(temp_with_audio, srt_path, working_output_path, expected_duration=audio_duration)
+        elif subtitle_mode == 'selective':
+            try:
+                add_subtitles_selective(temp_with_audio, srt_path, working_output_path, expected_duration=audio_duration)
+            except ValueError as selective_error:
+                logger.warning(f"Selective subtitles failed, burning the whole video: {selective_error}")
+                add_subtitles(temp_with_audio, srt_path, working_output_path, expected_duration=audio_duration)
+        else:
+            add_subtitles(temp_with_audio, srt_path, working_output_path, expected_duration=audio_duration)
+        os.replace(working_output_path, output_final_path)
+        _package_hls_quietly(output_final_path, hls_output_dir, audio_duration)
+        _record_bytes_processed(audio_path, video_paths, srt_path, output_final_path)
         logger.info(f"--- Video Processing Pipeline Completed Successfully ---")
         logger.info(f"Final video available at: {output_final_path}")
 
@@ -276,6 +1178,8 @@ def process_video(audio_path: str, video_paths: List[str], srt_path: str, output
 
     except Exception as main_error:
          logger.exception(f"--- Video Processing Pipeline FAILED --- Error: {main_error}")
+         if hls_output_dir:
+             shutil.rmtree(hls_output_dir, ignore_errors=True) # Không để lại playlist dở
          # Không cần raise lại lỗi nếu muốn background task hoàn thành (nhưng không thành công)
          # Nếu muốn báo lỗi rõ ràng hơn thì raise main_error
          # raise main_error
@@ -284,14 +1188,18 @@ def process_video(audio_path: str, video_paths: List[str], srt_path: str, output
          raise main_error
 
     finally:
+        if reporter_token is not None:
+            _progress_reporter.reset(reporter_token)
+        _cancel_event.reset(cancel_token)
         # --- Dọn dẹp tất cả file tạm đã tạo ---
         logger.info("--- Cleaning up temporary files ---")
         # Đảo ngược danh sách để xóa file gần nhất trước (tùy chọn)
         # temp_files_to_delete.reverse()
-        for temp_file in temp_files_to_delete:
-            if os.path.exists(temp_file):
-                try:
-                    os.unlink(temp_file)
-                    logger.info(f"Deleted temp file: {temp_file}")
-                except OSError as unlink_error:
-                    logger.error(f"Error deleting temp file {temp_file}: {unlink_error}")
\ No newline at end of file
+        with metrics.span('cleanup'):
+            for temp_file in temp_files_to_delete:
+                if os.path.exists(temp_file):
+                    try:
+                        os.unlink(temp_file)
+                        logger.info(f"Deleted temp file: {temp_file}")
+                    except OSError as unlink_error:
+                        logger.error(f"Error deleting temp file {temp_file}: {unlink_error}")
\ No newline at end of file
@@ -0,0 +1,47 @@
+# backend/app/utils/file_helper.py
+
+import hashlib
+import os
+from typing import Tuple
+
+import aiofiles
+
+# Kích thước khối đọc/ghi file (1 MiB)
+CHUNK_SIZE = 1024 * 1024
+
+
+def compute_file_hash(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """Tính SHA-256 của file theo từng khối, không đọc toàn bộ file vào bộ nhớ."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+async def save_upload_stream(upload, dest_path: str, chunk_size: int = CHUNK_SIZE) -> Tuple[int, str]:
+    """
+    Ghi một UploadFile xuống đĩa theo từng khối cố định (bộ nhớ tối đa ~chunk_size),
+    đồng thời tính SHA-256 trong lúc ghi để không phải đọc lại file.
+    Lỗi hoặc bị hủy giữa chừng (client ngắt kết nối, đĩa đầy) thì xóa file ghi dở.
+    Trả về (số byte đã ghi, sha256 hex).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+    except BaseException:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+    return size, digest.hexdigest()
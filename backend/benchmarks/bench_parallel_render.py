@@ -0,0 +1,73 @@
+# backend/benchmarks/bench_parallel_render.py
+#
+# So sánh thời gian render nối tiếp (render_single_pass) với chế độ render song song theo đoạn (render_parallel).
+# Gọi trực tiếp hai hàm render (không qua process_video) nên render song song lỗi thì benchmark dừng với lỗi,
+# thay vì âm thầm quay về pipeline nối tiếp và báo một con số sai.
+# Chạy từ thư mục backend:
+#   python -m benchmarks.bench_parallel_render --clips 8 --clip-seconds 10 --audio-seconds 300
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import make_inputs
+from app.services.media_probe import analyze_audio
+from app.services.parallel_render import render_parallel
+from app.services.video_processing import render_single_pass
+
+RENDERERS = {"serial": render_single_pass, "parallel": render_parallel}
+
+
+def _timed_render(inputs: dict, output_path: str, mode: str, target_duration: float) -> float:
+    started = time.perf_counter()
+    RENDERERS[mode](inputs["audio_path"], inputs["video_paths"], inputs["srt_path"], output_path, target_duration)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serial vs parallel segmented render wall time.")
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--clip-seconds", type=float, default=10.0)
+    parser.add_argument("--audio-seconds", type=float, default=300.0)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần chạy mỗi chế độ (lấy thời gian nhỏ nhất)")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục làm việc")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_parallel_")
+    try:
+        inputs = make_inputs(work_dir, args.clips, args.clip_seconds, args.audio_seconds, args.width, args.height)
+        target_duration = analyze_audio(inputs["audio_path"]).duration
+        results = {}
+        for mode in RENDERERS:
+            timings = [
+                _timed_render(inputs, os.path.join(work_dir, f"out_{mode}_{run}.mp4"), mode, target_duration)
+                for run in range(args.repeat)
+            ]
+            results[mode] = min(timings)
+
+        report = {
+            "clips": args.clips,
+            "clip_seconds": args.clip_seconds,
+            "audio_seconds": args.audio_seconds,
+            "resolution": f"{args.width}x{args.height}",
+            "cpu_count": os.cpu_count(),
+            "renderers": {mode: f"{renderer.__module__}.{renderer.__name__}" for mode, renderer in RENDERERS.items()},
+            "serial_seconds": round(results["serial"], 3),
+            "parallel_seconds": round(results["parallel"], 3),
+            "speedup": round(results["serial"] / results["parallel"], 2) if results["parallel"] else None,
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.keep:
+            print(f"Work directory kept at: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# backend/benchmarks/bench_pipeline.py
+#
+# Benchmark từng bước của pipeline (concatenate_videos, add_audio_to_video, add_subtitles)
+# và toàn bộ process_video trên input tổng hợp (lavfi testsrc2/sine + SRT sinh tự động).
+# Mỗi bước chạy trong một tiến trình con riêng để đo CPU/peak RSS độc lập; kết quả ghi ra JSON.
+# Chạy từ thư mục backend:
+#   python -m benchmarks.bench_pipeline --clips 2,8 --clip-seconds 5,20 --audio-seconds 60 --resolutions 640x360,1280x720
+#   python -m benchmarks.bench_pipeline --baseline benchmarks/results/pipeline_old.json --max-regression 0.2
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import make_inputs
+
+# Thứ tự chạy; mỗi bước dùng output của bước trước làm input
+STAGES = ("concatenate_videos", "add_audio_to_video", "add_subtitles", "process_video", "process_video_multi_step")
+# Chu kỳ lấy mẫu dung lượng thư mục tạm (giây)
+TEMP_SAMPLE_INTERVAL = 0.05
+
+
+class _TempDirMonitor:
+    """
+    Lấy mẫu định kỳ các file trong thư mục tạm (file tạm bị xóa ngay sau mỗi bước nên không đo được lúc kết thúc).
+    bytes_written = tổng kích thước lớn nhất của từng file từng xuất hiện, peak_bytes = tổng lớn nhất tại một thời điểm.
+    """
+
+    def __init__(self, directories: List[str], interval: float = TEMP_SAMPLE_INTERVAL):
+        self.directories = directories
+        self.interval = interval
+        self.max_sizes: Dict[str, int] = {}
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> None:
+        total = 0
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError:
+                        continue # File vừa bị xóa
+                    total += size
+                    if size > self.max_sizes.get(path, -1):
+                        self.max_sizes[path] = size
+        self.peak_bytes = max(self.peak_bytes, total)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "_TempDirMonitor":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(self.max_sizes.values())
+
+
+def _rss_bytes(max_rss: int) -> int:
+    # ru_maxrss tính bằng KB trên Linux, bằng byte trên macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _run_stage(stage: str, inputs: dict, artifacts: dict, stage_dir: str) -> Tuple[dict, Optional[str]]:
+    """Chạy một bước trong tiến trình con hiện tại, trả về (số đo, đường dẫn output để bước sau dùng)."""
+    temp_dir = os.path.join(stage_dir, "temp")
+    cache_dir = os.path.join(stage_dir, "clip_cache")
+    output_dir = os.path.join(stage_dir, "out")
+    for directory in (temp_dir, cache_dir, output_dir):
+        os.makedirs(directory, exist_ok=True)
+    # Clip cache riêng cho mỗi bước để không bước nào hưởng cache của bước trước
+    os.environ["CLIP_CACHE_DIR"] = cache_dir
+
+    from app.services import parallel_render, video_processing
+    from app.services.media_probe import probe_media
+    video_processing.TEMP_DIR = temp_dir
+    parallel_render.TEMP_DIR = temp_dir
+
+    audio_duration = probe_media(inputs["audio_path"]).duration
+    output_path = os.path.join(output_dir, f"{stage}.mp4")
+
+    def run() -> Optional[str]:
+        if stage == "concatenate_videos":
+            return video_processing.concatenate_videos(inputs["video_paths"], audio_duration)
+        if stage == "add_audio_to_video":
+            video_processing.add_audio_to_video(artifacts["concatenate_videos"], inputs["audio_path"], output_path, audio_duration)
+            return output_path
+        if stage == "add_subtitles":
+            video_processing.add_subtitles(artifacts["add_audio_to_video"], inputs["srt_path"], output_path, audio_duration)
+            return output_path
+        single_pass = stage == "process_video"
+        video_processing.process_video(inputs["audio_path"], inputs["video_paths"], inputs["srt_path"], output_path,
+                                       single_pass=single_pass, parallel=False)
+        return None
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    with _TempDirMonitor([temp_dir, cache_dir]) as monitor:
+        artifact = run()
+    wall = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if stage == "concatenate_videos":
+        # Output của concat nằm trong TEMP_DIR -> chuyển ra ngoài (sau khi đã đo) để bước sau dùng
+        shutil.move(artifact, output_path)
+        artifact = output_path
+
+    metrics = {
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(
+            (self_after.ru_utime - self_before.ru_utime) + (self_after.ru_stime - self_before.ru_stime)
+            + (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime), 3),
+        # Tiến trình con mới cho mỗi bước -> ru_maxrss của con cháu chính là đỉnh RSS của ffmpeg trong bước này
+        "peak_rss_bytes": max(_rss_bytes(self_after.ru_maxrss), _rss_bytes(children_after.ru_maxrss)),
+        "python_peak_rss_bytes": _rss_bytes(self_after.ru_maxrss),
+        "ffmpeg_peak_rss_bytes": _rss_bytes(children_after.ru_maxrss),
+        "temp_bytes_written": monitor.bytes_written,
+        "temp_peak_bytes": monitor.peak_bytes,
+    }
+    return metrics, artifact
+
+
+def _stage_process(stage: str, inputs: dict, artifacts: dict, stage_dir: str, results) -> None:
+    try:
+        results.put(("ok", *_run_stage(stage, inputs, artifacts, stage_dir)))
+    except Exception as e:
+        results.put(("error", repr(e), None))
+
+
+def measure_stage(stage: str, inputs: dict, artifacts: dict, stage_dir: str) -> Tuple[dict, Optional[str]]:
+    """Chạy một bước trong tiến trình con mới (spawn) để số đo rusage không lẫn với các bước khác."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_stage_process, args=(stage, inputs, artifacts, stage_dir, results))
+    process.start()
+    while True:
+        try:
+            status, payload, artifact = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Stage {stage} exited without a result (exit code {process.exitcode})")
+    process.join()
+    if status != "ok":
+        raise RuntimeError(f"Stage {stage} failed: {payload}")
+    return payload, artifact
+
+
+def run_scenario(work_dir: str, clips: int, clip_seconds: float, audio_seconds: float, width: int, height: int,
+                 stages: List[str], repeat: int) -> dict:
+    inputs = make_inputs(os.path.join(work_dir, "inputs"), clips, clip_seconds, audio_seconds, width, height)
+    scenario = {
+        "name": f"{clips}x{clip_seconds:g}s_{audio_seconds:g}s_{width}x{height}",
+        "clips": clips,
+        "clip_seconds": clip_seconds,
+        "audio_seconds": audio_seconds,
+        "resolution": f"{width}x{height}",
+        "stages": {},
+    }
+    artifacts: Dict[str, str] = {}
+    for stage in STAGES:
+        if stage not in stages and not _needed_by(stage, stages):
+            continue
+        runs = []
+        for run in range(repeat):
+            stage_dir = os.path.join(work_dir, f"{stage}_{run}")
+            metrics, artifact = measure_stage(stage, inputs, artifacts, stage_dir)
+            runs.append(metrics)
+            if artifact:
+                artifacts[stage] = artifact
+            if stage in ("process_video", "process_video_multi_step"):
+                shutil.rmtree(stage_dir, ignore_errors=True)
+        if stage in stages:
+            # Lấy lần chạy nhanh nhất (ít nhiễu nhất) làm kết quả, giữ wall time của mọi lần để tham khảo
+            best = min(runs, key=lambda metrics: metrics["wall_seconds"])
+            scenario["stages"][stage] = {**best, "wall_seconds_runs": [metrics["wall_seconds"] for metrics in runs]}
+        print(f"  {scenario['name']} {stage}: {min(metrics['wall_seconds'] for metrics in runs):.2f}s", file=sys.stderr)
+    return scenario
+
+
+def _needed_by(stage: str, stages: List[str]) -> bool:
+    """Bước tách lẻ cần output của bước trước (concat -> audio -> subtitles)."""
+    chain = ["concatenate_videos", "add_audio_to_video", "add_subtitles"]
+    if stage not in chain:
+        return False
+    return any(chain.index(stage) < chain.index(wanted) for wanted in stages if wanted in chain)
+
+
+def _environment() -> dict:
+    def command_output(*args: str) -> Optional[str]:
+        try:
+            return subprocess.run(args, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    ffmpeg_version = command_output("ffmpeg", "-version")
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": command_output("git", "rev-parse", "--short", "HEAD"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+    }
+
+
+def compare_with_baseline(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """So wall time từng (kịch bản, bước) với baseline; trả về danh sách các bước chậm hơn quá ngưỡng."""
+    baseline_stages = {
+        (scenario["name"], stage): metrics["wall_seconds"]
+        for scenario in baseline.get("scenarios", [])
+        for stage, metrics in scenario.get("stages", {}).items()
+    }
+    regressions = []
+    for scenario in report["scenarios"]:
+        for stage, metrics in scenario["stages"].items():
+            previous = baseline_stages.get((scenario["name"], stage))
+            if not previous:
+                continue
+            ratio = metrics["wall_seconds"] / previous
+            metrics["baseline_wall_seconds"] = previous
+            metrics["wall_ratio_vs_baseline"] = round(ratio, 3)
+            if ratio > 1 + max_regression:
+                regressions.append(f"{scenario['name']} {stage}: {previous:.2f}s -> {metrics['wall_seconds']:.2f}s (x{ratio:.2f})")
+    return regressions
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def _resolution(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-stage and end-to-end benchmarks of the render pipeline on synthetic media.")
+    parser.add_argument("--clips", type=_csv(int), default=[4], help="Số clip, phân tách bằng dấu phẩy")
+    parser.add_argument("--clip-seconds", type=_csv(float), default=[5.0])
+    parser.add_argument("--audio-seconds", type=_csv(float), default=[60.0])
+    parser.add_argument("--resolutions", type=_csv(_resolution), default=[(1280, 720)])
+    parser.add_argument("--stages", type=_csv(str), default=list(STAGES), help=f"Tập con của: {','.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần chạy mỗi bước (lấy lần nhanh nhất)")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định benchmarks/results/pipeline_<thời gian>.json)")
+    parser.add_argument("--baseline", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Tỉ lệ chậm hơn baseline tối đa cho phép")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại thư mục làm việc")
+    args = parser.parse_args()
+
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    work_root = tempfile.mkdtemp(prefix="bench_pipeline_")
+    report = {"environment": _environment(), "scenarios": []}
+    try:
+        grid = itertools.product(args.clips, args.clip_seconds, args.audio_seconds, args.resolutions)
+        for index, (clips, clip_seconds, audio_seconds, (width, height)) in enumerate(grid):
+            report["scenarios"].append(run_scenario(
+                os.path.join(work_root, f"scenario_{index:03d}"), clips, clip_seconds, audio_seconds, width, height,
+                args.stages, args.repeat,
+            ))
+    finally:
+        if args.keep:
+            print(f"Work directory kept at: {work_root}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), args.max_regression)
+        report["regressions"] = regressions
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to: {output}", file=sys.stderr)
+
+    if regressions:
+        print("Regressions vs baseline:\n  " + "\n  ".join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# backend/benchmarks/synthetic.py
+
+import os
+import subprocess
+from typing import List
+
+from app.services.subtitles import SubtitleCue, write_srt
+
+
+def _ffmpeg(*args: str) -> None:
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *args], check=True)
+
+
+def make_clip(path: str, duration: float, width: int = 1280, height: int = 720, fps: int = 30) -> str:
+    """Tạo clip H.264 từ nguồn lavfi testsrc2 (kèm audio sine để giống clip thật)."""
+    _ffmpeg(
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', path,
+    )
+    return path
+
+
+def make_audio(path: str, duration: float) -> str:
+    """Tạo track audio (sine) dài `duration` giây."""
+    _ffmpeg('-f', 'lavfi', '-i', f'sine=frequency=220:duration={duration}', '-c:a', 'aac', path)
+    return path
+
+
+def make_srt(path: str, duration: float, cue_seconds: float = 2.0, gap_seconds: float = 1.0) -> str:
+    """Tạo file SRT với các cue đều nhau phủ toàn bộ `duration`."""
+    cues = []
+    start = 0.5
+    while start + cue_seconds < duration:
+        cues.append(SubtitleCue(index=len(cues) + 1, start=start, end=start + cue_seconds, text=f"Cue {len(cues) + 1}"))
+        start += cue_seconds + gap_seconds
+    write_srt(cues, path)
+    return path
+
+
+def make_inputs(work_dir: str, clip_count: int, clip_seconds: float, audio_seconds: float,
+                width: int = 1280, height: int = 720) -> dict:
+    """Tạo bộ input đầy đủ (audio, srt, clip) cho một kịch bản benchmark."""
+    os.makedirs(work_dir, exist_ok=True)
+    clips: List[str] = [
+        make_clip(os.path.join(work_dir, f"clip_{idx:03d}.mp4"), clip_seconds, width, height)
+        for idx in range(clip_count)
+    ]
+    return {
+        "audio_path": make_audio(os.path.join(work_dir, "audio.m4a"), audio_seconds),
+        "srt_path": make_srt(os.path.join(work_dir, "subtitles.srt"), audio_seconds),
+        "video_paths": clips,
+    }
@@ -0,0 +1,9 @@
+# backend/tests/conftest.py
+
+import os
+import sys
+
+# Chạy pytest từ bất kỳ đâu: import app.* tính từ thư mục backend
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
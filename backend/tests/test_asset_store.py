@@ -0,0 +1,137 @@
+# backend/tests/test_asset_store.py
+
+import hashlib
+import os
+import time
+
+import pytest
+
+from app.services import metrics
+from app.services.asset_store import AssetNotFound, AssetStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AssetStore(root=str(tmp_path / "assets"), index_path=":memory:", ttl_seconds=0, quota_bytes=0)
+    yield store
+    store.close()
+
+
+def _add(store, content: bytes, filename="clip.mp4"):
+    """Ghi nội dung vào incoming/ như upload thật rồi đưa vào thư viện."""
+    temp_path = store.incoming_path()
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    return store.add(temp_path, sha256, len(content), filename)
+
+
+def _age(store, sha256, seconds):
+    with store._lock, store._conn:
+        store._conn.execute("UPDATE assets SET last_used_at = ? WHERE sha256 = ?", (time.time() - seconds, sha256))
+
+
+def test_add_deduplicates_identical_content(store):
+    first = _add(store, b"same bytes", "a.mp4")
+    second = _add(store, b"same bytes", "b.mp4")
+    assert first["created"] is True and second["created"] is False
+    assert first["asset_id"] == second["asset_id"]
+    assert store.usage()["assets"] == 1
+    with pytest.raises(ValueError):
+        store.add(store.incoming_path(), "not-a-sha", 1)
+
+
+def test_acquire_counts_references_per_job(store):
+    asset_id = _add(store, b"video")["asset_id"]
+    paths = store.acquire("job-1", [asset_id, asset_id])
+    assert paths[asset_id].endswith(f"{asset_id}.mp4")
+    store.acquire("job-2", [asset_id])
+    assert store.get(asset_id)["references"] == 2
+
+    assert store.release_job("job-1") == 1
+    assert store.get(asset_id)["references"] == 1
+    assert store.usage()["referenced"] == 1
+
+
+def _deduplicated_bytes():
+    return metrics.asset_deduplicated_bytes._values.get((), 0.0)
+
+
+def test_dedup_bytes_count_only_assets_reused_by_a_later_job(store):
+    video = _add(store, b"v" * 100)["asset_id"]
+    audio = _add(store, b"a" * 30, "a.mp3")["asset_id"]
+    before = _deduplicated_bytes()
+
+    store.acquire("job-1", [video, video, audio]) # Lần dùng đầu: client vừa upload, không phải dedup
+    assert _deduplicated_bytes() == before
+    store.acquire("job-2", [video])
+    assert _deduplicated_bytes() == before + 100
+    # Upload lại cùng nội dung không được đếm thêm lần nữa; job dùng lại mới được đếm
+    _add(store, b"a" * 30, "a.mp3")
+    store.acquire("job-3", [audio, video])
+    assert _deduplicated_bytes() == before + 100 + 130
+
+
+def test_acquire_with_missing_asset_records_nothing(store):
+    asset_id = _add(store, b"audio", "a.mp3")["asset_id"]
+    missing = "f" * 64
+    with pytest.raises(AssetNotFound) as excinfo:
+        store.acquire("job-1", [asset_id, missing])
+    assert excinfo.value.missing == [missing]
+    assert store.get(asset_id)["references"] == 0
+
+
+def test_sweep_ttl_skips_referenced_assets(store):
+    store.ttl_seconds = 3600
+    kept = _add(store, b"in use")["asset_id"]
+    stale = _add(store, b"stale")["asset_id"]
+    store.acquire("job-1", [kept])
+    _age(store, kept, 7200)
+    _age(store, stale, 7200)
+
+    assert store.sweep() == {"deleted": 1, "freed_bytes": len(b"stale")}
+    assert store.get(stale) is None and store.get(kept) is not None
+
+    store.release_job("job-1")
+    assert store.sweep()["deleted"] == 1
+    assert store.get(kept) is None
+
+
+def test_sweep_quota_evicts_least_recently_used_first(store):
+    store.quota_bytes = 12
+    oldest = _add(store, b"aaaaaa")["asset_id"]
+    middle = _add(store, b"bbbbbb")["asset_id"]
+    newest = _add(store, b"cccccc")["asset_id"]
+    _age(store, oldest, 300)
+    _age(store, middle, 200)
+    _age(store, newest, 100)
+    store.acquire("job-1", [oldest])
+
+    report = store.sweep()
+
+    # 18 byte > 12: asset cũ nhất đang được tham chiếu nên xóa asset kế tiếp
+    assert report == {"deleted": 1, "freed_bytes": 6}
+    assert store.get(middle) is None
+    assert store.get(oldest) is not None and store.get(newest) is not None
+
+
+def test_reconcile_drops_stale_refs_partials_and_missing_blobs(store):
+    asset_id = _add(store, b"video")["asset_id"]
+    gone = _add(store, b"gone", "x.srt")["asset_id"]
+    store.acquire("old-job", [asset_id])
+    open(store.incoming_path(), "wb").close()
+    os.remove(store.blob_path(gone, ".srt"))
+
+    assert store.reconcile() == {"dropped_refs": 1, "missing": 1}
+    assert os.listdir(store.incoming_dir) == []
+    assert store.get(asset_id)["references"] == 0
+    assert store.existing([asset_id, gone]) == {asset_id: len(b"video")}
+
+
+def test_library_is_created_on_first_use_not_on_construction(tmp_path):
+    root, index_path = tmp_path / "assets", tmp_path / "data" / "assets.sqlite3"
+    store = AssetStore(root=str(root), index_path=str(index_path))
+    assert not root.exists() and not index_path.parent.exists()
+    assert store.usage()["assets"] == 0
+    assert (root / "incoming").is_dir() and index_path.exists()
+    store.close()
@@ -0,0 +1,111 @@
+# backend/tests/test_cli.py
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("aiofiles") # clip_cache -> app.utils.file_helper
+pytest.importorskip("ffmpeg") # media_probe
+
+from app.cli import _append_checkpoint, _is_done, _open_checkpoint, load_manifest, read_checkpoint, run_batch
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    for name in ("a.mp3", "b.mp3", "a.srt", "b.srt", "clip1.mp4", "clip2.mp4"):
+        (tmp_path / name).write_bytes(b"data")
+    path = tmp_path / "batch.json"
+    path.write_text(json.dumps({
+        "output_dir": "renders",
+        "defaults": {"subtitle_mode": "soft", "hls": False},
+        "clip_pools": {"city": ["clip1.mp4", "clip2.mp4"]},
+        "jobs": [
+            {"id": "ep1", "audio": "a.mp3", "srt": "a.srt", "clips": "city"},
+            {"audio": "b.mp3", "srt": "b.srt", "clips": ["clip2.mp4"], "subtitle_mode": "burn"},
+        ],
+    }), encoding="utf-8")
+    return str(path)
+
+
+def _complete(job, checkpoint_path):
+    os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    with open(job.output_path, "wb") as output_file:
+        output_file.write(b"video")
+    with _open_checkpoint(checkpoint_path, fresh=False) as checkpoint_file:
+        _append_checkpoint(checkpoint_file, {"job_id": job.job_id, "status": "completed", "fingerprint": job.fingerprint()})
+
+
+def test_load_manifest_resolves_pools_and_options(manifest, tmp_path):
+    ep1, b = load_manifest(manifest)
+    assert ep1.video_paths == (str(tmp_path / "clip1.mp4"), str(tmp_path / "clip2.mp4"))
+    assert ep1.output_path == str(tmp_path / "renders" / "ep1.mp4")
+    assert ep1.options == {"subtitle_mode": "soft", "hls": False}
+    assert b.job_id == "b" and b.options["subtitle_mode"] == "burn"
+
+
+@pytest.mark.parametrize("change, message", [
+    (lambda data: data["jobs"][1].update(id="ep1"), "Duplicate job id"),
+    (lambda data: data["jobs"][0].update(clips="beach"), "unknown clip pool"),
+    (lambda data: data["jobs"][0].update(subtitle_mode="karaoke"), "Unknown subtitle_mode"),
+    (lambda data: data["jobs"][0].update(audio="missing.mp3"), "missing input files"),
+    (lambda data: data.update(jobs=[]), "non-empty 'jobs'"),
+])
+def test_invalid_manifest_raises(manifest, change, message):
+    with open(manifest, encoding="utf-8") as manifest_file:
+        data = json.load(manifest_file)
+    change(data)
+    with open(manifest, "w", encoding="utf-8") as manifest_file:
+        json.dump(data, manifest_file)
+    with pytest.raises(ValueError, match=message):
+        load_manifest(manifest)
+
+
+def test_read_checkpoint_keeps_latest_record_and_skips_torn_line(tmp_path):
+    path = tmp_path / "batch.checkpoint.jsonl"
+    path.write_text(
+        '{"job_id": "a", "status": "failed"}\n'
+        '{"job_id": "a", "status": "completed"}\n'
+        '["not", "a", "record"]\n'
+        '{"job_id": "b", "sta', encoding="utf-8")
+    assert read_checkpoint(str(path)) == {"a": {"job_id": "a", "status": "completed"}}
+    assert read_checkpoint(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_append_after_torn_line_starts_a_new_line(tmp_path):
+    path = tmp_path / "batch.checkpoint.jsonl"
+    path.write_text('{"job_id": "a", "status": "completed"}\n{"job_id": "b"', encoding="utf-8")
+    with _open_checkpoint(str(path), fresh=False) as checkpoint_file:
+        _append_checkpoint(checkpoint_file, {"job_id": "c", "status": "completed"})
+    assert set(read_checkpoint(str(path))) == {"a", "c"}
+
+
+def test_fresh_checkpoint_discards_old_records(tmp_path):
+    path = tmp_path / "batch.checkpoint.jsonl"
+    path.write_text('{"job_id": "a", "status": "completed"}\n', encoding="utf-8")
+    with _open_checkpoint(str(path), fresh=True):
+        pass
+    assert read_checkpoint(str(path)) == {}
+
+
+def test_completed_job_is_done_until_input_or_output_changes(manifest, tmp_path):
+    job = load_manifest(manifest)[0]
+    checkpoint_path = str(tmp_path / "batch.checkpoint.jsonl")
+    _complete(job, checkpoint_path)
+    assert _is_done(job, read_checkpoint(checkpoint_path)["ep1"])
+
+    (tmp_path / "clip2.mp4").write_bytes(b"edited clip") # Input đổi -> fingerprint đổi
+    assert not _is_done(job, read_checkpoint(checkpoint_path)["ep1"])
+
+    _complete(job, checkpoint_path)
+    os.remove(job.output_path) # Output bị xóa -> render lại
+    assert not _is_done(job, read_checkpoint(checkpoint_path)["ep1"])
+    assert not _is_done(job, None)
+
+
+def test_resume_skips_completed_jobs_without_starting_workers(manifest, tmp_path):
+    jobs = load_manifest(manifest)
+    checkpoint_path = str(tmp_path / "batch.checkpoint.jsonl")
+    for job in jobs:
+        _complete(job, checkpoint_path)
+    assert run_batch(jobs, checkpoint_path) == {"jobs": 2, "skipped": 2, "completed": 0, "failed": 0}
@@ -0,0 +1,103 @@
+# backend/tests/test_clip_cache.py
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("aiofiles") # app.utils.file_helper
+
+from app.services.clip_cache import ClipCache
+
+
+def _write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def _put(cache, tmp_path, key, size, age=0.0):
+    entry = cache.put(key, _write(str(tmp_path / f"{key}.src"), size))
+    if age:
+        stamp = time.time() - age
+        os.utime(entry, (stamp, stamp))
+    return entry
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ClipCache(cache_dir=str(tmp_path / "clips"), max_bytes=100, in_use_seconds=0)
+
+
+def test_put_then_get_is_a_hit(cache, tmp_path):
+    entry = _put(cache, tmp_path, "a", 10)
+    assert cache.get("a") == entry
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 1, 1, 10)
+
+
+def test_evicts_least_recently_used_first(cache, tmp_path):
+    _put(cache, tmp_path, "old", 40, age=300)
+    _put(cache, tmp_path, "recent", 40, age=100)
+    _put(cache, tmp_path, "new", 40)
+    assert cache.get("old") is None
+    assert cache.get("recent") and cache.get("new")
+
+
+def test_oversized_entry_is_kept(cache, tmp_path):
+    _put(cache, tmp_path, "small", 10, age=100)
+    entry = _put(cache, tmp_path, "huge", 500)
+    assert os.path.exists(entry)
+    assert cache.get("small") is None # Vẫn evict entry khác để giảm dung lượng
+
+
+def test_entries_in_use_are_not_evicted(tmp_path):
+    cache = ClipCache(cache_dir=str(tmp_path / "clips"), max_bytes=50, in_use_seconds=3600)
+    _put(cache, tmp_path, "a", 40, age=60)
+    _put(cache, tmp_path, "b", 40)
+    assert cache.evict() == 0
+    assert cache.get("a") and cache.get("b")
+
+
+def test_get_or_create_runs_producer_once(cache, tmp_path):
+    source = _write(str(tmp_path / "clip.mp4"), 5)
+    calls = []
+
+    def producer(output_path):
+        calls.append(output_path)
+        _write(output_path, 8)
+
+    first = cache.get_or_create(source, {"vcodec": "libx264"}, producer)
+    second = cache.get_or_create(source, {"vcodec": "libx264"}, producer)
+    assert first == second and len(calls) == 1
+    cache.get_or_create(source, {"vcodec": "libx265"}, producer)
+    assert len(calls) == 2 # Tham số encode khác -> khóa khác
+
+
+def test_failed_producer_leaves_no_temp_file(cache, tmp_path):
+    source = _write(str(tmp_path / "clip.mp4"), 5)
+
+    def producer(output_path):
+        _write(output_path, 8)
+        raise ValueError("encode failed")
+
+    with pytest.raises(ValueError):
+        cache.get_or_create(source, {}, producer)
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_lookup_and_contains_do_not_count(cache, tmp_path):
+    source = _write(str(tmp_path / "clip.mp4"), 5)
+    params = {"vcodec": "libx264"}
+    assert cache.lookup(source, params) is None
+    key = cache.make_key(cache.content_hash(source), params)
+    assert not cache.contains(key)
+
+    entry = cache.put(key, _write(str(tmp_path / "encoded.mp4"), 8))
+    stamp = time.time() - 600
+    os.utime(entry, (stamp, stamp))
+    assert cache.contains(key)
+    assert cache.lookup(source, params) == entry
+    assert os.path.getmtime(entry) > stamp # Đánh dấu vừa dùng để không bị evict
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,68 @@
+# backend/tests/test_clip_compat.py
+
+import pytest
+
+pytest.importorskip("ffmpeg") # media_probe import ffmpeg-python
+
+from app.services.clip_compat import analyze_compatibility, clip_signature
+from app.services.media_probe import ProbeResult
+
+
+def _probe(path="clip.mp4", **video):
+    stream = {
+        "codec_type": "video",
+        "codec_name": "h264",
+        "profile": "High",
+        "width": 1280,
+        "height": 720,
+        "r_frame_rate": "30/1",
+        "time_base": "1/15360",
+        "pix_fmt": "yuv420p",
+        **video,
+    }
+    return ProbeResult(path=path, duration=10.0, size=1000, format_name="mov,mp4", streams=(stream,))
+
+
+def test_signature_reads_first_video_stream():
+    audio = {"codec_type": "audio", "codec_name": "aac"}
+    probe = ProbeResult(path="a.mp4", duration=1.0, size=1, format_name="mp4",
+                        streams=(audio, _probe().streams[0]))
+    signature = clip_signature(probe)
+    assert signature.codec_name == "h264"
+    assert (signature.width, signature.height) == (1280, 720)
+    assert signature.frame_rate == "30/1"
+
+
+def test_signature_without_video_stream_raises():
+    probe = ProbeResult(path="a.m4a", duration=1.0, size=1, format_name="mp4",
+                        streams=({"codec_type": "audio"},))
+    with pytest.raises(ValueError):
+        clip_signature(probe)
+
+
+def test_identical_clips_are_compatible():
+    report = analyze_compatibility([_probe("a.mp4"), _probe("b.mp4")])
+    assert report.all_compatible
+    assert report.target_encoder == "libx264"
+
+
+def test_most_common_signature_is_target():
+    probes = [_probe("a.mp4", width=640, height=360), _probe("b.mp4"), _probe("c.mp4")]
+    report = analyze_compatibility(probes)
+    assert report.target.width == 1280
+    assert report.mismatched == [0]
+
+
+def test_time_base_difference_needs_normalization():
+    report = analyze_compatibility([_probe("a.mp4"), _probe("b.mp4", time_base="1/90000")])
+    assert report.mismatched == [1] # Hòa số lượng -> clip đầu tiên là đích
+
+
+def test_unknown_codec_has_no_normalize_encoder():
+    report = analyze_compatibility([_probe(codec_name="vp9")])
+    assert report.target_encoder is None
+
+
+def test_empty_probe_list_raises():
+    with pytest.raises(ValueError):
+        analyze_compatibility([])
@@ -0,0 +1,67 @@
+# backend/tests/test_ffmpeg_process.py
+
+import sys
+import threading
+import time
+
+import pytest
+
+from app.services import ffmpeg_process
+from app.services.ffmpeg_process import KILL_CANCELLED, ManagedProcess, ProcessTimeout, _parse_stage_timeouts, stage_timeout
+
+# Tiến trình con thay cho ffmpeg: ngủ lâu hơn mọi timeout trong test
+SLEEP_ARGS = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+@pytest.fixture(autouse=True)
+def fast_watchdog(monkeypatch):
+    monkeypatch.setattr(ffmpeg_process, "FFMPEG_WATCHDOG_INTERVAL", 0.05)
+
+
+def test_parse_stage_timeouts():
+    assert _parse_stage_timeouts("hls=600, subtitles = 3600.5") == {"hls": 600.0, "subtitles": 3600.5}
+
+
+def test_parse_stage_timeouts_skips_blank_and_invalid_entries():
+    assert _parse_stage_timeouts("") == {}
+    assert _parse_stage_timeouts(",hls=abc,concat=,=5,audio=30") == {"audio": 30.0}
+
+
+def test_stage_timeout_override_formula_and_disable(monkeypatch):
+    monkeypatch.setattr(ffmpeg_process, "_STAGE_TIMEOUTS", {"hls": 600.0, "preview": 0.0})
+    monkeypatch.setattr(ffmpeg_process, "FFMPEG_TIMEOUT_PER_MEDIA_SECOND", 2.0)
+    assert stage_timeout("hls", expected_duration=1000, base=100.0) == 600.0
+    assert stage_timeout("concat", expected_duration=30, base=100.0) == 160.0
+    assert stage_timeout("probe", base=120.0) == 120.0
+    assert stage_timeout("preview", base=100.0) is None
+    assert stage_timeout("concat", base=0.0) is None
+
+
+def test_managed_process_returns_exit_code_and_stderr():
+    args = [sys.executable, "-c", "import sys; sys.stderr.write('boom'); sys.exit(3)"]
+    with ManagedProcess(args, "concat", timeout=30) as process:
+        assert process.wait() == (3, b"boom")
+    assert process.killed_reason is None
+
+
+def test_watchdog_kills_process_after_stage_timeout():
+    started = time.monotonic()
+    with ManagedProcess(SLEEP_ARGS, "subtitles", timeout=0.3, stall_timeout=0) as process:
+        with pytest.raises(ProcessTimeout, match="subtitles"):
+            process.wait()
+    assert time.monotonic() - started < 10
+    assert process.process.returncode != 0
+
+
+def test_watchdog_kills_stalled_process():
+    with ManagedProcess(SLEEP_ARGS, "concat", timeout=None, stall_timeout=0.3) as process:
+        with pytest.raises(ProcessTimeout, match="no progress"):
+            process.wait()
+
+
+def test_cancel_event_kills_process_without_timeout_error():
+    cancel_event = threading.Event()
+    with ManagedProcess(SLEEP_ARGS, "concat", timeout=None, cancel_event=cancel_event, stall_timeout=0) as process:
+        cancel_event.set()
+        returncode, _ = process.wait()
+    assert returncode != 0 and process.killed_reason == KILL_CANCELLED
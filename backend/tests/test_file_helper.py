@@ -0,0 +1,85 @@
+# backend/tests/test_file_helper.py
+
+import asyncio
+import hashlib
+
+import pytest
+
+pytest.importorskip("aiofiles")
+
+from app.utils.file_helper import compute_file_hash, save_upload_stream
+
+
+class FakeUpload:
+    """Giả lập UploadFile: trả dữ liệu theo từng lần read(n) và ghi lại kích thước yêu cầu."""
+
+    def __init__(self, data: bytes, fail_after: int = None):
+        self.data = data
+        self.offset = 0
+        self.read_sizes = []
+        self.fail_after = fail_after # Số lần read thành công trước khi client "ngắt kết nối"
+
+    async def read(self, size: int = -1) -> bytes:
+        if self.fail_after is not None and len(self.read_sizes) >= self.fail_after:
+            raise ConnectionResetError("client disconnected")
+        self.read_sizes.append(size)
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+
+def test_save_upload_stream_writes_in_chunks_and_hashes_inline(tmp_path):
+    data = bytes(range(256)) * 40  # 10240 byte
+    upload = FakeUpload(data)
+    dest = tmp_path / "clip.mp4"
+
+    size, digest = asyncio.run(save_upload_stream(upload, str(dest), chunk_size=4096))
+
+    assert size == len(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert dest.read_bytes() == data
+    # 3 khối dữ liệu (4096 + 4096 + 2048) và một lần đọc rỗng báo hết file
+    assert upload.read_sizes == [4096] * 4
+
+
+def test_save_upload_stream_empty_upload(tmp_path):
+    dest = tmp_path / "empty.srt"
+    size, digest = asyncio.run(save_upload_stream(FakeUpload(b""), str(dest)))
+    assert (size, digest) == (0, hashlib.sha256(b"").hexdigest())
+    assert dest.read_bytes() == b""
+
+
+def test_compute_file_hash_matches_streamed_hash(tmp_path):
+    data = b"x" * 5000
+    dest = tmp_path / "audio.mp3"
+    _, digest = asyncio.run(save_upload_stream(FakeUpload(data), str(dest), chunk_size=1024))
+    assert compute_file_hash(str(dest), chunk_size=777) == digest
+
+
+def test_save_upload_stream_removes_partial_file_on_error(tmp_path):
+    dest = tmp_path / "clip.mp4"
+    upload = FakeUpload(b"x" * 10000, fail_after=2)
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(save_upload_stream(upload, str(dest), chunk_size=1024))
+    assert not dest.exists()
+
+
+def test_save_upload_stream_removes_partial_file_when_cancelled(tmp_path):
+    dest = tmp_path / "clip.mp4"
+
+    class StalledUpload(FakeUpload):
+        async def read(self, size: int = -1) -> bytes:
+            if self.read_sizes:
+                await asyncio.sleep(3600) # Client ngừng gửi sau khối đầu tiên
+            return await super().read(size)
+
+    async def run():
+        task = asyncio.ensure_future(save_upload_stream(StalledUpload(b"x" * 4096), str(dest), chunk_size=1024))
+        while not dest.exists():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert not dest.exists()
@@ -0,0 +1,212 @@
+# backend/tests/test_job_scheduler.py
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("aiofiles") # scheduler cộng thống kê clip cache của worker
+
+from app.services import job_scheduler
+from app.services.job_scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, JobScheduler
+
+TIMEOUT = 60
+
+
+# --- Job giả chạy trong tiến trình worker (phải ở mức module để pickle được) ---
+def _init_stub_worker(ffmpeg_threads):
+    pass
+
+
+def _stub_job(job_id, params, events, cancel_event):
+    """Gửi tiến độ giả, chờ file 'release' (nếu có), rồi trả về output hoặc raise theo params."""
+    crash_marker = params.get("crash_once")
+    if params.get("crash") or (crash_marker and not os.path.exists(crash_marker)):
+        if crash_marker:
+            open(crash_marker, "w").close()
+        os._exit(1) # Giả lập worker bị OOM kill / segfault
+    for progress in params.get("progress", []):
+        events.put((job_id, "progress", progress))
+    release = params.get("release")
+    deadline = time.monotonic() + TIMEOUT
+    while release and not os.path.exists(release) and time.monotonic() < deadline:
+        if cancel_event.is_set():
+            raise ValueError("Render cancelled")
+        time.sleep(0.02)
+    if params.get("fail"):
+        raise ValueError(params["fail"])
+    return {"output_path": params.get("output"), "preview_path": params.get("preview"), "cache": params.get("cache", {})}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(job_scheduler, "_init_worker", _init_stub_worker)
+    monkeypatch.setattr(job_scheduler, "_run_render_job", _stub_job)
+    scheduler = JobScheduler(max_workers=1, ffmpeg_threads=1)
+    yield scheduler
+    scheduler.shutdown(wait=True)
+
+
+def _wait_finished(scheduler, *job_ids):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        jobs = [scheduler.get(job_id) for job_id in job_ids]
+        if all(job.finished for job in jobs):
+            return jobs
+        time.sleep(0.02)
+    raise AssertionError(f"Jobs did not finish: {[scheduler.get(job_id).to_dict() for job_id in job_ids]}")
+
+
+def _wait_running(scheduler, job_id):
+    deadline = time.monotonic() + TIMEOUT
+    while scheduler.get(job_id).status != "running":
+        assert time.monotonic() < deadline, f"Job {job_id} never started"
+        time.sleep(0.02)
+
+
+def test_job_completes_with_output(scheduler):
+    scheduler.submit("a", {"output": "/outputs/a.mp4"})
+    job, = _wait_finished(scheduler, "a")
+    assert job.status == "completed" and job.output_path == "/outputs/a.mp4"
+    assert job.started_at >= job.submitted_at and job.finished_at >= job.started_at
+
+
+def test_preview_from_result_is_set_before_completion(scheduler):
+    scheduler.submit("a", {"output": "/outputs/a.mp4", "preview": "/outputs/preview_a.mp4"})
+    job, = _wait_finished(scheduler, "a")
+    assert job.status == "completed" and job.preview_path == "/outputs/preview_a.mp4"
+
+
+def test_worker_cache_counters_are_added_to_the_main_process(scheduler, monkeypatch, tmp_path):
+    from app.services import clip_cache, media_probe
+
+    clips = clip_cache.ClipCache(cache_dir=str(tmp_path / "clips"))
+    audio = media_probe.AudioAnalysisCache(cache_dir=str(tmp_path / "audio"))
+    monkeypatch.setattr(clip_cache, "clip_cache", clips)
+    monkeypatch.setattr(media_probe, "audio_analysis_cache", audio)
+    scheduler.submit("a", {"cache": {"hits": 2, "misses": 1, "audio_hits": 1, "audio_misses": 0}})
+    scheduler.submit("b", {"cache": {"hits": 0, "misses": 3, "audio_hits": 0, "audio_misses": 1}})
+    _wait_finished(scheduler, "a", "b")
+    assert (clips.hits, clips.misses) == (2, 4)
+    assert (audio.hits, audio.misses) == (1, 1)
+
+
+def test_failed_job_records_error_and_frees_the_slot(scheduler):
+    scheduler.submit("bad", {"fail": "boom"})
+    scheduler.submit("good", {"output": "/outputs/good.mp4"})
+    bad, good = _wait_finished(scheduler, "bad", "good")
+    assert (bad.status, bad.error) == ("failed", "boom")
+    assert good.status == "completed"
+    assert scheduler.stats()["running"] == 0
+
+
+def test_priority_order_and_queue_position(scheduler, tmp_path):
+    release = str(tmp_path / "release")
+    scheduler.submit("blocker", {"release": release})
+    _wait_running(scheduler, "blocker")
+    scheduler.submit("low", {}, priority=PRIORITY_LOW)
+    scheduler.submit("normal1", {}, priority=PRIORITY_NORMAL)
+    scheduler.submit("high", {}, priority=PRIORITY_HIGH)
+    scheduler.submit("normal2", {}, priority=PRIORITY_NORMAL)
+    order = ["high", "normal1", "normal2", "low"] # Cùng độ ưu tiên -> FIFO
+    assert [scheduler.queue_position(job_id) for job_id in order] == [1, 2, 3, 4]
+    assert scheduler.queue_position("blocker") is None
+    assert scheduler.stats()["queued"] == 4
+
+    open(release, "w").close()
+    jobs = _wait_finished(scheduler, "blocker", *order)
+    started = sorted(jobs[1:], key=lambda job: job.started_at)
+    assert [job.job_id for job in started] == order
+
+
+def test_running_since_tracks_the_oldest_running_job(scheduler, tmp_path):
+    assert scheduler.running_since() is None
+    release = str(tmp_path / "release")
+    scheduler.submit("a", {"release": release})
+    _wait_running(scheduler, "a")
+    assert scheduler.running_since() == scheduler.get("a").started_at
+    open(release, "w").close()
+    _wait_finished(scheduler, "a")
+    assert scheduler.running_since() is None
+
+
+def test_duplicate_job_id_is_rejected(scheduler):
+    scheduler.submit("a", {})
+    with pytest.raises(ValueError):
+        scheduler.submit("a", {})
+
+
+def test_worker_progress_reaches_the_job(scheduler, tmp_path):
+    release = str(tmp_path / "release")
+    scheduler.submit("a", {"release": release, "progress": [{"stage": "concat", "percent": 40.0}]})
+    deadline = time.monotonic() + TIMEOUT
+    while scheduler.get("a").progress.get("percent") != 40.0:
+        assert time.monotonic() < deadline, "Progress never arrived"
+        time.sleep(0.02)
+    assert scheduler.get("a").to_dict()["progress"]["stage"] == "concat"
+
+    open(release, "w").close()
+    job, = _wait_finished(scheduler, "a")
+    assert job.progress["stage"] == "done" and job.progress["percent"] == 100.0
+
+
+def test_cancel_queued_job_leaves_the_queue(scheduler, tmp_path):
+    release = str(tmp_path / "release")
+    scheduler.submit("blocker", {"release": release})
+    _wait_running(scheduler, "blocker")
+    scheduler.submit("first", {})
+    scheduler.submit("second", {})
+
+    assert scheduler.cancel("first") is True
+    assert scheduler.get("first").status == "cancelled"
+    assert scheduler.queue_position("first") is None
+    assert scheduler.queue_position("second") == 1
+
+    open(release, "w").close()
+    blocker, first, second = _wait_finished(scheduler, "blocker", "first", "second")
+    assert (blocker.status, first.status, second.status) == ("completed", "cancelled", "completed")
+    assert first.started_at is None
+
+
+def test_cancel_running_job_stops_the_worker(scheduler, tmp_path):
+    scheduler.submit("a", {"release": str(tmp_path / "never")})
+    _wait_running(scheduler, "a")
+    assert scheduler.cancel("a") is True
+    job, = _wait_finished(scheduler, "a")
+    assert job.status == "cancelled" and job.error is None
+    # Slot được trả lại cho job kế tiếp
+    scheduler.submit("b", {})
+    assert _wait_finished(scheduler, "b")[0].status == "completed"
+
+
+def test_cancel_unknown_or_finished_job(scheduler):
+    assert scheduler.cancel("missing") is False
+    scheduler.submit("a", {})
+    _wait_finished(scheduler, "a")
+    assert scheduler.cancel("a") is False
+
+
+def test_worker_crash_requeues_job_once(scheduler, tmp_path):
+    scheduler.submit("flaky", {"crash_once": str(tmp_path / "crashed"), "output": "/outputs/flaky.mp4"})
+    job, = _wait_finished(scheduler, "flaky")
+    assert job.status == "completed" and job.crash_retries == 1
+
+
+def test_worker_crash_fails_after_retries_and_pool_recovers(scheduler):
+    scheduler.submit("crash", {"crash": True})
+    scheduler.submit("after", {"output": "/outputs/after.mp4"})
+    crash, after = _wait_finished(scheduler, "crash", "after")
+    assert crash.status == "failed" and "died unexpectedly" in crash.error
+    assert crash.crash_retries == job_scheduler.RENDER_CRASH_RETRIES
+    assert after.status == "completed"
+    # Pool mới vẫn nhận job sau khi worker chết
+    scheduler.submit("later", {})
+    assert _wait_finished(scheduler, "later")[0].status == "completed"
+    assert scheduler.stats()["running"] == 0
+
+
+def test_worker_crash_without_retries_fails_immediately(scheduler, monkeypatch):
+    monkeypatch.setattr(job_scheduler, "RENDER_CRASH_RETRIES", 0)
+    scheduler.submit("crash", {"crash": True})
+    crash, = _wait_finished(scheduler, "crash")
+    assert crash.status == "failed" and crash.crash_retries == 0
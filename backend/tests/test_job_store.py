@@ -0,0 +1,123 @@
+# backend/tests/test_job_store.py
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.job_store import JobStore, decode_cursor, encode_cursor
+
+
+def _job(job_id, submitted_at, status="completed", **params):
+    return SimpleNamespace(
+        job_id=job_id, status=status, priority=1, submitted_at=submitted_at, started_at=None,
+        finished_at=None, output_path=None, error=None,
+        params={"output_final_path": f"/outputs/output_{job_id}.mp4", **params},
+    )
+
+
+@pytest.fixture
+def store():
+    store = JobStore(":memory:")
+    yield store
+    store.close()
+
+
+def _all_pages(store, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        items, cursor = store.list_jobs(limit=limit, cursor=cursor, **filters)
+        pages.append([item["job_id"] for item in items])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(12.5, "job-1")) == (12.5, "job-1")
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor(1.0, "x")[:-4], "WzFd"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_are_newest_first_and_break_ties_by_job_id(store):
+    for job_id, submitted_at in [("a", 1.0), ("b", 2.0), ("c", 2.0), ("d", 3.0), ("e", 4.0)]:
+        store.save(_job(job_id, submitted_at))
+    assert _all_pages(store, limit=2) == [["e", "d"], ["c", "b"], ["a"]]
+
+
+def test_no_cursor_when_last_page_is_exactly_full(store):
+    for idx in range(4):
+        store.save(_job(f"job{idx}", float(idx)))
+    items, cursor = store.list_jobs(limit=2)
+    items, cursor = store.list_jobs(limit=2, cursor=cursor)
+    assert [item["job_id"] for item in items] == ["job1", "job0"]
+    assert cursor is None
+
+
+def test_cursor_past_the_last_item_returns_empty_page(store):
+    store.save(_job("only", 5.0))
+    items, cursor = store.list_jobs(cursor=encode_cursor(5.0, "only"))
+    assert (items, cursor) == ([], None)
+
+
+def test_empty_store(store):
+    assert store.list_jobs() == ([], None)
+
+
+def test_filters_combine_with_cursor(store):
+    for idx in range(6):
+        store.save(_job(f"job{idx}", float(idx), status="failed" if idx % 2 else "completed"))
+    assert _all_pages(store, limit=1, status="failed", since=2.0) == [["job5"], ["job3"]]
+    with pytest.raises(ValueError):
+        store.list_jobs(status="unknown")
+
+
+def test_status_never_moves_backwards(store):
+    store.save(_job("a", 1.0, status="completed"))
+    store.save(_job("a", 1.0, status="running"), input_bytes=42)
+    row = store.get("a")
+    assert row["status"] == "completed"
+    assert row["input_bytes"] == 42 # Bản ghi muộn vẫn bổ sung thông tin còn thiếu
+
+
+def test_deleted_outputs_are_hidden_unless_requested(store):
+    store.save(_job("a", 1.0))
+    store.save(_job("b", 2.0))
+    store.mark_output_deleted("/elsewhere/output_a.mp4")
+    assert [item["job_id"] for item in store.list_jobs()[0]] == ["b"]
+    assert [item["job_id"] for item in store.list_jobs(include_deleted=True)[0]] == ["b", "a"]
+
+
+def test_input_hash_filter(store):
+    store.save(_job("a", 1.0, content_hashes={"/x": "h1", "/y": "h2"}))
+    store.save(_job("b", 2.0, content_hashes={"/z": "h2"}))
+    assert store.input_hashes("a") == ["h1", "h2"]
+    assert [item["job_id"] for item in store.list_jobs(input_hash="h1")[0]] == ["a"]
+    assert [item["job_id"] for item in store.list_jobs(input_hash="h2")[0]] == ["b", "a"]
+
+
+def test_reconcile_fails_interrupted_jobs_and_imports_outputs(store, tmp_path):
+    store.save(_job("running", 1.0, status="running"))
+    store.save(_job("gone", 2.0))
+    (tmp_path / "output_new.mp4").write_bytes(b"123")
+    (tmp_path / ".partial_x.mp4").write_bytes(b"1")
+    report = store.reconcile(str(tmp_path))
+    assert report == {"interrupted": 1, "imported": 1, "missing": 1}
+    assert store.get("running")["status"] == "failed"
+    assert store.get("gone")["output_deleted"] is True
+    assert store.get("new")["output_bytes"] == 3
+
+
+def test_database_is_created_on_first_use_not_on_construction(tmp_path):
+    path = tmp_path / "data" / "jobs.sqlite3"
+    store = JobStore(str(path))
+    assert not path.parent.exists()
+    store.save(_job("a", 1.0))
+    assert path.exists() and store.get("a")["status"] == "completed"
+    store.close()
+    # Mở lại sau close: dữ liệu vẫn còn trên đĩa
+    reopened = JobStore(str(path))
+    assert reopened.get("a")["job_id"] == "a"
+    reopened.close()
@@ -0,0 +1,79 @@
+# backend/tests/test_media_probe.py
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("ffmpeg")
+
+from app.services.media_probe import AudioAnalysisCache, AudioInfo
+
+INFO = AudioInfo(duration=12.5, codec="aac", sample_rate=44100, channels=2, bit_rate=128000)
+
+
+def _hash(idx: int) -> str:
+    return f"{idx:064x}"
+
+
+def _age(cache, content_hash, seconds):
+    mtime = time.time() - seconds
+    os.utime(cache._path(content_hash), (mtime, mtime))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AudioAnalysisCache(cache_dir=str(tmp_path / "audio"), max_entries=3)
+
+
+def test_hits_and_misses_are_counted_and_shared_through_disk(cache):
+    assert cache.get(_hash(1)) is None
+    cache.put(_hash(1), INFO)
+    assert cache.get(_hash(1)) == INFO
+    # Tiến trình khác (cache mới cùng thư mục) đọc được bản ghi trên đĩa
+    other = AudioAnalysisCache(cache_dir=cache.cache_dir, max_entries=3)
+    assert other.get(_hash(1)) == INFO
+    assert (cache.hits, cache.misses, other.hits, other.misses) == (1, 1, 1, 0)
+
+
+def test_contains_does_not_count(cache):
+    cache.put(_hash(1), INFO)
+    assert cache.contains(_hash(1)) and not cache.contains(_hash(2))
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_disk_entries_are_bounded_least_recently_used_first(cache):
+    for idx in range(3):
+        cache.put(_hash(idx), INFO)
+    _age(cache, _hash(0), 300)
+    _age(cache, _hash(1), 200)
+    _age(cache, _hash(2), 100)
+    cache.get(_hash(0)) # Vừa dùng -> không bị evict
+
+    cache.put(_hash(3), INFO)
+
+    assert sorted(name[:-len(".json")] for name in os.listdir(cache.cache_dir)) == [_hash(0), _hash(2), _hash(3)]
+    assert not cache.contains(_hash(1))
+
+
+def test_memory_entries_are_bounded(tmp_path):
+    cache = AudioAnalysisCache(cache_dir=str(tmp_path / "audio"), max_entries=2)
+    for idx in range(4):
+        cache.put(_hash(idx), INFO)
+    assert len(cache._entries) == 2
+
+
+def test_stats_and_record(cache):
+    cache.put(_hash(1), INFO)
+    cache.get(_hash(1))
+    cache.record(hits=2, misses=3) # Bộ đếm gửi về từ worker render
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["max_entries"]) == (3, 3, 1, 3)
+    assert stats["bytes"] == os.path.getsize(cache._path(_hash(1)))
+
+
+def test_unlimited_cache_never_evicts(tmp_path):
+    cache = AudioAnalysisCache(cache_dir=str(tmp_path / "audio"), max_entries=0)
+    for idx in range(5):
+        cache.put(_hash(idx), INFO)
+    assert cache.stats()["entries"] == 5
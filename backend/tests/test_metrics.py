@@ -0,0 +1,86 @@
+# backend/tests/test_metrics.py
+
+import pytest
+
+from app.services.metrics import MetricsRegistry, directory_usage
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_counter_renders_sorted_labelled_series(registry):
+    counter = registry.counter("jobs_total", "Jobs.", ("status",))
+    counter.inc(status="failed")
+    counter.inc(2, status="completed")
+    counter.inc(0.5, status="completed")
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs.",
+        "# TYPE jobs_total counter",
+        'jobs_total{status="completed"} 2.5',
+        'jobs_total{status="failed"} 1',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    counter = registry.counter("files_total", "Files.", ("name",))
+    counter.inc(name='a "quoted"\\path\nnext')
+    assert 'files_total{name="a \\"quoted\\"\\\\path\\nnext"} 1' in registry.render()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(1, 0.5))
+    for value in (0.2, 0.5, 0.7, 3):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{le="0.5"} 2', # Giá trị bằng cận trên nằm trong bucket đó
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 4.4",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_metric_without_samples_renders_header_only(registry):
+    registry.counter("idle_total", "Never incremented.")
+    assert registry.render() == "# HELP idle_total Never incremented.\n# TYPE idle_total counter\n"
+
+
+def test_gauge_reads_function_and_survives_errors(registry):
+    gauge = registry.gauge("dir_bytes", "Bytes.", ("directory",))
+    assert registry.render() == "\n" # Chưa đặt hàm -> không xuất gì
+    gauge.set_function(lambda: {("temp",): 10, ("outputs",): 2.5})
+    assert registry.render().splitlines()[2:] == ['dir_bytes{directory="outputs"} 2.5', 'dir_bytes{directory="temp"} 10']
+    gauge.set_function(lambda: 1 / 0)
+    assert registry.render() == "\n"
+
+
+def test_duplicate_registration_raises(registry):
+    registry.counter("dup_total", "First.")
+    with pytest.raises(ValueError):
+        registry.counter("dup_total", "Second.")
+
+
+def test_forwarder_receives_records_instead_of_local_registry(registry):
+    counter = registry.counter("forwarded_total", "Forwarded.", ("kind",))
+    forwarded = []
+    registry.set_forwarder(forwarded.append)
+    counter.inc(3, kind="upload")
+    registry.set_forwarder(None)
+    assert forwarded == [("inc", "forwarded_total", {"kind": "upload"}, 3)]
+    assert "forwarded_total{" not in registry.render()
+    registry.apply(forwarded[0]) # Tiến trình chính cộng record nhận được
+    registry.apply(("inc", "unknown_total", {}, 1))
+    assert 'forwarded_total{kind="upload"} 3' in registry.render()
+
+
+def test_directory_usage(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "nested").mkdir()
+    (tmp_path / "a" / "x.bin").write_bytes(b"12345")
+    (tmp_path / "a" / "nested" / "y.bin").write_bytes(b"123")
+    sizes, counts = directory_usage({"a": str(tmp_path / "a"), "missing": str(tmp_path / "missing")})
+    assert sizes == {("a",): 8, ("missing",): 0}
+    assert counts == {("a",): 2, ("missing",): 0}
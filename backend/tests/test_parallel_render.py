@@ -0,0 +1,68 @@
+# backend/tests/test_parallel_render.py
+
+import pytest
+
+pytest.importorskip("ffmpeg") # parallel_render dùng lại video_processing
+
+from app.services.parallel_render import plan_segments
+from app.services.subtitles import SubtitleCue
+from app.services.timeline import plan_timeline
+
+FPS = 25.0
+
+
+def _timeline(durations, target):
+    paths = [f"clip{idx}.mp4" for idx in range(len(durations))]
+    return list(plan_timeline(paths, dict(zip(paths, durations)), target).pieces)
+
+
+def _assert_contiguous(segments, target):
+    assert segments[0].start == 0.0
+    assert segments[-1].end == target
+    for previous, current in zip(segments, segments[1:]):
+        assert previous.end == current.start
+    for segment in segments:
+        assert sum(piece.duration for piece in segment.pieces) == pytest.approx(segment.duration)
+
+
+def test_segments_cover_target_without_gaps():
+    target = 100.0
+    segments = plan_segments(_timeline([12.0, 7.0], target), target, [], FPS, segment_seconds=20)
+    _assert_contiguous(segments, target)
+    assert all(segment.duration < 2 * 20 + 1e-6 for segment in segments)
+
+
+def test_cut_avoids_the_middle_of_a_cue():
+    target = 60.0
+    cue = SubtitleCue(1, 19.0, 23.0, "spans the natural cut")
+    segments = plan_segments(_timeline([60.0], target), target, [cue], FPS, segment_seconds=20)
+    _assert_contiguous(segments, target)
+    assert all(not (cue.start < segment.end < cue.end) for segment in segments)
+
+
+def test_cue_covering_everything_falls_back_to_time_grid():
+    target = 100.0
+    cue = SubtitleCue(1, 0.0, 100.0, "always on screen")
+    segments = plan_segments(_timeline([100.0], target), target, [cue], FPS, segment_seconds=20)
+    _assert_contiguous(segments, target)
+    assert len(segments) > 1 and max(segment.duration for segment in segments) <= 40 + 1e-6
+
+
+def test_short_tail_is_merged_into_previous_segment():
+    target = 42.0
+    segments = plan_segments(_timeline([42.0], target), target, [], FPS, segment_seconds=20)
+    _assert_contiguous(segments, target)
+    assert segments[-1].duration >= 20 / 4
+
+
+def test_target_shorter_than_one_segment():
+    segments = plan_segments(_timeline([5.0], 3.0), 3.0, [], FPS, segment_seconds=20)
+    assert [(segment.start, segment.end) for segment in segments] == [(0.0, 3.0)]
+    assert segments[0].pieces[0].outpoint == pytest.approx(3.0)
+
+
+def test_cut_points_are_on_the_frame_grid():
+    target = 50.0
+    segments = plan_segments(_timeline([3.33, 4.71], target), target, [], FPS, segment_seconds=10)
+    for segment in segments[1:]:
+        assert segment.start * FPS == pytest.approx(round(segment.start * FPS))
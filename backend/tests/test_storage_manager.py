@@ -0,0 +1,161 @@
+# backend/tests/test_storage_manager.py
+
+import os
+import time
+
+import pytest
+
+from app.services.storage_manager import StorageArea, StorageManager
+
+NOW = time.time()
+
+
+def _make(path, size, age_seconds):
+    """Tạo file `size` byte với mtime cách đây age_seconds."""
+    path.write_bytes(b"x" * size)
+    mtime = NOW - age_seconds
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _session(path, sizes, age_seconds):
+    """Tạo một thư mục session (đơn vị xóa) chứa các file con."""
+    path.mkdir()
+    for idx, size in enumerate(sizes):
+        _make(path / f"part{idx}", size, age_seconds)
+    mtime = NOW - age_seconds
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return tmp_path / "outputs", tmp_path / "uploads"
+
+
+def _manager(dirs, ttl=0, quota=0, min_free_bytes=0):
+    outputs, uploads = dirs
+    return StorageManager([
+        StorageArea("outputs", str(outputs), ttl, quota, pressure_order=1),
+        StorageArea("uploads", str(uploads), ttl, quota),
+    ], min_free_bytes=min_free_bytes)
+
+
+def test_ttl_expiry_removes_only_stale_entries(dirs):
+    manager = _manager(dirs, ttl=3600)
+    outputs, uploads = dirs
+    old = _make(outputs / "old.mp4", 10, 7200)
+    fresh = _make(outputs / "fresh.mp4", 10, 60)
+    stale_session = _session(uploads / "session-old", [5, 5], 7200)
+
+    report = manager.sweep()
+
+    assert not old.exists() and not stale_session.exists() and fresh.exists()
+    assert report == {"outputs": {"deleted": 1, "freed_bytes": 10}, "uploads": {"deleted": 1, "freed_bytes": 10}}
+
+
+def test_quota_evicts_oldest_first_and_skips_partial_outputs(dirs):
+    manager = _manager(dirs, quota=25)
+    outputs, _ = dirs
+    oldest = _make(outputs / "a.mp4", 10, 400)
+    partial = _make(outputs / ".partial_b.mp4", 10, 300)
+    middle = _make(outputs / "c.mp4", 10, 200)
+    newest = _make(outputs / "d.mp4", 10, 100)
+
+    manager.sweep()
+
+    # 40 byte > 25: xóa a rồi c (cũ nhất); file render dở không bị xóa vì quota
+    assert not oldest.exists() and not middle.exists()
+    assert partial.exists() and newest.exists()
+
+
+def test_protected_entries_survive_ttl_and_count_towards_quota(dirs):
+    manager = _manager(dirs, ttl=3600, quota=15)
+    _, uploads = dirs
+    running = _session(uploads / "running-job", [10], 7200)
+    other = _make(uploads / "other.bin", 10, 60)
+    manager.protect(str(running))
+
+    manager.sweep()
+
+    # Quá TTL nhưng đang được job dùng -> giữ; 10 byte được bảo vệ + 10 > 15 -> xóa mục còn lại
+    assert running.exists() and not other.exists()
+
+    manager.release(str(running))
+    assert not running.exists()
+
+
+def test_release_without_delete_only_unprotects(dirs):
+    manager = _manager(dirs, ttl=3600)
+    _, uploads = dirs
+    session = _session(uploads / "s", [1], 7200)
+    manager.protect(str(session))
+    manager.release(str(session), delete=False)
+    assert session.exists()
+    manager.sweep()
+    assert not session.exists()
+
+
+def test_disk_pressure_evicts_only_areas_with_pressure_order(dirs):
+    # Ngưỡng dung lượng trống không thể đạt -> xóa mọi output có thể xóa, không động tới uploads
+    manager = _manager(dirs, min_free_bytes=1 << 62)
+    outputs, uploads = dirs
+    first = _make(outputs / "a.mp4", 10, 200)
+    second = _make(outputs / "b.mp4", 10, 100)
+    upload = _make(uploads / "u.bin", 10, 300)
+
+    report = manager.sweep()
+
+    assert not first.exists() and not second.exists() and upload.exists()
+    assert report["outputs"]["deleted"] == 2
+    assert manager.has_free_space() is False
+    assert manager.usage()["accepting_jobs"] is False
+
+
+def test_running_jobs_files_are_not_swept(tmp_path):
+    outputs, temp = tmp_path / "outputs", tmp_path / "temp"
+    manager = StorageManager([
+        StorageArea("outputs", str(outputs), 3600, 0, pressure_order=1),
+        StorageArea("temp", str(temp), 3600, 0, scratch=True),
+    ], min_free_bytes=0)
+    # Job đang chạy lâu nhất bắt đầu cách đây 2 giờ: file của nó đã quá TTL 1 giờ
+    manager.set_running_since(lambda: NOW - 7200)
+    scratch = _session(temp / "selective_job", [10], 5400)
+    leftover = _make(temp / "crashed_job.mp4", 10, 9000)
+    partial = _make(outputs / ".partial_output_job.mp4", 10, 5400)
+    finished = _make(outputs / "output_old.mp4", 10, 5400)
+
+    manager.sweep()
+
+    assert scratch.exists() and partial.exists()
+    # Ghi trước khi job chạy lâu nhất bắt đầu, hoặc là output đã xong -> vẫn bị xóa theo TTL
+    assert not leftover.exists() and not finished.exists()
+
+    manager.set_running_since(lambda: None) # Không còn job nào chạy
+    manager.sweep()
+    assert not scratch.exists() and not partial.exists()
+
+
+def test_running_jobs_files_count_towards_quota(tmp_path):
+    temp = tmp_path / "temp"
+    manager = StorageManager([StorageArea("temp", str(temp), 0, 15, scratch=True)], min_free_bytes=0)
+    manager.set_running_since(lambda: NOW - 300)
+    old = _make(temp / "old.bin", 10, 600)
+    running = _make(temp / "running.bin", 10, 60)
+
+    manager.sweep()
+
+    assert running.exists() and not old.exists()
+
+
+def test_running_since_errors_do_not_block_the_sweep(tmp_path):
+    temp = tmp_path / "temp"
+    manager = StorageManager([StorageArea("temp", str(temp), 3600, 0, scratch=True)], min_free_bytes=0)
+
+    def broken():
+        raise RuntimeError("scheduler stopped")
+
+    manager.set_running_since(broken)
+    stale = _make(temp / "stale.bin", 1, 7200)
+    manager.sweep()
+    assert not stale.exists()
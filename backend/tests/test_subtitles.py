@@ -0,0 +1,64 @@
+# backend/tests/test_subtitles.py
+
+import pytest
+
+from app.services.subtitles import SubtitleCue, cue_windows, format_srt_timestamp, parse_srt, write_srt
+
+
+def _srt(tmp_path, content):
+    path = tmp_path / "subs.srt"
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_parse_srt_sorts_cues_and_skips_invalid_blocks(tmp_path):
+    path = _srt(tmp_path, (
+        "1\n00:00:05,000 --> 00:00:06,500\nSecond\n\n"
+        "2\n00:00:01.000 --> 00:00:02,5\nFirst\nline two\n\n"
+        "3\nnot a timing line\n\n"
+        "4\n00:00:09,000 --> 00:00:08,000\nBackwards\n"
+    ))
+    cues = parse_srt(path)
+    assert [cue.text for cue in cues] == ["First\nline two", "Second"]
+    assert cues[0].start == 1.0 and cues[0].end == pytest.approx(2.5)
+
+
+def test_parse_srt_handles_bom_and_crlf(tmp_path):
+    path = tmp_path / "subs.srt"
+    path.write_bytes("\ufeff1\r\n00:00:00,000 --> 00:00:01,000\r\nXin chào\r\n".encode("utf-8"))
+    assert [cue.text for cue in parse_srt(str(path))] == ["Xin chào"]
+
+
+def test_parse_empty_file(tmp_path):
+    assert parse_srt(_srt(tmp_path, "")) == []
+
+
+def test_write_srt_round_trip(tmp_path):
+    cues = [SubtitleCue(1, 0.0, 1.25, "a"), SubtitleCue(2, 3661.5, 3662.0, "b")]
+    path = str(tmp_path / "out.srt")
+    write_srt(cues, path)
+    assert [(cue.start, cue.end, cue.text) for cue in parse_srt(path)] == [(0.0, 1.25, "a"), (3661.5, 3662.0, "b")]
+
+
+def test_format_timestamp_clamps_negative():
+    assert format_srt_timestamp(-1) == "00:00:00,000"
+    assert format_srt_timestamp(3723.0456) == "01:02:03,046"
+
+
+@pytest.mark.parametrize("merge_gap, expected", [
+    (0.0, [(0.0, 2.0), (2.5, 3.0), (5.0, 6.0)]),
+    (0.5, [(0.0, 3.0), (5.0, 6.0)]),
+    (10.0, [(0.0, 6.0)]),
+])
+def test_cue_windows_merge_overlaps_and_gaps(merge_gap, expected):
+    cues = [
+        SubtitleCue(3, 5.0, 6.0, "c"),
+        SubtitleCue(1, 0.0, 1.5, "a"),
+        SubtitleCue(2, 1.0, 2.0, "overlap"),
+        SubtitleCue(4, 2.5, 3.0, "d"),
+    ]
+    assert cue_windows(cues, merge_gap=merge_gap) == expected
+
+
+def test_cue_windows_empty():
+    assert cue_windows([]) == []
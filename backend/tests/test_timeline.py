@@ -0,0 +1,87 @@
+# backend/tests/test_timeline.py
+
+import pytest
+
+from app.services.timeline import Timeline, TimelinePiece, plan_timeline
+
+
+def _plan(durations, target, keyframes=None):
+    paths = [f"clip{idx}.mp4" for idx in range(len(durations))]
+    return plan_timeline(paths, dict(zip(paths, durations)), target, keyframes)
+
+
+def test_exact_fit_uses_whole_clips_without_outpoint():
+    timeline = _plan([4.0, 6.0], 10.0)
+    assert [(piece.path, piece.outpoint) for piece in timeline.pieces] == [("clip0.mp4", 4.0), ("clip1.mp4", 6.0)]
+    assert not any(piece.trims_end for piece in timeline.pieces)
+    assert timeline.duration == 10.0 and timeline.overshoot == 0.0
+
+
+def test_exact_fit_within_epsilon_adds_no_sliver_piece():
+    timeline = _plan([4.0, 6.0], 10.0005)
+    assert len(timeline.pieces) == 2
+
+
+def test_loops_and_trims_last_clip():
+    timeline = _plan([4.0, 6.0], 23.0)
+    assert [piece.path for piece in timeline.pieces] == ["clip0.mp4", "clip1.mp4", "clip0.mp4", "clip1.mp4", "clip0.mp4"]
+    last = timeline.pieces[-1]
+    assert (last.start, last.outpoint) == (20.0, 3.0)
+    assert last.trims_end and not last.trims_start
+    assert last.input_args() == {"t": 3.0}
+    assert timeline.duration == 23.0
+
+
+def test_target_shorter_than_first_clip():
+    timeline = _plan([10.0, 5.0], 2.5)
+    assert [(piece.path, piece.outpoint) for piece in timeline.pieces] == [("clip0.mp4", 2.5)]
+
+
+def test_zero_target_gives_empty_timeline():
+    timeline = _plan([3.0], 0.0)
+    assert timeline.pieces == ()
+    assert timeline.duration == 0.0 and timeline.overshoot == 0.0
+    assert timeline.concat_lines() == []
+
+
+@pytest.mark.parametrize("durations", [[], [0.0, 0.0]])
+def test_no_usable_clip_duration_raises(durations):
+    with pytest.raises(ValueError):
+        _plan(durations, 10.0)
+
+
+def test_keyframe_snap_extends_outpoint_to_next_keyframe():
+    timeline = _plan([10.0], 7.0, keyframes=lambda path: [0.0, 4.0, 8.0])
+    assert timeline.pieces[-1].outpoint == 8.0
+    assert timeline.overshoot == pytest.approx(1.0)
+
+
+def test_keyframe_snap_without_later_keyframe_uses_whole_clip():
+    timeline = _plan([10.0], 9.0, keyframes=lambda path: [0.0, 4.0])
+    assert timeline.pieces[-1].outpoint == 10.0
+    assert not timeline.pieces[-1].trims_end
+
+
+def test_keyframe_lookup_failure_keeps_exact_outpoint():
+    def failing(path):
+        raise ValueError("ffprobe failed")
+
+    timeline = _plan([10.0], 7.0, keyframes=failing)
+    assert timeline.pieces[-1].outpoint == 7.0
+
+
+def test_concat_lines_and_path_mapping():
+    timeline = Timeline(pieces=(
+        TimelinePiece(path="C:\\clips\\a.mp4", inpoint=0.0, outpoint=5.0, start=0.0, source_duration=5.0),
+        TimelinePiece(path="b.mp4", inpoint=1.5, outpoint=3.0, start=5.0, source_duration=6.0),
+    ), target_duration=6.5)
+    assert timeline.concat_lines() == [
+        "file 'C:/clips/a.mp4'",
+        "file 'b.mp4'",
+        "inpoint 1.500000",
+        "outpoint 3.000000",
+    ]
+    mapped = timeline.with_paths({"b.mp4": "cache/b_normalized.mp4"})
+    assert [piece.path for piece in mapped.pieces] == ["C:\\clips\\a.mp4", "cache/b_normalized.mp4"]
+    assert mapped.pieces[1].inpoint == 1.5
+    assert timeline.with_paths({}) is timeline
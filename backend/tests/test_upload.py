@@ -0,0 +1,83 @@
+# backend/tests/test_upload.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiofiles")
+pytest.importorskip("ffmpeg")
+
+from app.api import upload
+
+
+class FakeUpload:
+    """Giả lập UploadFile: gửi dữ liệu theo khối, có thể chờ `gate` hoặc lỗi ở khối thứ hai."""
+
+    def __init__(self, data: bytes, gate: asyncio.Event = None, error: Exception = None):
+        self.filename = "clip.mp4"
+        self.data = data
+        self.gate = gate
+        self.error = error
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        if self.reads > 1:
+            if self.error is not None:
+                raise self.error
+            if self.gate is not None:
+                await self.gate.wait()
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+@pytest.fixture(autouse=True)
+def one_write_per_request(monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_WRITE_CONCURRENCY", 1)
+    monkeypatch.setattr(upload, "UPLOAD_CHUNK_SIZE", 4)
+
+
+def test_write_limit_is_per_request(tmp_path):
+    async def run():
+        gate = asyncio.Event()
+        # Request A giữ slot ghi duy nhất của nó cho tới khi client gửi tiếp
+        slow = asyncio.ensure_future(upload._save_uploads([(FakeUpload(b"a" * 8, gate=gate), str(tmp_path / "a"))]))
+        await asyncio.sleep(0.05)
+        # Request B không phải chờ request A
+        results = await asyncio.wait_for(
+            upload._save_uploads([(FakeUpload(b"b" * 6), str(tmp_path / "b1")),
+                                  (FakeUpload(b"c" * 3), str(tmp_path / "b2"))]), timeout=5)
+        assert [size for size, _ in results] == [6, 3]
+        assert not slow.done()
+        gate.set()
+        assert (await slow)[0][0] == 8
+
+    asyncio.run(run())
+
+
+def test_failed_upload_cancels_the_rest_of_the_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_WRITE_CONCURRENCY", 2)
+
+    async def run():
+        stalled = FakeUpload(b"s" * 8, gate=asyncio.Event()) # Không bao giờ được mở
+        broken = FakeUpload(b"x" * 8, error=ConnectionResetError("client disconnected"))
+        with pytest.raises(ConnectionResetError):
+            await upload._save_uploads([(stalled, str(tmp_path / "stalled")), (broken, str(tmp_path / "broken"))])
+
+    asyncio.run(run())
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_stats_include_audio_analysis_cache(tmp_path, monkeypatch):
+    from app.services.clip_cache import ClipCache
+    from app.services.media_probe import AudioAnalysisCache
+
+    monkeypatch.setattr(upload, "clip_cache", ClipCache(cache_dir=str(tmp_path / "clips")))
+    monkeypatch.setattr(upload, "audio_analysis_cache", AudioAnalysisCache(cache_dir=str(tmp_path / "audio")))
+    upload.audio_analysis_cache.record(hits=4, misses=1)
+
+    stats = upload._cache_stats()
+
+    assert stats["entries"] == 0 and "max_bytes" in stats
+    assert stats["audio_analysis"]["hits"] == 4 and stats["audio_analysis"]["misses"] == 1
@@ -0,0 +1,191 @@
+# backend/tests/test_video_processing.py
+
+import pytest
+
+ffmpeg = pytest.importorskip("ffmpeg")
+
+from app.services import video_processing
+from app.services.clip_cache import ClipCache
+from app.services.media_probe import AudioInfo, ProbeResult
+from app.services.subtitles import SubtitleCue, cue_windows
+from app.services.video_processing import (
+    RenderCancelled, RenderTimeout, _plan_selective_ranges, _prepare_copy_concat, _ProgressReporter,
+)
+
+
+def _reporter(stages, media_duration=10.0):
+    events = []
+    return _ProgressReporter(events.append, stages, media_duration), events
+
+
+def test_progress_reporter_weights_stages_equally():
+    reporter, events = _reporter(["concat", "audio", "subtitles", "finalize"])
+    reporter.begin("audio")
+    reporter.emit("audio", 0.5)
+    assert [e["percent"] for e in events] == [25.0, 37.5]
+    assert events[-1]["stage"] == "audio" and events[-1]["stage_percent"] == 50.0
+
+
+def test_progress_reporter_clamps_fraction_and_estimates_eta():
+    reporter, events = _reporter(["concat", "audio"], media_duration=10.0)
+    reporter.begin("concat")
+    reporter.emit("concat", 1.7, fps=30.0, speed=2.0)
+    assert events[-1]["stage_percent"] == 100.0 and events[-1]["percent"] == 50.0
+    # Phần còn lại của bước hiện tại (0) + 1 bước sau, mỗi bước 10s ở tốc độ 2x
+    assert events[-1]["eta_seconds"] == 5.0
+
+
+def test_progress_reporter_never_goes_backwards():
+    reporter, events = _reporter(["concat", "audio", "subtitles", "finalize"])
+    reporter.begin("subtitles")
+    reporter.emit("subtitles", 0.6)
+    # Chạy lại một bước trước (ví dụ concat dự phòng) và tiến độ bước mới về 0
+    reporter.begin("concat")
+    reporter.emit("concat", 0.9)
+    reporter.begin("subtitles")
+    reporter.emit("subtitles", 0.2)
+    percents = [e["percent"] for e in events]
+    assert percents == sorted(percents)
+    assert percents[-1] == 65.0
+    # stage_percent vẫn phản ánh bước hiện tại
+    assert events[-1]["stage_percent"] == 20.0
+
+
+def test_progress_reporter_sub_stages_do_not_add_their_own_percent():
+    reporter, events = _reporter(["concat", "audio"])
+    reporter.begin("audio")
+    for stage, fraction in [("normalize", 0.9), ("segment", 1.0), ("audio", 0.4), ("hls", 0.99)]:
+        reporter.emit(stage, fraction)
+    assert [e["percent"] for e in events] == [50.0, 50.0, 50.0, 70.0, 70.0]
+
+
+def test_progress_reporter_switching_pipelines_keeps_percent():
+    reporter, events = _reporter(["concat", "audio", "subtitles", "finalize"])
+    reporter.begin("audio")
+    reporter.emit("audio", 1.0)
+    # Chuyển sang pipeline dự phòng ít bước hơn, bắt đầu lại từ đầu
+    reporter.set_stages(["render", "finalize"])
+    reporter.begin("render")
+    reporter.emit("render", 0.5)
+    reporter.emit("render", 0.8)
+    # render 50%/80% của 2 bước = 25%/40% tổng -> giữ 50% cho tới khi vượt qua
+    reporter.emit("render", 1.0)
+    reporter.begin("finalize")
+    assert [e["percent"] for e in events] == [25.0, 50.0, 50.0, 50.0, 50.0, 50.0, 50.0]
+
+
+def test_progress_reporter_swallows_callback_errors():
+    def broken(progress):
+        raise RuntimeError("queue closed")
+
+    reporter = _ProgressReporter(broken, ["concat"], 1.0)
+    reporter.begin("concat")  # Không được làm hỏng lệnh render
+
+
+# --- Phụ đề chọn lọc: chia khoảng encode lại / stream copy ---
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0]
+
+
+def test_selective_ranges_widen_cue_windows_to_keyframes():
+    ranges = _plan_selective_ranges([(2.5, 3.5)], KEYFRAMES, 12.0)
+    assert ranges == [(0.0, 2.0, False), (2.0, 4.0, True), (4.0, 12.0, False)]
+
+
+def test_selective_ranges_merge_overlapping_and_adjacent_windows():
+    cues = [SubtitleCue(1, 4.2, 5.0, "a"), SubtitleCue(2, 5.5, 6.5, "b"), SubtitleCue(3, 9.0, 9.5, "c")]
+    ranges = _plan_selective_ranges(cue_windows(cues), KEYFRAMES, 12.0)
+    # Hai cửa sổ liền kề tại keyframe 8.0 được gộp thành một khoảng encode lại
+    assert ranges == [(0.0, 4.0, False), (4.0, 10.0, True), (10.0, 12.0, False)]
+
+
+def test_selective_ranges_cover_duration_and_copy_ranges_start_on_keyframes():
+    windows = [(0.5, 1.0), (7.1, 7.3), (11.0, 13.0)]
+    ranges = _plan_selective_ranges(windows, KEYFRAMES, 12.0)
+    assert ranges[0][0] == 0.0 and ranges[-1][1] == 12.0
+    for (_, previous_end, _), (start, _, _) in zip(ranges, ranges[1:]):
+        assert previous_end == start
+    assert all(start in KEYFRAMES for start, _, reencode in ranges if not reencode)
+    # Cue kéo dài quá cuối video bị cắt tại duration
+    assert ranges[-1] == (10.0, 12.0, True)
+
+
+def test_selective_ranges_ignore_cues_after_the_end():
+    assert _plan_selective_ranges([(20.0, 21.0)], KEYFRAMES, 12.0) == [(0.0, 12.0, False)]
+
+
+def test_burn_subtitle_ranges_encodes_only_cue_ranges_with_cumulative_progress(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_run_ffmpeg(stream_spec, stage, expected_duration=None, progress_offset=0.0, progress_total=None):
+        calls.append((" ".join(ffmpeg.compile(stream_spec)), stage, progress_offset, progress_total))
+
+    monkeypatch.setattr(video_processing, "_run_ffmpeg", fake_run_ffmpeg)
+    monkeypatch.setattr(video_processing, "TEMP_DIR", str(tmp_path))
+    _, probe = _clip(tmp_path, "in.mp4", 1280)
+    ranges = [(0.0, 4.0, False), (4.0, 8.0, True), (8.0, 10.0, False)]
+
+    video_processing._burn_subtitle_ranges(probe.path, "subs.srt", str(tmp_path / "out.mp4"), probe, ranges, 10.0)
+
+    pieces, final = calls[:-1], calls[-1]
+    assert [stage for _, stage, _, _ in pieces] == ["subtitles"] * 3
+    assert [(offset, total) for _, _, offset, total in pieces] == [(0.0, 10.0), (4.0, 10.0), (8.0, 10.0)]
+    assert ["subtitles=" in args for args, _, _, _ in pieces] == [False, True, False]
+    assert ["-vcodec copy" in args for args, _, _, _ in pieces] == [True, False, True]
+    assert final[1] == "subtitles_concat" and "-c copy" in final[0]
+
+
+# --- Chuẩn hóa clip cho concat c=copy ---
+def _clip(tmp_path, name, width):
+    path = tmp_path / name
+    path.write_bytes(name.encode())
+    stream = {"codec_type": "video", "codec_name": "h264", "profile": "High", "width": width, "height": 720,
+              "r_frame_rate": "30/1", "time_base": "1/15360", "pix_fmt": "yuv420p"}
+    return str(path), ProbeResult(path=str(path), duration=10.0, size=1, format_name="mov,mp4", streams=(stream,))
+
+
+@pytest.fixture
+def mismatched_clips(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_processing, "clip_cache", ClipCache(cache_dir=str(tmp_path / "cache")))
+    clips = [_clip(tmp_path, "a.mp4", 1280), _clip(tmp_path, "b.mp4", 1280), _clip(tmp_path, "c.mp4", 640)]
+    return [path for path, _ in clips], [probe for _, probe in clips]
+
+
+def _raise(error):
+    def normalize_clip(*args, **kwargs):
+        raise error
+    return normalize_clip
+
+
+def test_normalize_timeout_falls_back_to_reencode_concat(mismatched_clips, monkeypatch):
+    monkeypatch.setattr(video_processing, "normalize_clip", _raise(RenderTimeout("normalize timed out")))
+    assert _prepare_copy_concat(*mismatched_clips) == (False, {})
+
+
+def test_normalize_cancel_is_not_swallowed(mismatched_clips, monkeypatch):
+    monkeypatch.setattr(video_processing, "normalize_clip", _raise(RenderCancelled("cancelled")))
+    with pytest.raises(RenderCancelled):
+        _prepare_copy_concat(*mismatched_clips)
+
+
+# --- Thông số khung hình đích của render một lượt ---
+def test_render_target_uses_the_most_common_signature_not_the_first_clip(tmp_path):
+    probes = [_clip(tmp_path, name, width)[1] for name, width in (("a.mp4", 640), ("b.mp4", 1281), ("c.mp4", 1281))]
+    # 1281x720 -> làm tròn xuống kích thước chẵn cho yuv420p
+    assert video_processing._render_target_from_probes(probes) == (1280, 720, 30.0)
+
+
+def test_single_pass_frame_size_follows_the_compatibility_target(tmp_path, monkeypatch):
+    clips = [_clip(tmp_path, name, width) for name, width in (("small.mp4", 640), ("a.mp4", 1280), ("b.mp4", 1280))]
+    paths, probes = [path for path, _ in clips], [probe for _, probe in clips]
+    commands = []
+    monkeypatch.setattr(video_processing, "clip_cache", ClipCache(cache_dir=str(tmp_path / "cache")))
+    monkeypatch.setattr(video_processing, "_probe_video_files", lambda video_paths, hashes: (paths, [10.0] * 3, probes))
+    monkeypatch.setattr(video_processing, "analyze_audio", lambda path, content_hash=None: AudioInfo(20.0, "aac", 44100, 2))
+    monkeypatch.setattr(video_processing, "_run_ffmpeg",
+                        lambda stream_spec, **kwargs: commands.append(" ".join(ffmpeg.compile(stream_spec))))
+
+    video_processing.render_single_pass("audio.m4a", paths, "subs.srt", str(tmp_path / "out.mp4"), 20.0)
+
+    command, = commands
+    assert "scale=1280:720" in command and "pad=1280:720" in command
+    assert "640:720" not in command